@@ -3,6 +3,7 @@ using ChatBot.Server.Settings;
 using ChatBot.Server.Data;
 using Microsoft.AspNetCore.Diagnostics;
 using Microsoft.EntityFrameworkCore;
+using System.Net.Sockets;
 using System.Text.Json;
 
 var builder = WebApplication.CreateBuilder(args);
@@ -44,7 +45,31 @@ builder.Services.Configure<OpenRouterSettings>(
     builder.Configuration.GetSection("OpenRouter"));
 
 // Add services
-builder.Services.AddHttpClient<IPythonNlpService, PythonNlpService>();
+builder.Services.AddHttpClient<IPythonNlpService, PythonNlpService>()
+    .ConfigurePrimaryHttpMessageHandler(sp =>
+    {
+        // Same-host deployments can reach the NLP service over its Unix domain socket (serve --uds)
+        var socketPath = sp.GetRequiredService<IConfiguration>()["PythonNlpService:UnixSocketPath"];
+        if (string.IsNullOrEmpty(socketPath))
+            return new SocketsHttpHandler();
+        return new SocketsHttpHandler
+        {
+            ConnectCallback = async (context, cancellationToken) =>
+            {
+                var socket = new Socket(AddressFamily.Unix, SocketType.Stream, ProtocolType.Unspecified);
+                try
+                {
+                    await socket.ConnectAsync(new UnixDomainSocketEndPoint(socketPath), cancellationToken);
+                    return new NetworkStream(socket, ownsSocket: true);
+                }
+                catch
+                {
+                    socket.Dispose();
+                    throw;
+                }
+            }
+        };
+    });
 builder.Services.AddHttpClient<ILLMService, LLMService>((sp, client) =>
 {
     var config = sp.GetRequiredService<IConfiguration>();
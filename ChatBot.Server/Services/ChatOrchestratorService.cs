@@ -39,24 +39,19 @@ namespace ChatBot.Server.Services
                 fullChatHistory = await _chatHistoryRepository.GetChatHistoryBySessionAsync(sessionId);
             }
 
-            // Step 1: Store user message in semantic memory
-            if (!string.IsNullOrEmpty(sessionId))
-            {
-                await _semanticMemoryService.StoreMessageAsync(sessionId, userMessage, "user");
-            }
-
-            // Step 2: Classify intent
-            var classifiedIntent = await _intentService.ClassifyIntentAsync(userMessage);
-
-            // Step 3: Call Python NLP for direct answer
+            // Steps 1-3: one /turn call stores the user message, resolves coreference and returns
+            // the KB match, intent, entities and relevant history from a single analysis
             string prevBotResponse = fullChatHistory.LastOrDefault()?.BotResponse ?? string.Empty;
-            var nlpResult = await _pythonNlpService.AnalyzeAsync(userMessage, fullChatHistory, prevBotResponse);
-            if (nlpResult.HasValue && nlpResult.Value.ValueKind == JsonValueKind.Object)
+            var nlpResult = await _pythonNlpService.TurnAsync(
+                userMessage, string.IsNullOrEmpty(sessionId) ? null : sessionId, prevBotResponse, "entities", "relevant_history");
+            var turnResult = nlpResult.HasValue && nlpResult.Value.ValueKind == JsonValueKind.Object ? nlpResult.Value : (JsonElement?)null;
+            if (turnResult.HasValue)
             {
-                var root = nlpResult.Value;
+                var root = turnResult.Value;
                 if (root.TryGetProperty("source", out var sourceProp) && sourceProp.GetString() == "csv")
                 {
-                    var csvAnswer = root.TryGetProperty("answer", out var answerProp) ? answerProp.GetString() : null;
+                    var csvAnswer = root.TryGetProperty("kb", out var kbProp) && kbProp.ValueKind == JsonValueKind.Object
+                        && kbProp.TryGetProperty("answer", out var answerProp) ? answerProp.GetString() : null;
                     if (!string.IsNullOrWhiteSpace(csvAnswer))
                     {
                         // Step 3a: Rephrase with LLM
@@ -97,7 +92,9 @@ ERP answer: {csvAnswer}
             }
 
             // Step 4: Use semantic memory for context
-            var relevantHistoricalMessages = await _semanticMemoryService.GetRelevantHistoryAsync(userMessage, fullChatHistory);
+            var relevantHistoricalMessages = turnResult.HasValue && fullChatHistory.Any()
+                ? ReadRelevantHistory(turnResult.Value, fullChatHistory.First().SessionId)
+                : new List<ChatHistory>();
 
             // Step 5: Use LLM with context
             var historicalMessages = new List<object>();
@@ -153,8 +150,10 @@ ERP answer: {csvAnswer}
                 await _semanticMemoryService.StoreMessageAsync(sessionId, botResponse, "bot");
             }
 
-            // Step 6: Analyze intent and save history (placeholder)
-            var (intent, entities, confidence) = await _intentService.AnalyzeIntentAsync(userMessage, relevantHistoricalMessages);
+            // Step 6: Intent and entities from the same /turn analysis, then save history
+            var (intent, entities, confidence) = turnResult.HasValue
+                ? ReadIntent(turnResult.Value)
+                : ("general_query", new List<string>(), (double?)0.9);
 
             // Save chat history
             var chatEntry = new ChatHistory
@@ -171,5 +170,50 @@ ERP answer: {csvAnswer}
 
             return botResponse;
         }
+
+        private static List<ChatHistory> ReadRelevantHistory(JsonElement turn, string sessionId)
+        {
+            var results = new List<ChatHistory>();
+            if (!turn.TryGetProperty("relevant_history", out var historyProp) || historyProp.ValueKind != JsonValueKind.Array)
+                return results;
+            foreach (var item in historyProp.EnumerateArray())
+            {
+                var message = item.TryGetProperty("message", out var messageProp) ? messageProp.GetString() : null;
+                var role = item.TryGetProperty("role", out var roleProp) ? roleProp.GetString() : null;
+                var timestamp = item.TryGetProperty("timestamp", out var timestampProp) ? timestampProp.GetString() : null;
+                if (message != null && role != null && timestamp != null)
+                {
+                    results.Add(new ChatHistory
+                    {
+                        SessionId = sessionId,
+                        UserMessage = role == "user" ? message : "",
+                        BotResponse = role == "bot" ? message : "",
+                        Timestamp = DateTime.Parse(timestamp)
+                    });
+                }
+            }
+            return results;
+        }
+
+        private static (string intent, List<string> entities, double? confidence) ReadIntent(JsonElement turn)
+        {
+            string? intent = null;
+            double? confidence = null;
+            if (turn.TryGetProperty("intent", out var intentProp) && intentProp.ValueKind == JsonValueKind.Object)
+            {
+                intent = intentProp.TryGetProperty("intent", out var nameProp) ? nameProp.GetString() : null;
+                if (intentProp.TryGetProperty("confidence", out var confProp) && confProp.ValueKind == JsonValueKind.Number)
+                    confidence = confProp.GetDouble();
+            }
+            var entities = new List<string>();
+            if (turn.TryGetProperty("entities", out var entitiesProp) && entitiesProp.ValueKind == JsonValueKind.Object)
+            {
+                foreach (var ent in entitiesProp.EnumerateObject())
+                {
+                    entities.Add(ent.Value.GetString() ?? string.Empty);
+                }
+            }
+            return (intent ?? "general_query", entities, confidence ?? 0.9);
+        }
     }
 } 
\ No newline at end of file
@@ -8,5 +8,6 @@ namespace ChatBot.Server.Services
     public interface IPythonNlpService
     {
         Task<JsonElement?> AnalyzeAsync(string userMessage, List<ChatHistory> chatHistory, string prevBotResponse);
+        Task<JsonElement?> TurnAsync(string userMessage, string? sessionId, string prevBotResponse, params string[] include);
     }
 } 
\ No newline at end of file
@@ -5,6 +5,7 @@ using System.Text;
 using System.Text.Json;
 using System.Threading.Tasks;
 using ChatBot.Server.Models;
+using Microsoft.Extensions.Configuration;
 using Microsoft.Extensions.Logging;
 
 namespace ChatBot.Server.Services
@@ -14,11 +15,26 @@ namespace ChatBot.Server.Services
         private readonly HttpClient _httpClient;
         private readonly ILogger<PythonNlpService> _logger;
         private readonly string _analyzeUrl = "http://localhost:8000/analyze";
+        private readonly string _turnUrl = "http://localhost:8000/turn";
+        // Latency budget per call; the service skips optional stages it cannot fit (X-Deadline-Ms)
+        private readonly double? _deadlineMs;
 
-        public PythonNlpService(HttpClient httpClient, ILogger<PythonNlpService> logger)
+        public PythonNlpService(HttpClient httpClient, ILogger<PythonNlpService> logger, IConfiguration configuration)
         {
             _httpClient = httpClient;
             _logger = logger;
+            _deadlineMs = configuration.GetValue<double?>("PythonNlpService:DeadlineMs");
+        }
+
+        private Task<HttpResponseMessage> PostAsync(string url, object payload)
+        {
+            var request = new HttpRequestMessage(HttpMethod.Post, url)
+            {
+                Content = new StringContent(JsonSerializer.Serialize(payload), Encoding.UTF8, "application/json")
+            };
+            if (_deadlineMs.HasValue)
+                request.Headers.Add("X-Deadline-Ms", _deadlineMs.Value.ToString(System.Globalization.CultureInfo.InvariantCulture));
+            return _httpClient.SendAsync(request);
         }
 
         public async Task<JsonElement?> AnalyzeAsync(string userMessage, List<ChatHistory> chatHistory, string prevBotResponse)
@@ -27,8 +43,26 @@ namespace ChatBot.Server.Services
             {
                 var historyTexts = chatHistory?.OrderBy(h => h.Timestamp).Select(h => h.UserMessage).ToList() ?? new List<string>();
                 var payload = new { text = userMessage, history = historyTexts, prev_bot_response = prevBotResponse };
-                var content = new StringContent(JsonSerializer.Serialize(payload), Encoding.UTF8, "application/json");
-                var response = await _httpClient.PostAsync(_analyzeUrl, content);
+                var response = await PostAsync(_analyzeUrl, payload);
+                if (!response.IsSuccessStatusCode)
+                    return null;
+                var json = await response.Content.ReadAsStringAsync();
+                var doc = JsonDocument.Parse(json);
+                return doc.RootElement;
+            }
+            catch (Exception ex)
+            {
+                _logger.LogError(ex, "Error calling Python NLP service: {Message}", ex.Message);
+                return null;
+            }
+        }
+
+        public async Task<JsonElement?> TurnAsync(string userMessage, string? sessionId, string prevBotResponse, params string[] include)
+        {
+            try
+            {
+                var payload = new { text = userMessage, session_id = sessionId, prev_bot_response = prevBotResponse, include = include };
+                var response = await PostAsync(_turnUrl, payload);
                 if (!response.IsSuccessStatusCode)
                     return null;
                 var json = await response.Content.ReadAsStringAsync();
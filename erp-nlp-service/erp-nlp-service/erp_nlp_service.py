@@ -1,20 +1,41 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, StreamingResponse, Response, JSONResponse
 import spacy
+from spacy.vectors import Vectors
+from spacy.matcher import Matcher, PhraseMatcher
+from spacy.tokens import Span
+from spacy.util import filter_spans
 from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
 import pandas as pd
 import numpy as np
 import torch
 import json
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any, Union
+from typing import List, Optional, Dict, Any, Union, Callable
 import chromadb
 from chromadb.config import Settings
 from datetime import datetime
 import uuid
 import coreferee
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 import os
+import re
+import time
+import gc
+import asyncio
+import random
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager, closing
+import multiprocessing
+import sys
+import types
+import inference_worker
+from functools import lru_cache
+from collections import OrderedDict, deque
+from pathlib import Path
 
 app = FastAPI()
 
@@ -32,6 +53,12 @@ class IntentConfig:
     model_path: str
     lookup_csv_path: Optional[str] = None
     confidence_threshold: float = 0.5
+    fuzzy_threshold: float = 0.85
+    cascade_enabled: bool = True
+    cascade_target_precision: float = 0.95
+    cascade_margin_threshold: Optional[float] = None
+    shadow_fraction: float = 0.0  # > 0 keeps a new model_path in shadow mode until promoted
+    top_k_probabilities: int = 5  # intents (with probabilities) returned next to the prediction
     enabled: bool = True
 
 @dataclass
@@ -39,6 +66,60 @@ class SemanticConfig:
     similarity_threshold: float = 0.6
     max_history_results: int = 5
     use_coreference: bool = True
+    coref_context_sentences: int = 3  # trailing sentences of the previous bot reply given to coreference
+    coref_engine: str = "erp"  # "erp" (rule-based, per-session) or "coreferee"
+    embedding_backend: str = "spacy"  # "spacy" or "intent_model"
+    enabled: bool = True
+
+@dataclass
+class EntityConfig:
+    erp_model_path: str = "../../intent_training/erp_ner_model/model-best"
+    merge_mode: str = "erp"  # "erp", "generic" (en_core_web_lg OntoNotes labels) or "merged"
+    generic_labels: Optional[List[str]] = None  # generic labels kept when merging; None keeps all
+    rules_enabled: bool = True
+    rule_files: List[str] = field(default_factory=lambda: ["entity_patterns.json"])
+    enabled: bool = True
+
+@dataclass
+class MemoryConfig:
+    # The spaCy model is reloaded (after draining in-flight requests) when any limit is exceeded
+    max_new_strings: Optional[int] = 500000
+    max_requests: Optional[int] = None
+    max_rss_mb: Optional[float] = None
+    sample_interval_s: float = 30.0
+    drain_timeout_s: float = 30.0
+    enabled: bool = True
+
+@dataclass
+class ExecutionConfig:
+    # Blocking work runs on bounded thread pools so the event loop (and /health) stays responsive
+    model_workers: int = 2  # spaCy, torch and NumPy work
+    storage_workers: int = 4  # ChromaDB reads and writes
+    # > 0 moves parsing, embedding and intent inference to worker processes
+    inference_processes: int = field(default_factory=lambda: int(os.environ.get("NLP_INFERENCE_PROCESSES", "0")))
+    enabled: bool = True  # False runs everything inline on the event loop (the old behaviour)
+
+@dataclass
+class AdmissionConfig:
+    # Concurrent requests per endpoint; endpoints not listed are not limited (health, stats, ...)
+    max_concurrent: Dict[str, int] = field(default_factory=lambda: {
+        "/analyze": 8, "/analyze/stream": 4, "/turn": 8, "/classify_intent": 8, "/extract_entities": 8,
+        "/resolve_coref": 8, "/store_message": 8, "/get_relevant_history": 8})
+    # Requests over the limit wait in a queue of this size; a full queue or a longer wait is a 503
+    max_queued: int = 32
+    queue_timeout_s: float = 5.0
+    # Input caps, checked before anything is parsed (413 when exceeded)
+    max_body_bytes: int = 256 * 1024
+    max_text_chars: int = 4000  # text, prev_bot_response, last_user_message, message, query
+    max_history_items: int = 50
+    enabled: bool = True
+
+@dataclass
+class DeadlineConfig:
+    # With a budget (X-Deadline-Ms header or deadline_ms field) an optional stage only runs when
+    # the time left covers its recent average cost plus reserve_ms for the required stages
+    reserve_ms: float = 30.0
+    default_budget_ms: Optional[float] = None  # budget for callers that send none
     enabled: bool = True
 
 class AnalysisStrategy(Enum):
@@ -54,6 +135,11 @@ class Config:
         self.data_sources: List[DataSourceConfig] = []
         self.intent_config: Optional[IntentConfig] = None
         self.semantic_config = SemanticConfig()
+        self.memory_config = MemoryConfig()
+        self.entity_config = EntityConfig()
+        self.execution_config = ExecutionConfig()
+        self.admission_config = AdmissionConfig()
+        self.deadline_config = DeadlineConfig()
         self.default_strategy = AnalysisStrategy.HYBRID
         
     def add_data_source(self, config: DataSourceConfig):
@@ -68,63 +154,1553 @@ class Config:
 # Initialize global configuration
 config = Config()
 
-# Initialize ChromaDB for semantic memory
-chroma_client = chromadb.Client(Settings(
-    persist_directory="./chroma_db"  # Persistent storage for chat history
-))
-chat_collection = chroma_client.get_or_create_collection("chat_history")
+class WorkerPool:
+    """A bounded thread pool that records how long work waited for a worker and how long it ran.
 
-# Use spaCy's large model for all NLP tasks (embeddings, similarity, coreference)
-try:
-    nlp = spacy.load("en_core_web_lg")
-    print(f"[spaCy] Loaded model: {nlp.meta['name']} (version {nlp.meta['version']})")
-    if config.semantic_config.use_coreference:
+    call() runs inline when already on one of the pool's own threads (or when pools are
+    disabled), so nested calls never wait on a worker they are holding.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-pool")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.counts = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'queued': 0, 'running': 0,
+                       'queue_ms': 0.0, 'exec_ms': 0.0, 'max_queue_ms': 0.0}
+
+    def _execute(self, submitted: float, fn, args, kwargs):
+        started = time.perf_counter()
+        with self._lock:
+            self.counts['queued'] -= 1
+            self.counts['running'] += 1
+            queue_ms = (started - submitted) * 1000
+            self.counts['queue_ms'] += queue_ms
+            self.counts['max_queue_ms'] = max(self.counts['max_queue_ms'], queue_ms)
+        self._local.active = True
+        failed = False
         try:
-            nlp.add_pipe('coreferee')
+            return fn(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._local.active = False
+            with self._lock:
+                self.counts['running'] -= 1
+                self.counts['failed' if failed else 'completed'] += 1
+                self.counts['exec_ms'] += (time.perf_counter() - started) * 1000
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self.counts['submitted'] += 1
+            self.counts['queued'] += 1
+            executor = self._executor
+        return executor.submit(self._execute, time.perf_counter(), fn, args, kwargs)
+
+    def cancel(self, future) -> bool:
+        """Drop submitted work that has not started yet."""
+        if not future.cancel():
+            return False
+        with self._lock:
+            self.counts['queued'] -= 1
+            self.counts['cancelled'] += 1
+        return True
+
+    def on_worker(self) -> bool:
+        return getattr(self._local, 'active', False)
+
+    def call(self, fn, *args, **kwargs):
+        if not config.execution_config.enabled or self.on_worker():
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run(self, fn, *args, **kwargs):
+        if not config.execution_config.enabled:
+            return fn(*args, **kwargs)
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def resize(self, max_workers: int):
+        if max_workers == self.max_workers:
+            return
+        with self._lock:
+            previous, self._executor = self._executor, ThreadPoolExecutor(max_workers=max_workers,
+                                                                           thread_name_prefix=f"{self.name}-pool")
+            self.max_workers = max_workers
+        previous.shutdown(wait=False)  # work already queued there still runs
+
+    def shutdown(self):
+        """Finish queued work and stop the threads, before a fork (after_fork() starts new ones)."""
+        with self._lock:
+            executor = self._executor
+        executor.shutdown(wait=True)
+
+    def after_fork(self):
+        # Threads do not survive fork; the inherited executor would wait on workers that do not exist
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{self.name}-pool")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        done = counts['completed'] + counts['failed']
+        return {'workers': self.max_workers, **counts,
+                'mean_queue_ms': counts['queue_ms'] / done if done else 0.0,
+                'mean_exec_ms': counts['exec_ms'] / done if done else 0.0}
+
+model_pool = WorkerPool("model", config.execution_config.model_workers)
+storage_pool = WorkerPool("storage", config.execution_config.storage_workers)
+# spaCy grows the shared Vocab/StringStore while it tokenizes and is not documented as
+# thread-safe, so calls into one pipeline are serialised; torch, NumPy and Chroma work
+# on the other model workers proceeds meanwhile.
+nlp_lock = threading.RLock()
+
+stage_race_stats: Dict[str, Any] = {'races': 0, 'cancelled': 0, 'inline': 0, 'decided_by': {}}
+stage_race_lock = threading.Lock()  # races run on (and are read from) several model workers
+
+def stage_race_report() -> Dict[str, Any]:
+    with stage_race_lock:
+        return {**stage_race_stats, 'decided_by': dict(stage_race_stats['decided_by'])}
+
+class StageRace:
+    """Independent analysis stages started together on model_pool and read in priority order.
+
+    result(name) waits for one stage. A stage still queued is taken back and run by the caller,
+    so a model worker waiting on its stages never waits for a free model worker and the
+    model_workers limit holds. While the stage it needs runs elsewhere the caller runs other
+    queued ones, unless a decisive stage (one whose result can end the race) is unresolved: then
+    it blocks, so a decisive hit returns as soon as it is ready. cancel() drops the stages that
+    have not started and sets the cancelled event, which stages check before their expensive
+    steps (pass the request Deadline's, so its deadline.run() calls skip too). With pools
+    disabled each stage runs inline when it is first asked for, the old one-after-another order.
+    """
+    def __init__(self, stages: Dict[str, tuple], decisive: tuple = (), cancelled: Optional[threading.Event] = None):
+        self._stages = stages  # name -> (fn, *args), in priority order
+        self._decisive = set(decisive)
+        self.cancelled = cancelled or threading.Event()
+        self._results: Dict[str, Any] = {}
+        self._futures: Dict[str, Any] = {}
+        with stage_race_lock:
+            stage_race_stats['races'] += 1
+        if config.execution_config.enabled:
+            self._futures = {name: model_pool.submit(self._run_stage, name) for name in stages}
+
+    def _run_stage(self, name: str) -> Any:
+        # A worker that reaches a stage after the race was cancelled has nothing to do
+        if self.cancelled.is_set():
+            return None
+        fn, *args = self._stages[name]
+        return fn(*args)
+
+    def _run_inline(self, name: str) -> Any:
+        fn, *args = self._stages[name]
+        self._results[name] = fn(*args)
+        return self._results[name]
+
+    def _take_back(self, name: str) -> bool:
+        """Run a queued stage on the calling thread; False when it has already started."""
+        if not model_pool.cancel(self._futures[name]):
+            return False
+        with stage_race_lock:
+            stage_race_stats['inline'] += 1
+        self._run_inline(name)
+        return True
+
+    def result(self, name: str) -> Any:
+        if name in self._results:
+            return self._results[name]
+        future = self._futures.get(name)
+        if future is None:
+            return self._run_inline(name)
+        if self._take_back(name):
+            return self._results[name]
+        if not any(stage not in self._results for stage in self._decisive):
+            for other in self._futures:
+                if future.done():
+                    break
+                if other not in self._results:
+                    self._take_back(other)
+        self._results[name] = future.result()
+        return self._results[name]
+
+    def first_decisive(self, checks: List[tuple]) -> tuple:
+        """(name, result) of the first stage whose result passes its check (None always passes)."""
+        self._decisive.update(name for name, decisive in checks if decisive is not None)
+        for name, decisive in checks:
+            result = self.result(name)
+            if decisive is None or decisive(result):
+                with stage_race_lock:
+                    stage_race_stats['decided_by'][name] = stage_race_stats['decided_by'].get(name, 0) + 1
+                self.cancel()
+                return name, result
+        return None, None
+
+    def cancel(self):
+        self.cancelled.set()
+        for name, future in self._futures.items():
+            if name not in self._results and model_pool.cancel(future):
+                with stage_race_lock:
+                    stage_race_stats['cancelled'] += 1
+
+@contextmanager
+def _main_module_hidden():
+    # Spawned children re-import __main__; the service module must not start up again in them
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+class InferenceProcessPool:
+    """Optional worker processes for spaCy parsing, embedding and intent inference.
+
+    Threads share one GIL, so the model pool cannot use more than about one core for
+    spaCy and tokenizer work. Each worker process loads its own models at start-up
+    (inference_worker.init_worker); vectors come back through shared memory. Calls made
+    while the pool is off, starting or broken return None and the caller runs in-process.
+    """
+
+    TASKS = ("embed", "intent", "entities")
+    START_TIMEOUT_S = 300
+
+    def __init__(self):
+        self.processes = 0
+        self.state = 'off'  # off | starting | ready | failed
+        self.error: Optional[str] = None
+        self.intent_model_path: Optional[str] = None
+        self.intent_model_version: Optional[int] = None  # registry version the workers loaded
+        self.pids: List[int] = []
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.counts = {task: {'calls': 0, 'items': 0, 'ms': 0.0, 'fallbacks': 0} for task in self.TASKS}
+
+    @property
+    def active(self) -> bool:
+        return self.state == 'ready'
+
+    def serves(self, version: int) -> bool:
+        # Keyed on the registry version: a retrain written over the same path is another model
+        return self.active and self.intent_model_version == version
+
+    def start(self, processes: int, spacy_model: str, intent_model_path: Optional[str] = None,
+              intent_model_version: Optional[int] = None, background: bool = True):
+        self.stop()
+        if processes <= 0:
+            return
+        with self._lock:
+            self.state, self.error, self.processes = 'starting', None, processes
+        if background:
+            threading.Thread(target=self._start, args=(processes, spacy_model, intent_model_path, intent_model_version),
+                             name="inference-process-start", daemon=True).start()
+        else:
+            self._start(processes, spacy_model, intent_model_path, intent_model_version)
+
+    def _start(self, processes, spacy_model, intent_model_path, intent_model_version):
+        start = time.perf_counter()
+        try:
+            context = multiprocessing.get_context("spawn")
+            ready = context.Queue()
+            executor = ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                           initializer=inference_worker.init_worker,
+                                           initargs=(spacy_model, intent_model_path, 1, ready))
+            # The executor spawns on demand: one task per worker while none is idle yet starts
+            # them all now; each reports its pid once its models are loaded
+            with _main_module_hidden():
+                futures = [executor.submit(inference_worker.ping) for _ in range(processes)]
+            pids = sorted(ready.get(timeout=self.START_TIMEOUT_S) for _ in range(processes))
+            for future in futures:
+                future.result()
+        except Exception as e:
+            with self._lock:
+                self.state, self.error = 'failed', str(e)
+            print(f"[Inference] Error starting {processes} worker process(es): {e}")
+            return
+        with self._lock:
+            self._executor, self.pids, self.intent_model_path = executor, pids, intent_model_path
+            self.intent_model_version = intent_model_version
+            self.state = 'ready'
+        print(f"[Inference] {processes} worker process(es) ready in {time.perf_counter() - start:.1f}s: {pids}")
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self.state, self.pids, self.processes = 'off', [], 0
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _call(self, task: str, items: int, fn, *args):
+        executor = self._executor
+        if executor is None or not self.active:
+            return None
+        start = time.perf_counter()
+        try:
+            result = executor.submit(fn, *args).result()
+        except Exception as e:
+            with self._lock:
+                self.counts[task]['fallbacks'] += 1
+                if self._executor is executor and getattr(executor, '_broken', False):
+                    self.state, self.error = 'failed', str(e)
+            print(f"[Inference] {task} failed in a worker process, running in-process: {e}")
+            return None
+        with self._lock:
+            counts = self.counts[task]
+            counts['calls'] += 1
+            counts['items'] += items
+            counts['ms'] += (time.perf_counter() - start) * 1000
+        return result
+
+    def embed(self, texts: List[str]) -> Optional[np.ndarray]:
+        result = self._call("embed", len(texts), inference_worker.embed, list(texts))
+        return inference_worker.read_shared(*result) if result else None
+
+    def intent_forward(self, texts: List[str]):
+        result = self._call("intent", len(texts), inference_worker.intent_forward, list(texts))
+        if not result:
+            return None
+        name, shape, labels = result
+        block = inference_worker.read_shared(name, shape)
+        return torch.from_numpy(np.ascontiguousarray(block[:, :labels])), np.ascontiguousarray(block[:, labels:])
+
+    def entities(self, text: str) -> Optional[List[Dict[str, Any]]]:
+        return self._call("entities", 1, inference_worker.entities, str(text))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'state': self.state, 'processes': self.processes, 'pids': list(self.pids),
+                    'intent_model_path': self.intent_model_path, 'intent_model_version': self.intent_model_version,
+                    'error': self.error,
+                    **{task: {**counts, 'mean_ms': counts['ms'] / counts['calls'] if counts['calls'] else 0.0}
+                       for task, counts in self.counts.items()}}
+
+inference_processes = InferenceProcessPool()
+
+# ChromaDB for semantic memory. The client is opened on first use in each process, so a
+# preforked server (serve --preload) never carries one across a fork.
+_chroma = {'pid': None, 'client': None, 'collections': {}}
+_chroma_lock = threading.Lock()
+
+def chroma_client():
+    with _chroma_lock:
+        if _chroma['pid'] != os.getpid():
+            _chroma['client'] = chromadb.Client(Settings(
+                persist_directory="./chroma_db"  # Persistent storage for chat history
+            ))
+            _chroma['pid'], _chroma['collections'] = os.getpid(), {}
+        return _chroma['client']
+
+# Use spaCy's large model for all NLP tasks (embeddings, similarity, coreference). A copy with
+# the vectors table pruned to the ERP vocabulary (prune-vectors) is used when it has been built.
+SPACY_BASE_MODEL = "en_core_web_lg"
+PRUNED_MODEL_DIR = "models/en_core_web_lg_erp"
+SPACY_MODEL = os.environ.get("NLP_SPACY_MODEL") or (PRUNED_MODEL_DIR if os.path.isdir(PRUNED_MODEL_DIR) else SPACY_BASE_MODEL)
+NER_TRAINING_DATA_PATH = "../../intent_training/erp_ner_training_data.json"
+def load_spacy_model():
+    load_start = time.perf_counter()
+    model = spacy.load(SPACY_MODEL)
+    print(f"[spaCy] Loaded model: {model.meta['name']} (version {model.meta['version']}) from {SPACY_MODEL} "
+          f"in {time.perf_counter() - load_start:.1f}s, vectors {model.vocab.vectors.shape}")
+    if config.semantic_config.use_coreference and config.semantic_config.coref_engine == "coreferee":
+        try:
+            model.add_pipe('coreferee')
             print("[spaCy] coreferee pipeline added successfully to en_core_web_lg.")
         except Exception as e:
             print(f"[spaCy] Error adding coreferee pipeline: {e}")
+    return model
+
+try:
+    nlp = load_spacy_model()
 except Exception as e:
     print(f"[spaCy] Error loading model or setting up coreferee: {e}")
     raise
 
-# Load fine-tuned intent classifier
+# Named pipeline profiles over the one loaded model. Each task parses with the profile it
+# needs; the others' components are disabled per call (nlp(text, disable=...) leaves the
+# shared pipeline untouched, so concurrent requests with different profiles are safe).
+#   embedding   - tokenizer only; Doc.vector comes from the static vectors table
+#   ner         - NER (plus tok2vec only if NER listens to it)
+#   analysis    - everything but coreferee: entities, sentences, vectors
+#   coreference - the full pipeline including coreferee
+PIPELINE_PROFILES = ("embedding", "ner", "analysis", "coreference")
+profile_stats = {profile: {'docs': 0, 'ms': 0.0} for profile in PIPELINE_PROFILES}
+
+@lru_cache(maxsize=8)
+def _profile_disabled(profile: str, pipe_names: tuple) -> List[str]:
+    if profile == "coreference":
+        return []
+    if profile == "analysis":
+        return [name for name in pipe_names if name == "coreferee"]
+    if profile == "ner":
+        keep = {"ner"}
+        if "tok2vec" in pipe_names and "ner" in nlp.get_pipe("tok2vec").listening_components:
+            keep.add("tok2vec")
+        return [name for name in pipe_names if name not in keep]
+    raise ValueError(f"Unknown pipeline profile '{profile}'")
+
+def parse(text: str, profile: str):
+    start = time.perf_counter()
+    if profile == "embedding":
+        with nlp_lock:
+            doc = nlp.make_doc(str(text))
+    else:
+        with nlp_lock:
+            doc = nlp(str(text), disable=_profile_disabled(profile, tuple(nlp.pipe_names)))
+    profile_stats[profile]['docs'] += 1
+    profile_stats[profile]['ms'] += (time.perf_counter() - start) * 1000
+    return doc
+
+def parse_many(texts: List[str], profile: str, batch_size: int = 256):
+    texts = [str(t) for t in texts]
+    start = time.perf_counter()
+    with nlp_lock:
+        if profile == "embedding":
+            docs = list(nlp.tokenizer.pipe(texts, batch_size=batch_size))
+        else:
+            docs = list(nlp.pipe(texts, batch_size=batch_size,
+                                 disable=_profile_disabled(profile, tuple(nlp.pipe_names))))
+    profile_stats[profile]['docs'] += len(docs)
+    profile_stats[profile]['ms'] += (time.perf_counter() - start) * 1000
+    return docs
+
+def profile_stats_report() -> Dict[str, Any]:
+    return {
+        profile: {**counts, 'mean_ms': counts['ms'] / counts['docs'] if counts['docs'] else 0.0,
+                  'components': [n for n in nlp.pipe_names if profile != "embedding"
+                                 and n not in _profile_disabled(profile, tuple(nlp.pipe_names))]}
+        for profile, counts in profile_stats.items()
+    }
+
+def benchmark_profiles(texts: List[str], repeats: int = 3) -> Dict[str, Any]:
+    """Milliseconds per doc for each profile over the same texts (best of a few runs)."""
+    report = {'texts': len(texts), 'pipeline': list(nlp.pipe_names)}
+    for profile in PIPELINE_PROFILES:
+        if profile == "coreference" and "coreferee" not in nlp.pipe_names:
+            continue
+        single, batched = [], []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for text in texts:
+                parse(text, profile)
+            single.append((time.perf_counter() - start) * 1000 / len(texts))
+            start = time.perf_counter()
+            parse_many(texts, profile)
+            batched.append((time.perf_counter() - start) * 1000 / len(texts))
+        report[profile] = {'ms_per_doc': min(single), 'ms_per_doc_batched': min(batched)}
+    full = report.get('analysis', {}).get('ms_per_doc')
+    if full:
+        for profile in PIPELINE_PROFILES:
+            if profile in report:
+                report[profile]['speedup_vs_analysis'] = full / report[profile]['ms_per_doc']
+    return report
+
+class StaticVectorEmbedder:
+    """Doc.vector for a whole batch in one NumPy pass: tokenizer only, no Doc per text.
+
+    Token orth ids are mapped to vector-table rows with a sorted-key search, gathered, and
+    averaged per text with reduceat. Like Doc.vector, tokens without a vector count as zeros
+    and an empty text gives a zero vector, so the result matches the vectors already stored.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.reload()
+
+    def reload(self):
+        """Re-read the vectors table (after the model's vectors change, e.g. pruning)."""
+        vectors = self.model.vocab.vectors
+        self.table = vectors.data
+        self.width = vectors.shape[1]
+        keys = np.fromiter(vectors.key2row.keys(), dtype=np.uint64, count=len(vectors.key2row))
+        rows = np.fromiter(vectors.key2row.values(), dtype=np.int64, count=len(vectors.key2row))
+        order = np.argsort(keys)
+        self.keys, self.rows = keys[order], rows[order]
+
+    def _lookup(self, orths: np.ndarray) -> np.ndarray:
+        if not len(self.keys):
+            return np.full(len(orths), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.keys, orths), len(self.keys) - 1)
+        return np.where(self.keys[positions] == orths, self.rows[positions], -1)
+
+    def embed(self, texts: List[str], batch_size: int = 1024, normalize: bool = False) -> np.ndarray:
+        texts = [str(t) for t in texts]
+        out = np.zeros((len(texts), self.width), dtype=np.float32)
+        for offset in range(0, len(texts), batch_size):
+            with nlp_lock:
+                docs = list(self.model.tokenizer.pipe(texts[offset:offset + batch_size]))
+            lengths = np.array([len(doc) for doc in docs], dtype=np.int64)
+            if not lengths.sum():
+                continue
+            orths = np.concatenate([doc.to_array("ORTH").astype(np.uint64) for doc in docs if len(doc)])
+            rows = self._lookup(orths)
+            gathered = self.table[np.maximum(rows, 0)]
+            gathered[rows < 0] = 0.0
+            nonempty = np.flatnonzero(lengths)
+            starts = np.concatenate(([0], np.cumsum(lengths[nonempty])[:-1]))
+            sums = np.add.reduceat(gathered, starts, axis=0)
+            out[offset + nonempty] = sums / lengths[nonempty, None]
+        if normalize:
+            out = CentroidIntentClassifier._normalize_rows(out)
+        return out
+
+    def benchmark(self, texts: List[str]) -> Dict[str, Any]:
+        """Per-Doc vs batched timing and the largest difference from Doc.vector."""
+        list(self.model.tokenizer.pipe(texts))  # warm the tokenizer cache for both runs
+        start = time.perf_counter()
+        reference = np.array([nlp.make_doc(t).vector for t in texts], dtype=np.float32)
+        doc_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        batched = self.embed(texts)
+        batch_ms = (time.perf_counter() - start) * 1000
+        return {
+            'texts': len(texts),
+            'doc_vector_ms': doc_ms,
+            'batched_ms': batch_ms,
+            'speedup': doc_ms / batch_ms if batch_ms else None,
+            'max_abs_diff': float(np.abs(reference - batched).max()) if len(texts) else 0.0
+        }
+
+static_embedder = StaticVectorEmbedder(nlp)
+
+# Memory: every parse of unseen text adds strings to the shared Vocab/StringStore, which never
+# shrink. Track them with process RSS and, past a threshold, swap in a freshly loaded copy of
+# the model once in-flight requests have drained.
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def process_rss_mb() -> Optional[float]:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def process_memory_breakdown(pid: Union[int, str] = "self") -> Optional[Dict[str, float]]:
+    """RSS split into pages shared with other processes (e.g. copy-on-write from a preloading
+    parent) and private ones, plus PSS (shared pages divided by their sharers). Linux only."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f if line.split()[-1] == "kB"}
+    except (OSError, ValueError, IndexError):
+        return None
+    return {
+        'rss_mb': fields.get('Rss', 0) / 1024,
+        'pss_mb': fields.get('Pss', 0) / 1024,
+        'shared_mb': (fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)) / 1024,
+        'private_mb': (fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024,
+    }
+
+class RequestGate:
+    """Counts in-flight requests and can hold new ones back while the model is swapped.
+
+    enter() runs on the event loop; drain() and reopen() run on the memory monitor's thread,
+    so held-back requests wait on futures that reopen() resolves through their loop.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._open = True
+        self._waiters: List[asyncio.Future] = []
+
+    async def enter(self):
+        while True:
+            with self._lock:
+                if self._open:
+                    self.in_flight += 1
+                    self.requests += 1
+                    return
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def exit(self):
+        with self._lock:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.notify_all()
+
+    def drain(self, timeout_s: float) -> bool:
+        with self._lock:
+            self._open = False
+            return self._idle.wait_for(lambda: self.in_flight == 0, timeout_s)
+
+    def reopen(self):
+        with self._lock:
+            self._open = True
+            waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            try:
+                waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:  # its loop has closed
+                pass
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+request_gate = RequestGate()
+
+class EndpointAdmission:
+    """Concurrency limit and bounded FIFO wait queue for one endpoint (AdmissionConfig).
+
+    Runs on the event loop only. A finishing request hands its slot straight to the oldest
+    waiter, so a burst is served in arrival order and in_flight never exceeds the limit.
+    """
+    def __init__(self):
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.mean_ms = 0.0  # moving average of admitted request time, for Retry-After
+        self._waiters: deque = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, limit: int, max_queued: int, timeout_s: float) -> bool:
+        if self.in_flight < limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= max_queued:
+            self.rejected += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait([waiter], timeout=timeout_s)
+        except asyncio.CancelledError:  # the client went away while queued
+            self._leave(waiter, limit)
+            raise
+        if not waiter.done():
+            self._leave(waiter, limit)
+            self.timed_out += 1
+            self.rejected += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def _leave(self, waiter: asyncio.Future, limit: int):
+        if waiter.done():
+            self.release(limit)  # a slot was handed over just as the wait ended
+        else:
+            self._waiters.remove(waiter)
+            waiter.cancel()
+
+    def release(self, limit: int, elapsed_ms: Optional[float] = None):
+        if elapsed_ms is not None:
+            self.mean_ms = elapsed_ms if not self.mean_ms else 0.9 * self.mean_ms + 0.1 * elapsed_ms
+        if self._waiters and self.in_flight <= limit:
+            self._waiters.popleft().set_result(True)  # in_flight stays the same: the slot moves on
+        else:
+            self.in_flight -= 1
+
+    def retry_after_s(self, limit: int) -> int:
+        """Time for the queue ahead to drain at the recent request rate, at least one second."""
+        return max(1, math.ceil(self.mean_ms * (self.queued + 1) / max(limit, 1) / 1000))
+
+    def stats(self, limit: int) -> Dict[str, Any]:
+        return {'limit': limit, 'in_flight': self.in_flight, 'queued': self.queued, 'admitted': self.admitted,
+                'rejected': self.rejected, 'timed_out': self.timed_out, 'mean_ms': self.mean_ms}
+
+admission: Dict[str, EndpointAdmission] = {}
+admission_stats = {'oversized': 0}
+
+INPUT_TEXT_FIELDS = ("text", "prev_bot_response", "last_user_message", "message", "query")
+
+def oversized_input(request: Any) -> Optional[str]:
+    """Why a request's inputs exceed the AdmissionConfig caps, or None. Checked before any parsing."""
+    limits = config.admission_config
+    if not limits.enabled:
+        return None
+    values = request if isinstance(request, dict) else {name: getattr(request, name, None) for name in
+                                                        INPUT_TEXT_FIELDS + ("history",)}
+    for name in INPUT_TEXT_FIELDS:
+        value = values.get(name)
+        if isinstance(value, str) and len(value) > limits.max_text_chars:
+            return f"{name} has {len(value)} characters; the limit is {limits.max_text_chars}"
+    history = values.get("history") or []
+    if len(history) > limits.max_history_items:
+        return f"history has {len(history)} items; the limit is {limits.max_history_items}"
+    if any(len(str(item)) > limits.max_text_chars for item in history):
+        return f"a history item is longer than {limits.max_text_chars} characters"
+    return None
+
+def input_rejection(reason: str) -> JSONResponse:
+    admission_stats['oversized'] += 1
+    return JSONResponse({"status": "error", "message": reason}, status_code=413)
+
+async def read_body_capped(request: Request, max_bytes: int) -> Optional[bytes]:
+    """The request body, or None as soon as more than max_bytes have arrived."""
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            return None
+        chunks.append(chunk)
+    # Cached where Request.body() keeps it, so the endpoint reads it without another receive
+    request._body = b"".join(chunks)
+    return request._body
+
+async def _release_after(body_iterator, release):
+    # Streamed responses (/analyze/stream) keep their slot and their place in the request gate
+    # until the last chunk is sent
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        release()
+
+def admission_report() -> Dict[str, Any]:
+    limits = config.admission_config
+    return {**admission_stats, 'enabled': limits.enabled, 'max_queued': limits.max_queued,
+            'in_flight': sum(a.in_flight for a in admission.values()),
+            'queued': sum(a.queued for a in admission.values()),
+            'rejected': sum(a.rejected for a in admission.values()),
+            'endpoints': {path: admission[path].stats(limit) for path, limit in limits.max_concurrent.items()
+                          if path in admission}}
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    request.state.received_at = time.monotonic()  # latency budgets include time spent queued
+    # The memory endpoints must not wait on (or count towards) a drain they may have started
+    if request.url.path.startswith("/memory"):
+        return await call_next(request)
+    limits = config.admission_config
+    path = request.url.path
+    limit = limits.max_concurrent.get(path) if limits.enabled else None
+    if limit is None:
+        await request_gate.enter()
+        try:
+            response = await call_next(request)
+        except BaseException:
+            request_gate.exit()
+            raise
+        # A streamed body is still running analysis; a memory reset must wait for its last chunk
+        response.body_iterator = _release_after(response.body_iterator, request_gate.exit)
+        return response
+
+    # Size cap on the raw body, before it is decoded; the declared length is checked first, and
+    # the cap is enforced while reading since chunked uploads declare none
+    try:
+        declared = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        return JSONResponse({"status": "error", "message": "Invalid Content-Length header"}, status_code=400)
+    if declared > limits.max_body_bytes or await read_body_capped(request, limits.max_body_bytes) is None:
+        return input_rejection(f"Request body is larger than {limits.max_body_bytes} bytes")
+    endpoint = admission.setdefault(path, EndpointAdmission())
+    if not await endpoint.acquire(limit, limits.max_queued, limits.queue_timeout_s):
+        return JSONResponse({"status": "error", "message": f"{path} is at capacity; retry later"}, status_code=503,
+                            headers={"Retry-After": str(endpoint.retry_after_s(limit))})
+    start = time.perf_counter()
+    released = []
+
+    def release():
+        if not released:
+            released.append(True)
+            request_gate.exit()
+            endpoint.release(limit, (time.perf_counter() - start) * 1000)
+
+    try:
+        await request_gate.enter()
+    except BaseException:  # the client went away while a memory reset held it back
+        endpoint.release(limit)
+        raise
+    try:
+        response = await call_next(request)
+    except BaseException:
+        release()
+        raise
+    response.body_iterator = _release_after(response.body_iterator, release)
+    return response
+
+class MemoryMonitor:
+    def __init__(self, max_samples: int = 720):
+        self.samples: deque = deque(maxlen=max_samples)
+        self.resets: List[Dict[str, Any]] = []
+        self.drain_timeouts = 0
+        self._mark_baseline()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def _mark_baseline(self):
+        self.baseline_strings = {name: (id(vocab), len(vocab.strings)) for name, vocab in tracked_vocabs().items()}
+        self.baseline_requests = request_gate.requests
+        self.loaded_at = time.time()
+
+    def _new_strings(self, vocabs: Dict[str, Any]) -> int:
+        total = 0
+        for name, vocab in vocabs.items():
+            vocab_id, baseline = self.baseline_strings.get(name, (None, 0))
+            if vocab_id != id(vocab):
+                # First seen, or replaced since (/configure loaded another ERP NER or rule set)
+                self.baseline_strings[name] = (id(vocab), len(vocab.strings))
+                continue
+            total += len(vocab.strings) - baseline
+        return total
+
+    def sample(self) -> Dict[str, Any]:
+        vocabs = tracked_vocabs()
+        sample = {
+            'time': datetime.utcnow().isoformat(),
+            'rss_mb': process_rss_mb(),
+            'strings': sum(len(vocab.strings) for vocab in vocabs.values()),
+            'vocab': sum(len(vocab) for vocab in vocabs.values()),
+            'new_strings': self._new_strings(vocabs),
+            'strings_by_vocab': {name: len(vocab.strings) for name, vocab in vocabs.items()},
+            'requests': request_gate.requests,
+            'in_flight': request_gate.in_flight
+        }
+        self.samples.append(sample)
+        return sample
+
+    def reset_reason(self, sample: Dict[str, Any]) -> Optional[str]:
+        memory_config = config.memory_config
+        if not memory_config.enabled:
+            return None
+        if memory_config.max_new_strings and sample['new_strings'] > memory_config.max_new_strings:
+            return f"{sample['new_strings']} strings added since load"
+        if memory_config.max_requests and sample['requests'] - self.baseline_requests >= memory_config.max_requests:
+            return f"{sample['requests'] - self.baseline_requests} requests since load"
+        if memory_config.max_rss_mb and sample['rss_mb'] and sample['rss_mb'] > memory_config.max_rss_mb:
+            return f"RSS {sample['rss_mb']:.0f} MB above {memory_config.max_rss_mb} MB"
+        return None
+
+    def reset_model(self, reason: str) -> Dict[str, Any]:
+        """Load fresh copies of every tracked pipeline, drain in-flight requests, then swap them in."""
+        global nlp, erp_ner, erp_entity_ruler
+        before = self.sample()
+        start = time.perf_counter()
+        fresh = load_spacy_model()
+        fresh_erp_ner = load_erp_ner(config.entity_config.erp_model_path) if erp_ner is not None else None
+        fresh_ruler = load_entity_ruler(config.entity_config) if erp_entity_ruler is not None else None
+        load_s = time.perf_counter() - start
+        if not request_gate.drain(config.memory_config.drain_timeout_s):
+            request_gate.reopen()
+            self.drain_timeouts += 1
+            print(f"[Memory] Model reset skipped ({reason}): requests did not drain in time")
+            return {'status': 'drain_timeout', 'reason': reason}
+        try:
+            nlp = fresh
+            erp_ner, erp_entity_ruler = fresh_erp_ner, fresh_ruler
+            static_embedder.model = fresh
+            static_embedder.reload()
+            _profile_disabled.cache_clear()
+            self._mark_baseline()
+        finally:
+            request_gate.reopen()
+        gc.collect()
+        after = self.sample()
+        event = {
+            'time': after['time'], 'reason': reason, 'load_seconds': load_s,
+            'strings_before': before['strings'], 'strings_after': after['strings'],
+            'rss_mb_before': before['rss_mb'], 'rss_mb_after': after['rss_mb']
+        }
+        self.resets.append(event)
+        print(f"[Memory] Reloaded spaCy pipelines ({reason}): strings {before['strings']} -> {after['strings']}")
+        return event
+
+    def _run(self):
+        while not self._stopped.wait(config.memory_config.sample_interval_s):
+            try:
+                reason = self.reset_reason(self.sample())
+                if reason:
+                    self.reset_model(reason)
+            except Exception as e:
+                print(f"[Memory] Monitor error: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="memory-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            thread.join()  # waits for a reset in progress
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'current': self.samples[-1] if self.samples else self.sample(),
+            'baseline_strings': {name: count for name, (_, count) in self.baseline_strings.items()},
+            'model_age_s': time.time() - self.loaded_at,
+            'resets': self.resets[-20:],
+            'drain_timeouts': self.drain_timeouts,
+            'pages': process_memory_breakdown(),
+            'pid': os.getpid(),
+            'samples': list(self.samples)
+        }
+
+def render_memory_svg(samples: List[Dict[str, Any]], width: int = 720, height: int = 160) -> str:
+    """One inline SVG line chart per tracked value."""
+    charts = []
+    for key, label in (('rss_mb', 'RSS (MB)'), ('strings', 'StringStore size'), ('vocab', 'Vocab size')):
+        values = [s[key] for s in samples if s.get(key) is not None]
+        if len(values) < 2:
+            charts.append(f"<h3>{label}</h3><p>not enough samples</p>")
+            continue
+        low, high = min(values), max(values)
+        span = (high - low) or 1
+        points = " ".join(
+            f"{i * width / (len(values) - 1):.1f},{height - (v - low) * (height - 10) / span - 5:.1f}"
+            for i, v in enumerate(values))
+        charts.append(
+            f"<h3>{label}: {values[-1]:.0f} (min {low:.0f}, max {high:.0f})</h3>"
+            f"<svg width='{width}' height='{height}' style='border:1px solid #ccc'>"
+            f"<polyline fill='none' stroke='#1f77b4' stroke-width='2' points='{points}'/></svg>")
+    return "<html><body><h2>NLP service memory</h2>" + "".join(charts) + "</body></html>"
+
+# Fine-tuned intent classifier, served through a versioned registry
 INTENT_MODEL_PATH = "intent_model"
-intent_tokenizer = AutoTokenizer.from_pretrained(INTENT_MODEL_PATH)
-intent_model = AutoModelForSequenceClassification.from_pretrained(INTENT_MODEL_PATH)
-with open(f"{INTENT_MODEL_PATH}/id2intent.json", "r") as f:
-    id2intent = json.load(f)
 
-# Load CSV and compute spaCy docs for semantic search (use nlp with vectors)
+@dataclass
+class IntentModelVersion:
+    version: int
+    model_path: str
+    tokenizer: Any
+    model: Any
+    id2intent: Dict[str, str]
+    loaded_at: str
+    load_seconds: float = 0.0
+    kb_vectors: Optional[Dict[str, np.ndarray]] = None  # prepared KB embeddings when serving the intent_model backend
+    chat_vectors: Optional[tuple] = None  # (ids, embeddings) of the intent_model chat collection, prepared before promotion
+    chat_written: Optional[set] = None  # chat message ids written with this version before its swap
+
+    def __post_init__(self):
+        # Per-version cache: intent and embedding share one forward pass, and a swap never serves stale logits
+        self.forward = lru_cache(maxsize=1024)(self._forward)
+        # Fast (Rust) tokenizers raise "Already borrowed" when one instance is used from two threads
+        self.tokenizer_lock = threading.Lock()
+
+    def forward_batch(self, texts: List[str]):
+        """One intent-model pass: returns (logits, L2-normalised mean-pooled last hidden states)."""
+        if inference_processes.serves(self.version):
+            result = inference_processes.intent_forward(texts)
+            if result is not None:
+                return result
+        with self.tokenizer_lock:
+            inputs = self.tokenizer(list(texts), return_tensors="pt", truncation=True, padding=True, max_length=64)
+        with torch.no_grad():
+            outputs = self.model(**inputs, output_hidden_states=True)
+        pooled = inference_worker.mean_pooled(outputs.hidden_states[-1], inputs['attention_mask'])
+        return outputs.logits, pooled.numpy()
+
+    def _forward(self, text: str):
+        logits, pooled = self.forward_batch([text])
+        return logits, pooled[0]
+
+    def info(self) -> Dict[str, Any]:
+        return {'version': self.version, 'model_path': self.model_path, 'intents': len(self.id2intent),
+                'loaded_at': self.loaded_at, 'load_seconds': self.load_seconds}
+
+class IntentModelRegistry:
+    """One active intent model plus at most one candidate, loaded in the background.
+
+    A candidate can shadow a sampled fraction of live traffic (agreement and latency are
+    recorded off the request path) before it is promoted. Promotion first runs before_promote
+    (writing what the candidate prepared), outside the lock; if that fails the candidate stays
+    loaded and nothing is swapped. Then the active reference is swapped atomically, so every
+    endpoint picks up the new version on its next call, and on_promote runs.
+    """
+
+    MAX_PENDING_SHADOW = 32
+
+    def __init__(self):
+        self.active: Optional[IntentModelVersion] = None
+        self.candidate: Optional[IntentModelVersion] = None
+        self.candidate_state = 'none'  # none | loading | ready | promoting | failed
+        self.candidate_error: Optional[str] = None
+        self.shadow_fraction = 0.0
+        self.history: List[Dict[str, Any]] = []
+        self._next_version = 1
+        self._lock = threading.Lock()
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="intent-shadow")
+        self._shadow_pending = 0
+        self._reset_shadow_stats()
+        self.before_promote = None  # called with the candidate before the swap; raising cancels the promotion
+        self.on_promote = None  # called with the new active version after the swap
+
+    def _reset_shadow_stats(self):
+        self.shadow_stats = {'samples': 0, 'agreements': 0, 'dropped': 0,
+                             'active_ms': 0.0, 'candidate_ms': 0.0, 'disagreements': []}
+
+    def load(self, model_path: str) -> IntentModelVersion:
+        start = time.perf_counter()
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        model.eval()
+        with open(f"{model_path}/id2intent.json", "r") as f:
+            labels = json.load(f)
+        with self._lock:
+            version = self._next_version
+            self._next_version += 1
+        return IntentModelVersion(version, model_path, tokenizer, model, labels,
+                                  datetime.utcnow().isoformat(), time.perf_counter() - start)
+
+    def activate(self, model_version: IntentModelVersion):
+        with self._lock:
+            self.active = model_version
+            self.history.append({**model_version.info(), 'activated_at': datetime.utcnow().isoformat()})
+        print(f"[Intent Registry] Active intent model v{model_version.version} ({model_version.model_path})")
+
+    def load_candidate(self, model_path: str, shadow_fraction: float = 0.0, auto_promote: bool = False,
+                       prepare=None) -> Dict[str, Any]:
+        """Start loading a candidate in a background thread. Refuses while another candidate exists."""
+        with self._lock:
+            if self.candidate_state == 'loading' or self.candidate is not None:
+                return {'status': 'error', 'message': 'A candidate is already loading or loaded; promote or discard it first'}
+            self.candidate_state = 'loading'
+            self.candidate_error = None
+        threading.Thread(target=self._load_candidate, args=(model_path, shadow_fraction, auto_promote, prepare),
+                         name="intent-model-loader", daemon=True).start()
+        return {'status': 'loading', 'model_path': model_path, 'shadow_fraction': shadow_fraction,
+                'auto_promote': auto_promote}
+
+    def _load_candidate(self, model_path, shadow_fraction, auto_promote, prepare):
+        try:
+            candidate = self.load(model_path)
+            if prepare:
+                prepare(candidate)
+        except Exception as e:
+            with self._lock:
+                self.candidate_state = 'failed'
+                self.candidate_error = str(e)
+            print(f"[Intent Registry] Error loading candidate {model_path}: {e}")
+            return
+        with self._lock:
+            self.candidate = candidate
+            self.candidate_state = 'ready'
+            self.shadow_fraction = shadow_fraction
+            self._reset_shadow_stats()
+        print(f"[Intent Registry] Candidate v{candidate.version} ready ({model_path}, {candidate.load_seconds:.1f}s, "
+              f"shadow fraction {shadow_fraction})")
+        if auto_promote:
+            self.promote()
+
+    def promote(self) -> Dict[str, Any]:
+        with self._lock:
+            candidate = self.candidate
+            if candidate is None or self.candidate_state != 'ready':
+                return {'status': 'error', 'message': f'No candidate ready (state: {self.candidate_state})'}
+            self.candidate_state = 'promoting'
+        try:
+            if self.before_promote:
+                self.before_promote(candidate)
+        except Exception as e:
+            with self._lock:
+                self.candidate_state, self.candidate_error = 'ready', str(e)
+            print(f"[Intent Registry] Promotion of v{candidate.version} failed; the active model is unchanged: {e}")
+            return {'status': 'error', 'message': f'Promotion failed: {e}'}
+        with self._lock:
+            previous, self.active = self.active, candidate
+            self.candidate, self.candidate_state, self.shadow_fraction = None, 'none', 0.0
+            self.history.append({**candidate.info(), 'activated_at': datetime.utcnow().isoformat()})
+        if self.on_promote:
+            try:
+                self.on_promote(candidate)
+            except Exception as e:
+                print(f"[Intent Registry] Post-promotion update for v{candidate.version} failed: {e}")
+        print(f"[Intent Registry] Promoted v{candidate.version}; released v{previous.version if previous else None}")
+        # Drop the previous copy so at most one extra model is ever resident
+        del previous
+        gc.collect()
+        return {'status': 'promoted', 'active': self.active.info()}
+
+    def discard(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.candidate_state == 'promoting':
+                return {'status': 'error', 'message': 'The candidate is being promoted'}
+            discarded, self.candidate = self.candidate, None
+            self.candidate_state, self.shadow_fraction = 'none', 0.0
+        gc.collect()
+        return {'status': 'discarded', 'version': discarded.version if discarded else None}
+
+    def shadow(self, text: str, active_intent: str, active_ms: float):
+        """Sample live traffic onto the candidate without adding latency to the request."""
+        candidate = self.candidate
+        if candidate is None or self.shadow_fraction <= 0 or random.random() >= self.shadow_fraction:
+            return
+        with self._lock:
+            if self._shadow_pending >= self.MAX_PENDING_SHADOW:
+                self.shadow_stats['dropped'] += 1
+                return
+            self._shadow_pending += 1
+        self._shadow_executor.submit(self._run_shadow, candidate, text, active_intent, active_ms)
+
+    def _run_shadow(self, candidate: IntentModelVersion, text: str, active_intent: str, active_ms: float):
+        try:
+            start = time.perf_counter()
+            logits, _ = candidate.forward(text)
+            candidate_ms = (time.perf_counter() - start) * 1000
+            intent = candidate.id2intent.get(str(int(torch.argmax(logits, dim=1).item())), 'unknown')
+            with self._lock:
+                stats = self.shadow_stats
+                stats['samples'] += 1
+                stats['agreements'] += intent == active_intent
+                stats['active_ms'] += active_ms
+                stats['candidate_ms'] += candidate_ms
+                if intent != active_intent:
+                    stats['disagreements'] = (stats['disagreements'] + [
+                        {'text': text, 'active': active_intent, 'candidate': intent}])[-20:]
+        except Exception as e:
+            print(f"[Intent Registry] Shadow evaluation failed: {e}")
+        finally:
+            with self._lock:
+                self._shadow_pending -= 1
+
+    def status(self) -> Dict[str, Any]:
+        stats = self.shadow_stats
+        samples = stats['samples']
+        return {
+            'active': self.active.info() if self.active else None,
+            'candidate': self.candidate.info() if self.candidate else None,
+            'candidate_state': self.candidate_state,
+            'candidate_error': self.candidate_error,
+            'shadow': {
+                'fraction': self.shadow_fraction,
+                'samples': samples,
+                'dropped': stats['dropped'],
+                'agreement': stats['agreements'] / samples if samples else None,
+                'active_mean_ms': stats['active_ms'] / samples if samples else None,
+                'candidate_mean_ms': stats['candidate_ms'] / samples if samples else None,
+                'recent_disagreements': list(stats['disagreements'])
+            },
+            'history': list(self.history)
+        }
+
+intent_registry = IntentModelRegistry()
+intent_registry.activate(intent_registry.load(INTENT_MODEL_PATH))
+
+# Sentence embeddings for KB search and semantic memory. "spacy" uses en_core_web_lg doc
+# vectors; "intent_model" mean-pools the fine-tuned intent model's last hidden states so the
+# same forward pass also yields the intent logits.
+EMBEDDING_BACKENDS = ("spacy", "intent_model")
+EMBEDDING_BACKEND = os.environ.get("NLP_EMBEDDING_BACKEND", config.semantic_config.embedding_backend)
+KB_EMBEDDINGS_DIR = "kb_embeddings"
+
+def embed_text(text: str, backend: Optional[str] = None) -> np.ndarray:
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "intent_model":
+        return intent_registry.active.forward(str(text))[1]
+    vectors = inference_processes.embed([text])
+    return vectors[0] if vectors is not None else parse(text, "embedding").vector
+
+def embed_texts(texts: List[str], backend: Optional[str] = None, batch_size: int = 32,
+                model_version: Optional[IntentModelVersion] = None) -> np.ndarray:
+    backend = backend or EMBEDDING_BACKEND
+    texts = [str(t) for t in texts]
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    if backend == "intent_model":
+        model_version = model_version or intent_registry.active
+        chunks = [model_version.forward_batch(texts[i:i + batch_size])[1] for i in range(0, len(texts), batch_size)]
+        return np.vstack(chunks).astype(np.float32)
+    vectors = inference_processes.embed(texts)
+    return vectors if vectors is not None else static_embedder.embed(texts)
+
+def cosine_similarities(matrix: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    """Cosine of each row against vector; zero vectors score 0 like spaCy's Doc.similarity."""
+    if len(matrix) == 0:
+        return np.zeros(0, dtype=np.float32)
+    matrix = np.asarray(matrix, dtype=np.float32)
+    vector = np.asarray(vector, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector)
+    dots = matrix @ vector
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+# Latency budgets: optional stages (coreference, context-blended KB search, relevant history,
+# NER) are skipped when the request's remaining budget does not cover what they usually take.
+OPTIONAL_STAGES = ("coref", "context_search", "relevant_history", "entities")
+stage_cost_ms: Dict[str, float] = {}  # moving average per optional stage, budget or not
+deadline_stats = {'requests': 0, 'overrun': 0, 'skipped': {stage: 0 for stage in OPTIONAL_STAGES}}
+# Raced stages of one request update its Deadline and these counters from several threads
+deadline_lock = threading.Lock()
+
+class Deadline:
+    """Latency budget of one request, counted from when the service received it."""
+    def __init__(self, budget_ms: Optional[float] = None, started: Optional[float] = None):
+        self.budget_ms = budget_ms
+        self.started = started if started is not None else time.monotonic()
+        self.skipped: List[str] = []
+        self.cancelled = threading.Event()  # set when the request's stage race is over
+        if budget_ms is not None:
+            with deadline_lock:
+                deadline_stats['requests'] += 1
+
+    def remaining_ms(self) -> float:
+        if self.budget_ms is None:
+            return math.inf
+        return self.budget_ms - (time.monotonic() - self.started) * 1000
+
+    def allows(self, stage: str) -> bool:
+        if self.cancelled.is_set():
+            return False  # nothing reads the stage any more; not counted as a budget skip
+        if self.budget_ms is None or not config.deadline_config.enabled:
+            return True
+        if self.remaining_ms() >= stage_cost_ms.get(stage, 0.0) + config.deadline_config.reserve_ms:
+            return True
+        with deadline_lock:
+            self.skipped.append(stage)
+            deadline_stats['skipped'][stage] += 1
+        return False
+
+    def run(self, stage: str, default: Any, fn: Callable, *args, **kwargs) -> Any:
+        """fn(*args) if the budget allows the stage, else default; the stage's cost is tracked either way."""
+        if not self.allows(stage):
+            return default
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with deadline_lock:
+                previous = stage_cost_ms.get(stage)
+                stage_cost_ms[stage] = elapsed_ms if previous is None else 0.8 * previous + 0.2 * elapsed_ms
+
+def request_deadline(http_request: Optional[Request], deadline_ms: Optional[float] = None) -> Deadline:
+    """Deadline from the deadline_ms field, else the X-Deadline-Ms header, else the configured default."""
+    budget_ms = deadline_ms
+    if budget_ms is None and http_request is not None and http_request.headers.get("x-deadline-ms"):
+        try:
+            budget_ms = float(http_request.headers["x-deadline-ms"])
+        except ValueError:
+            budget_ms = None
+    if budget_ms is None:
+        budget_ms = config.deadline_config.default_budget_ms
+    started = getattr(http_request.state, "received_at", None) if http_request is not None else None
+    return Deadline(budget_ms, started)
+
+def deadline_report() -> Dict[str, Any]:
+    with deadline_lock:
+        return {**deadline_stats, 'skipped': dict(deadline_stats['skipped']), 'stage_cost_ms': dict(stage_cost_ms)}
+
+class AnalysisContext:
+    """Per-request memo of spaCy parses and embeddings, keyed by text.
+
+    Every stage of one request asks the context instead of calling nlp()/embed_text(), so a
+    text that several stages look at is parsed once. A doc parsed with a richer pipeline
+    profile also serves requests for a lighter one. It also carries the request's Deadline.
+    Raced stages share one context, so the memo is guarded by a lock; the parse or embedding
+    itself runs outside it, and two stages asking for a new text at once may both compute it.
+    """
+    def __init__(self, embeddings: Optional[Dict[tuple, np.ndarray]] = None, deadline: Optional[Deadline] = None):
+        self.deadline = deadline or Deadline()
+        self._docs: Dict[str, tuple] = {}  # text -> (profile, Doc)
+        self._embeddings: Dict[tuple, np.ndarray] = embeddings if embeddings is not None else {}  # may outlive the request
+        self._entity_spans: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self.parses = 0
+        self.embeddings = 0
+        self.reused = 0
+
+    def doc(self, text: str, profile: str = "analysis"):
+        text = str(text)
+        with self._lock:
+            cached = self._docs.get(text)
+            if cached and PIPELINE_PROFILES.index(cached[0]) >= PIPELINE_PROFILES.index(profile):
+                self.reused += 1
+                return cached[1]
+        doc = parse(text, profile)
+        with self._lock:
+            cached = self._docs.get(text)
+            if not cached or PIPELINE_PROFILES.index(cached[0]) < PIPELINE_PROFILES.index(profile):
+                self._docs[text] = (profile, doc)
+            self.parses += 1
+        return doc
+
+    def vector(self, text: str) -> np.ndarray:
+        """spaCy doc vector (used by the centroid intent tier whatever the embedding backend)."""
+        key = ("spacy", str(text))
+        with self._lock:
+            cached = key in self._embeddings
+        if inference_processes.active or cached:
+            return self._embedding("spacy", text)
+        vector = self.doc(text, "embedding").vector
+        with self._lock:
+            return self._embeddings.setdefault(key, vector)
+
+    def embedding(self, text: str, backend: Optional[str] = None) -> np.ndarray:
+        backend = backend or EMBEDDING_BACKEND
+        if backend == "spacy":
+            return self.vector(text)
+        return self._embedding(backend, text)
+
+    def _embedding(self, backend: str, text: str) -> np.ndarray:
+        key = (backend, str(text))
+        with self._lock:
+            if key in self._embeddings:
+                self.reused += 1
+                return self._embeddings[key]
+        vector = embed_text(text, backend)
+        with self._lock:
+            self.embeddings += 1
+            return self._embeddings.setdefault(key, vector)
+
+    def entity_spans(self, text: str) -> List[Dict[str, Any]]:
+        text = str(text)
+        with self._lock:
+            if text in self._entity_spans:
+                self.reused += 1
+                return self._entity_spans[text]
+        erp_docs = entity_stats['erp_ner']['docs']
+        spans = extract_entity_spans(text, lambda: self.doc(text, "ner"))
+        with self._lock:
+            self.parses += entity_stats['erp_ner']['docs'] - erp_docs  # the ERP NER pipeline
+            return self._entity_spans.setdefault(text, spans)
+
+    def entities(self, text: str) -> Dict[str, str]:
+        return entities_by_label(self.entity_spans(text))
+
+    def tokens(self, text: str) -> List[str]:
+        return [token.text for token in self.doc(text, "embedding")]
+
+    def record(self, label: str) -> Dict[str, int]:
+        report = {'parses': self.parses, 'embeddings': self.embeddings, 'reused': self.reused}
+        with analysis_stats_lock:
+            for totals in (analysis_stats, analysis_stats['by_label'].setdefault(label, dict.fromkeys(ANALYSIS_COUNTS, 0))):
+                totals['requests'] += 1
+                for key, value in report.items():
+                    totals[key] += value
+                totals['max_parses'] = max(totals['max_parses'], self.parses)
+        if self.deadline.remaining_ms() < 0:
+            with deadline_lock:
+                deadline_stats['overrun'] += 1
+        return report
+
+ANALYSIS_COUNTS = ('requests', 'parses', 'embeddings', 'reused', 'max_parses')
+analysis_stats: Dict[str, Any] = {**dict.fromkeys(ANALYSIS_COUNTS, 0), 'by_label': {}}  # by_label: per endpoint
+analysis_stats_lock = threading.Lock()  # WebSocket turns record from model workers
+
+def analysis_stats_report() -> Dict[str, Any]:
+    with analysis_stats_lock:
+        stats = {**analysis_stats, 'by_label': {label: dict(totals) for label, totals in analysis_stats['by_label'].items()}}
+    requests = stats['requests']
+    return {**stats, 'parses_per_request': stats['parses'] / requests if requests else 0.0}
+
+def chat_collection_name(backend: str) -> str:
+    # Keep one collection per backend: vector sizes differ (300 for spaCy, 768 for DistilBERT)
+    return "chat_history" if backend == "spacy" else f"chat_history_{backend}"
+
+def kb_embeddings_path(backend: str) -> str:
+    return os.path.join(KB_EMBEDDINGS_DIR, f"{backend}.npz")
+
+def embedding_model_id(backend: str) -> str:
+    """Identifies the vectors behind stored embeddings, so a pruned or replaced model invalidates them."""
+    if backend == "intent_model":
+        return f"intent_model:{os.path.abspath(intent_registry.active.model_path)}"
+    return f"spacy:{nlp.meta['name']}-{nlp.meta['version']}:{nlp.vocab.vectors.shape[0]}"
+
+def embedding_version(backend: str) -> Optional[int]:
+    """Version of the model behind a backend's vectors; None for backends that are never swapped."""
+    return intent_registry.active.version if backend == "intent_model" else None
+
+def load_kb_embeddings(kb_questions: List[str], backend: str) -> np.ndarray:
+    """Use the prebuilt embeddings from build-kb-embeddings when they match the CSV, else embed now."""
+    path = kb_embeddings_path(backend)
+    if os.path.exists(path):
+        stored = np.load(path, allow_pickle=False)
+        if (list(stored['questions']) == [str(q) for q in kb_questions]
+                and 'model' in stored.files and str(stored['model']) == embedding_model_id(backend)):
+            print(f"[Embedding] Loaded {len(kb_questions)} KB embeddings from {path}")
+            return stored['embeddings'].astype(np.float32)
+        print(f"[Embedding] {path} is stale for the current KB CSV or model; re-embedding")
+    return embed_texts(kb_questions, backend)
+
+def save_kb_embeddings(kb_questions: List[str], backend: str) -> str:
+    os.makedirs(KB_EMBEDDINGS_DIR, exist_ok=True)
+    path = kb_embeddings_path(backend)
+    np.savez(path, questions=np.array([str(q) for q in kb_questions]),
+             embeddings=embed_texts(kb_questions, backend), model=np.array(embedding_model_id(backend)))
+    return path
+
+if EMBEDDING_BACKEND not in EMBEDDING_BACKENDS:
+    raise ValueError(f"Unknown embedding backend '{EMBEDDING_BACKEND}', expected one of {EMBEDDING_BACKENDS}")
+print(f"[Embedding] Using '{EMBEDDING_BACKEND}' embedding backend")
+
+def chat_store(backend: Optional[str] = None):
+    """The chat history collection of an embedding backend (the active one by default)."""
+    name = chat_collection_name(backend or EMBEDDING_BACKEND)
+    client = chroma_client()
+    if name not in _chroma['collections']:
+        _chroma['collections'][name] = client.get_or_create_collection(name)
+    return _chroma['collections'][name]
+
+# Load CSV and embed KB questions for semantic search
 CSV_PATH = '../../ChatBot.Server/Data/erp_case_data_expanded.csv'
 df = pd.read_csv(CSV_PATH)
 questions = df['Question'].tolist()
 answers = df['Answer'].tolist()
-question_docs = [nlp(q) for q in questions]
+question_vectors = load_kb_embeddings(questions, EMBEDDING_BACKEND)
+# set_embedding_backend swaps the backend and the KB matrices together under this lock; searches
+# take one snapshot of both, so a switch never pairs a query vector with the other backend's matrix
+embedding_lock = threading.Lock()
+
+def kb_snapshot() -> tuple:
+    with embedding_lock:
+        return EMBEDDING_BACKEND, question_vectors
+
+# Text normalization for the cheap intent lookup path
+CONTRACTIONS = {
+    "what's": "what is", "whats": "what is", "where's": "where is", "wheres": "where is",
+    "who's": "who is", "how's": "how is", "it's": "it is", "there's": "there is",
+    "that's": "that is", "let's": "let us", "i'm": "i am", "im": "i am",
+    "i've": "i have", "i'd": "i would", "i'll": "i will", "you're": "you are",
+    "we're": "we are", "they're": "they are", "can't": "cannot", "cant": "cannot",
+    "won't": "will not", "wont": "will not", "don't": "do not", "dont": "do not",
+    "doesn't": "does not", "doesnt": "does not", "didn't": "did not", "didnt": "did not",
+    "isn't": "is not", "isnt": "is not", "aren't": "are not", "wasn't": "was not",
+    "haven't": "have not", "hasn't": "has not", "shouldn't": "should not",
+}
+
+# Common misspellings of ERP vocabulary seen in chat input
+COMMON_TYPOS = {
+    "invocie": "invoice", "invoce": "invoice", "inovice": "invoice", "invioce": "invoice",
+    "purchse": "purchase", "puchase": "purchase", "oder": "order", "ordr": "order",
+    "leav": "leave", "leaev": "leave", "levae": "leave", "polcy": "policy",
+    "policiy": "policy", "plicy": "policy", "employe": "employee", "emplyee": "employee",
+    "salry": "salary", "sallary": "salary", "payrol": "payroll", "reciept": "receipt",
+    "recieve": "receive", "aproval": "approval", "approvel": "approval", "aprove": "approve",
+    "departmnet": "department", "deparment": "department", "attendence": "attendance",
+    "reimbursment": "reimbursement", "expence": "expense", "procurment": "procurement",
+    "inventroy": "inventory", "invetory": "inventory", "projcet": "project", "pls": "please",
+    "plz": "please", "u": "you", "ur": "your",
+}
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s']")  # apostrophes stay until contractions are expanded
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_text(text) -> str:
+    """Lowercase, drop punctuation, expand contractions, fix common typos and collapse whitespace."""
+    text = str(text).lower().replace("’", "'").replace("`", "'")
+    text = _PUNCTUATION_RE.sub(" ", text)  # "can't." -> "can't "
+    tokens = [CONTRACTIONS.get(tok.strip("'"), tok) for tok in text.split()]
+    tokens = [COMMON_TYPOS.get(tok, tok) for tok in " ".join(tokens).replace("'", " ").split()]
+    return " ".join(tokens)
+
+def char_ngrams(text: str, n: int = 3) -> set:
+    padded = f" {text} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+class IntentLookupIndex:
+    """Exact, normalized and character-trigram fuzzy lookup over the intent CSV."""
+
+    def __init__(self, texts, intents, fuzzy_threshold: float = 0.85, ngram_size: int = 3):
+        self.fuzzy_threshold = fuzzy_threshold
+        self.ngram_size = ngram_size
+        self.exact: Dict[str, str] = {}
+        self.normalized: Dict[str, str] = {}
+        self.entries: List[tuple] = []  # (normalized_text, intent, ngram_count)
+        self.postings: Dict[str, List[int]] = {}
+        self.counts = {'exact': 0, 'normalized': 0, 'fuzzy': 0, 'miss': 0}
+        self._lock = threading.Lock()  # lookups run on several model workers
+        for text, intent in zip(texts, intents):
+            if pd.isna(text) or pd.isna(intent):
+                continue
+            self.exact[str(text).strip().lower()] = intent
+            norm = normalize_text(text)
+            if not norm or norm in self.normalized:
+                continue
+            self.normalized[norm] = intent
+            grams = char_ngrams(norm, ngram_size)
+            entry_id = len(self.entries)
+            self.entries.append((norm, intent, len(grams)))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(entry_id)
+
+    def _fuzzy(self, norm: str):
+        grams = char_ngrams(norm, self.ngram_size)
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for entry_id in self.postings.get(gram, ()):
+                shared[entry_id] = shared.get(entry_id, 0) + 1
+        best_id, best_score = -1, 0.0
+        for entry_id, overlap in shared.items():
+            # Dice coefficient over character n-gram sets
+            score = 2.0 * overlap / (len(grams) + self.entries[entry_id][2])
+            if score > best_score:
+                best_id, best_score = entry_id, score
+        return best_id, best_score
+
+    def lookup(self, text) -> Optional[Dict[str, Any]]:
+        """Return {'intent', 'match_type', 'score', 'matched_text'} or None on a miss."""
+        key = str(text).strip().lower()
+        if key in self.exact:
+            self._count('exact')
+            return {'intent': self.exact[key], 'match_type': 'exact', 'score': 1.0, 'matched_text': key}
+        norm = normalize_text(text)
+        if norm in self.normalized:
+            self._count('normalized')
+            return {'intent': self.normalized[norm], 'match_type': 'normalized', 'score': 1.0, 'matched_text': norm}
+        if norm:
+            best_id, best_score = self._fuzzy(norm)
+            if best_id >= 0 and best_score >= self.fuzzy_threshold:
+                self._count('fuzzy')
+                matched_text, intent, _ = self.entries[best_id]
+                return {'intent': intent, 'match_type': 'fuzzy', 'score': best_score, 'matched_text': matched_text}
+        self._count('miss')
+        return None
+
+    def _count(self, match_type: str):
+        with self._lock:
+            self.counts[match_type] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        return {
+            'entries': len(self.entries),
+            'fuzzy_threshold': self.fuzzy_threshold,
+            'lookups': total,
+            'counts': counts,
+            'hit_rates': {k: (v / total if total else 0.0) for k, v in counts.items()}
+        }
 
 # Load intent CSV for hybrid lookup
 INTENT_LOOKUP_CSV = '../../intent_training/erp_intents.csv'
 intent_df = pd.read_csv(INTENT_LOOKUP_CSV)
-intent_lookup = {str(q).strip().lower(): i for q, i in zip(intent_df['text'], intent_df['intent'])}
+intent_lookup_index = IntentLookupIndex(intent_df['text'], intent_df['intent'])
 
-# Initialize ChromaDB for semantic memory
-chroma_client = chromadb.Client(Settings(
-    persist_directory="./chroma_db"  # Persistent storage for chat history
-))
-chat_collection = chroma_client.get_or_create_collection("chat_history")
-
-# ChromaDB functions for semantic memory (store as before, but use spaCy for similarity)
-def add_message_to_chroma(session_id: str, message: str, role: str, timestamp: Optional[str] = None):
+# ChromaDB functions for semantic memory (similarity is computed on the stored embeddings)
+def add_message_to_chroma(session_id: str, message: str, role: str, timestamp: Optional[str] = None,
+                          analysis: Optional[AnalysisContext] = None):
     if timestamp is None:
         timestamp = datetime.utcnow().isoformat()
     message_id = str(uuid.uuid4())
-    # Use spaCy vector for embedding
-    embedding = nlp(message).vector
+    if role == "bot":
+        # Analyse the reply once now; the next user turn reads the prepared result
+        prepared = prepared_messages.prepare(session_id, message)
+        erp_coref.observe(session_id, message, prepared.mentions)
+        embedding, backend, version = prepared.vector, prepared.backend, prepared.model_version
+    else:
+        erp_coref.observe(session_id, message)
+        # Embed with the configured backend
+        backend = EMBEDDING_BACKEND
+        version = embedding_version(backend)
+        embedding = analysis.embedding(message, backend) if analysis else embed_text(message, backend)
     print(f"[Embedding DEBUG] Message: '{message}'\n[Embedding DEBUG] Vector (first 5): {embedding[:5]} | Norm: {np.linalg.norm(embedding):.4f}")
     if embedding is None or np.linalg.norm(embedding) == 0 or len(embedding) == 0:
         print(f"[Embedding WARNING] Empty or zero embedding for message: '{message}' (skipping ChromaDB add)")
         return None
-    chat_collection.add(
+    storage_pool.call(
+        chat_store(backend).add,
         documents=[message],
         embeddings=[embedding.tolist()],
         metadatas=[{
@@ -135,16 +1711,25 @@ def add_message_to_chroma(session_id: str, message: str, role: str, timestamp: O
         }],
         ids=[message_id]
     )
+    if version != embedding_version(backend):
+        # A promotion re-embedded the collection while this message was in flight
+        storage_pool.call(chat_store(backend).update, ids=[message_id],
+                          embeddings=[embed_text(message, backend).tolist()])
     print(f"[ChromaDB] Stored {role} message for session {session_id}")
     return message_id
 
-def get_relevant_history(query: str, session_id: Optional[str] = None, top_k: int = 5):
-    query_doc = nlp(query)
+def get_relevant_history(query: str, session_id: Optional[str] = None, top_k: int = 5,
+                         analysis: Optional[AnalysisContext] = None):
+    backend = EMBEDDING_BACKEND  # the query and the collection must come from the same backend
+    query_vector = analysis.embedding(query, backend) if analysis else embed_text(query, backend)
+    if analysis is not None and analysis.deadline.cancelled.is_set():
+        return []  # started for a stage race that is over; skip the Chroma read
     filters = {}
     if session_id:
         filters["session_id"] = session_id
-    # Get all messages for the session
-    results = chat_collection.get(where=filters if filters else None)
+    # Get all messages for the session, with the embeddings stored at write time
+    results = storage_pool.call(chat_store(backend).get, where=filters if filters else None,
+                                include=["documents", "metadatas", "embeddings"])
     messages = []
     if results["documents"]:
         for i, doc in enumerate(results["documents"]):
@@ -153,17 +1738,19 @@ def get_relevant_history(query: str, session_id: Optional[str] = None, top_k: in
                 "role": results["metadatas"][i]["role"],
                 "timestamp": results["metadatas"][i]["timestamp"]
             })
-    # Compute similarity using spaCy
-    for msg in messages:
-        msg_doc = nlp(msg["message"])
-        msg["similarity"] = query_doc.similarity(msg_doc)
+    # Cosine similarity against the stored embeddings instead of re-parsing every message
+    if messages:
+        similarities = cosine_similarities(np.asarray(results["embeddings"], dtype=np.float32), query_vector)
+        for msg, similarity in zip(messages, similarities):
+            msg["similarity"] = float(similarity)
     # Sort by similarity and return top_k
     messages.sort(key=lambda x: x["similarity"], reverse=True)
     return messages[:top_k]
 
 def get_session_history(session_id: str, limit: int = 10):
     try:
-        results = chat_collection.get(
+        results = storage_pool.call(
+            chat_store().get,
             where={"session_id": session_id},
             limit=limit
         )
@@ -181,653 +1768,980 @@ def get_session_history(session_id: str, limit: int = 10):
         print(f"[ChromaDB] Error getting session history: {e}")
         return []
 
-def search_with_context(query: str, context_messages: List[str] = None):
+def combined_vector_from_prepared(query: str, query_vector: np.ndarray, prepared: List["PreparedMessage"],
+                                  analysis: AnalysisContext, backend: Optional[str] = None) -> Optional[np.ndarray]:
+    """Vector of "query context..." from prepared replies, without parsing the replies again.
+
+    spaCy's Doc.vector is the mean of the token vectors, so the vector of the concatenation is
+    the token-count weighted mean of the parts. Other backends have no such identity.
+    """
+    backend = backend or EMBEDDING_BACKEND
+    if backend != "spacy" or any(p.backend != backend for p in prepared):
+        return None
+    weights = [len(analysis.tokens(query))] + [len(p.tokens) for p in prepared]
+    vectors = [query_vector] + [p.vector for p in prepared]
+    total = sum(weights)
+    if total == 0:
+        return None
+    return np.sum([w * v for w, v in zip(weights, vectors)], axis=0) / total
+
+def kb_search(query: str, session_id: Optional[str], analysis: AnalysisContext,
+              context_messages: Optional[List[str]] = None):
+    """Best KB match; blended with the session's recent bot replies when the latency budget allows."""
+    search = None
+    if session_id or context_messages:
+        search = analysis.deadline.run("context_search", None, session_context_search, query, session_id, analysis,
+                                       context_messages)
+    return search or search_with_context(query, [], session_id, analysis)
+
+def session_context_search(query: str, session_id: Optional[str], analysis: AnalysisContext,
+                           context_messages: Optional[List[str]] = None):
+    """search_with_context over the session's recent bot replies (read from ChromaDB unless given)."""
+    if context_messages is None:
+        context_messages = []
+        if session_id:
+            recent_history = get_session_history(session_id, limit=3)
+            context_messages = [msg["message"] for msg in recent_history if msg["role"] == "bot"]
+    return search_with_context(query, context_messages, session_id, analysis)
+
+def search_with_context(query: str, context_messages: List[str] = None, session_id: Optional[str] = None,
+                        analysis: Optional[AnalysisContext] = None):
     """Enhanced semantic search that considers conversation context"""
-    if not questions or not question_docs:
+    backend, kb_vectors = kb_snapshot()
+    if not questions or not len(kb_vectors):
         return None, 0.0
     
-    query_doc = nlp(query)
-    best_score = 0.0
-    best_idx = -1
+    analysis = analysis or AnalysisContext()
+    query_vector = analysis.embedding(query, backend)
     
     # If we have context, create a combined query
+    combined_vector = query_vector
     if context_messages:
-        context_text = " ".join(context_messages)
-        context_doc = nlp(context_text)
-        # Combine query with context for better matching
-        combined_query = f"{query} {context_text}"
-        combined_doc = nlp(combined_query)
-    else:
-        combined_doc = query_doc
+        prepared = [prepared_messages.get(session_id, message) for message in context_messages]
+        combined_vector = (combined_vector_from_prepared(query, query_vector, prepared, analysis, backend)
+                           if all(prepared) else None)
+        if combined_vector is None:
+            context_text = " ".join(context_messages)
+            # Combine query with context for better matching
+            combined_vector = analysis.embedding(f"{query} {context_text}", backend)
     
-    # Search through all questions
-    for i, q_doc in enumerate(question_docs):
-        # Calculate similarity with both original query and combined query
-        direct_similarity = query_doc.similarity(q_doc)
-        context_similarity = combined_doc.similarity(q_doc)
-        
-        # Use the higher similarity score
-        similarity = max(direct_similarity, context_similarity)
-        
-        if similarity > best_score:
-            best_score = similarity
-            best_idx = i
+    # Similarity with both original query and combined query; use the higher score
+    direct_similarity = cosine_similarities(kb_vectors, query_vector)
+    context_similarity = cosine_similarities(kb_vectors, combined_vector)
+    similarity = np.maximum(direct_similarity, context_similarity)
     
+    best_idx = int(np.argmax(similarity))
+    best_score = float(similarity[best_idx])
+    if best_score <= 0.0:
+        return -1, 0.0
     return best_idx, best_score
 
-def lookup_intent_exact(text):
-    return intent_lookup.get(str(text).strip().lower())
+def lookup_intent(text):
+    """Cheap intent lookup: exact, then normalized, then fuzzy n-gram match."""
+    match = intent_lookup_index.lookup(text)
+    if match:
+        print(f"[Intent Lookup] {match['match_type']} match '{match['matched_text']}' -> {match['intent']} ({match['score']:.3f})")
+    return match
 
-def resolve_coref(user_message, last_bot_message, last_user_message=None):
-    # Use only the last bot message as context, with clear speaker tags
-    if last_bot_message:
-        context = f"Bot: {last_bot_message}\nUser: {user_message}"
-    else:
-        context = user_message
-    doc = nlp(context)
-    
-    # Check if coreferee is properly loaded
-    if not hasattr(doc._, 'coref_resolved'):
-        print("[Coreferee WARNING] coref_resolved extension not found. Trying alternative approach.")
-    else:
-        try:
-            # Only return the rewritten user message part
-            if "User:" in doc._.coref_resolved:
-                resolved = doc._.coref_resolved.split("User:")[-1].strip()
-            else:
-                resolved = doc._.coref_resolved
-        except Exception as e:
-            print(f"[Coreferee WARNING] Error resolving coref: {e}")
-            resolved = user_message
-    
-    return resolved
+# Cheap, POS-free pre-check: only messages with a candidate anaphor go to coreference
+ANAPHORIC_TOKENS = frozenset({
+    "it", "its", "itself", "they", "them", "their", "theirs", "themselves",
+    "he", "him", "his", "she", "her", "hers", "this", "that", "these", "those",
+})
+# Only phrases the ERP resolver rewrites: "the same" alone usually repeats an action ("do the same")
+ANAPHORIC_PHRASES = frozenset({
+    ("that", "one"), ("this", "one"), ("the", "above"),
+    ("the", "former"), ("the", "latter"), ("same", "one"),
+})
+_WORD_RE = re.compile(r"[a-z]+")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+|\n+")
 
-def classify_intent_local(text):
-    inputs = intent_tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=64)
-    with torch.no_grad():
-        logits = intent_model(**inputs).logits
-        pred = torch.argmax(logits, dim=1).item()
-    print(f"[Intent Debug] Input: {text}")
-    print(f"[Intent Debug] Logits: {logits.tolist()}")
-    print(f"[Intent Debug] Predicted class index: {pred}")
-    print(f"[Intent Debug] Predicted intent: {id2intent[str(pred)]}")
-    return id2intent[str(pred)]
+coref_stats = {'runs': 0, 'skipped_no_anaphor': 0, 'skipped_disabled': 0, 'errors': 0, 'run_ms': 0.0}
+coref_stats_lock = threading.Lock()
 
-class AnalysisStrategy(Enum):
-    EXACT_MATCH = "exact_match"
-    SEMANTIC_SEARCH = "semantic_search"
-    INTENT_CLASSIFICATION = "intent_classification"
-    CONTEXT_AWARE = "context_aware"
-    HYBRID = "hybrid"
+def _count_coref(key: str, amount: float = 1):
+    with coref_stats_lock:
+        coref_stats[key] += amount
 
-# Initialize ChromaDB for semantic memory
-chroma_client = chromadb.Client(Settings(
-    persist_directory="./chroma_db"  # Persistent storage for chat history
-))
-chat_collection = chroma_client.get_or_create_collection("chat_history")
+def needs_coreference(text: str) -> bool:
+    tokens = _WORD_RE.findall(str(text).lower())
+    if any(tok in ANAPHORIC_TOKENS for tok in tokens):
+        return True
+    return any(pair in ANAPHORIC_PHRASES for pair in zip(tokens, tokens[1:]))
 
-# Use spaCy's large model for all NLP tasks (embeddings, similarity, coreference)
-try:
-    nlp = spacy.load("en_core_web_lg")
-    print(f"[spaCy] Loaded model: {nlp.meta['name']} (version {nlp.meta['version']})")
-    if config.semantic_config.use_coreference:
-        try:
-            nlp.add_pipe('coreferee')
-            print("[spaCy] coreferee pipeline added successfully to en_core_web_lg.")
-        except Exception as e:
-            print(f"[spaCy] Error adding coreferee pipeline: {e}")
-except Exception as e:
-    print(f"[spaCy] Error loading model or setting up coreferee: {e}")
-    raise
+def trim_context(text: str, max_sentences: int) -> str:
+    """Keep only the last few sentences of a (possibly long) bot reply."""
+    sentences = [s for s in _SENTENCE_END_RE.split(str(text).strip()) if s]
+    return " ".join(sentences[-max_sentences:]) if max_sentences > 0 else ""
 
-# Load fine-tuned intent classifier
-INTENT_MODEL_PATH = "intent_model"
-intent_tokenizer = AutoTokenizer.from_pretrained(INTENT_MODEL_PATH)
-intent_model = AutoModelForSequenceClassification.from_pretrained(INTENT_MODEL_PATH)
-with open(f"{INTENT_MODEL_PATH}/id2intent.json", "r") as f:
-    id2intent = json.load(f)
+def coref_stats_report() -> Dict[str, Any]:
+    with coref_stats_lock:
+        stats = dict(coref_stats)
+    skipped = stats['skipped_no_anaphor'] + stats['skipped_disabled']
+    total = stats['runs'] + skipped
+    return {
+        **stats,
+        'calls': total,
+        'run_ratio': stats['runs'] / total if total else 0.0,
+        'skip_ratio': skipped / total if total else 0.0,
+        'mean_run_ms': stats['run_ms'] / stats['runs'] if stats['runs'] else 0.0,
+        'engine': config.semantic_config.coref_engine,
+        'erp_engine': erp_coref.report()
+    }
 
-# Load CSV and compute spaCy docs for semantic search (use nlp with vectors)
-CSV_PATH = '../../ChatBot.Server/Data/erp_case_data_expanded.csv'
-df = pd.read_csv(CSV_PATH)
-questions = df['Question'].tolist()
-answers = df['Answer'].tolist()
-question_docs = [nlp(q) for q in questions]
+# Lightweight ERP coreference: remembers the ERP mentions of recent turns per session and
+# replaces pronouns with the most recent compatible one, in a single pass over the tokens.
+ERP_MENTION_NOUNS = {
+    ("invoice",): "thing", ("purchase", "order"): "thing", ("sales", "order"): "thing",
+    ("order",): "thing", ("leave", "request"): "thing", ("leave", "policy"): "thing",
+    ("leave", "balance"): "thing", ("expense", "report"): "thing", ("expense", "claim"): "thing",
+    ("payslip",): "thing", ("project",): "thing", ("policy",): "thing", ("ticket",): "thing",
+    ("contract",): "thing", ("budget",): "thing", ("report",): "thing", ("request",): "thing",
+    ("payment",): "thing", ("quotation",): "thing", ("shipment",): "thing", ("timesheet",): "thing",
+    ("asset",): "thing",
+    ("department",): "group", ("team",): "group", ("vendor",): "group", ("supplier",): "group",
+    ("customer",): "group",
+    ("employee",): "person", ("manager",): "person", ("approver",): "person",
+}
+ERP_ID_PREFIXES = {"po": ("purchase", "order"), "inv": ("invoice",), "so": ("sales", "order"), "tkt": ("ticket",)}
+# Compatible mention categories, most preferred first: within a turn "it" means the document or
+# record ("review invoice 12345 for the marketing department" -> the invoice), not the group
+PRONOUN_TARGETS = {
+    "it": ("thing", "group"), "its": ("thing", "group"), "this": ("thing", "group"), "that": ("thing", "group"),
+    "they": ("plural", "group"), "them": ("plural", "group"), "their": ("plural", "group"),
+    "these": ("plural",), "those": ("plural",),
+    "he": ("person",), "him": ("person",), "his": ("person",), "she": ("person",), "her": ("person",),
+}
+ERP_COREF_PHRASES = {("that", "one"), ("this", "one"), ("same", "one"), ("the", "above"),
+                     ("the", "former"), ("the", "latter")}
+# Demonstratives and phrases only count as anaphors at the end of a clause ("approve that",
+# "what about that one?"), not as determiners ("that invoice") or complementizers ("that the").
+CLAUSE_END_FOLLOWERS = frozenset({"please", "too", "again", "instead", "now", "then", "for", "to", "as",
+                                  "with", "and", "or", "also", "by", "in", "on", "is", "was", "has"})
+_COREF_TOKEN_RE = re.compile(r"[A-Za-z]+-\d[\w-]*|\w+(?:[-/]\w+)*|[^\w\s]")
+_ERP_ID_RE = re.compile(r"^(?:[A-Za-z]{1,5}-)?\d[\w-]*$")
+_MAX_NOUN_LEN = max(len(key) for key in ERP_MENTION_NOUNS)
+_NAME_STOPWORDS = frozenset({"the", "a", "an", "my", "your", "our", "what", "who", "when", "where", "how",
+                             "is", "are", "can", "please", "show", "i", "hi", "hello", "dear"})
+_NON_POSSESSIVE_FOLLOWERS = frozenset({"the", "a", "an", "my", "your", "our", "his", "their", "this", "that",
+                                       "these", "those", "some", "any"})
+# Non-referential "it": weather, time and extraposition ("if it is raining", "it seems that ...")
+PLEONASTIC_IT_VERBS = frozenset({"seems", "seemed", "appears", "appeared", "rains", "rained", "snows", "snowed",
+                                 "happens", "happened", "turns", "turned", "depends"})
+PLEONASTIC_IT_COMPLEMENTS = frozenset({"raining", "snowing", "sunny", "cloudy", "windy", "foggy", "cold", "hot",
+                                       "warm", "dark", "noon", "midnight", "time", "possible", "impossible",
+                                       "likely", "unlikely", "necessary", "weekend", "monday", "tuesday",
+                                       "wednesday", "thursday", "friday", "saturday", "sunday"})
+_PLEONASTIC_COPULAS = frozenset({"is", "was", "s", "'", "be", "will", "been", "getting", "going", "to", "still",
+                                 "not", "already", "too", "very", "so", "really"})
 
-# Load intent CSV for hybrid lookup
-INTENT_LOOKUP_CSV = '../../intent_training/erp_intents.csv'
-intent_df = pd.read_csv(INTENT_LOOKUP_CSV)
-intent_lookup = {str(q).strip().lower(): i for q, i in zip(intent_df['text'], intent_df['intent'])}
+@dataclass
+class CorefMention:
+    text: str
+    category: str  # "thing", "group", "person" or "plural"
+    definite: bool  # carries an identifier or a name, so no article is added
 
-# Initialize ChromaDB for semantic memory
-chroma_client = chromadb.Client(Settings(
-    persist_directory="./chroma_db"  # Persistent storage for chat history
-))
-chat_collection = chroma_client.get_or_create_collection("chat_history")
+    def replacement(self, possessive: bool = False) -> str:
+        surface = self.text if self.definite else f"the {self.text}"
+        return f"{surface}'s" if possessive else surface
 
-# ChromaDB functions for semantic memory (store as before, but use spaCy for similarity)
-def add_message_to_chroma(session_id: str, message: str, role: str, timestamp: Optional[str] = None):
-    if timestamp is None:
-        timestamp = datetime.utcnow().isoformat()
-    message_id = str(uuid.uuid4())
-    # Use spaCy vector for embedding
-    embedding = nlp(message).vector
-    print(f"[Embedding DEBUG] Message: '{message}'\n[Embedding DEBUG] Vector (first 5): {embedding[:5]} | Norm: {np.linalg.norm(embedding):.4f}")
-    if embedding is None or np.linalg.norm(embedding) == 0 or len(embedding) == 0:
-        print(f"[Embedding WARNING] Empty or zero embedding for message: '{message}' (skipping ChromaDB add)")
+class ErpCorefResolver:
+    def __init__(self, max_turns: int = 6, max_sessions: int = 1000):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.sessions: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'resolved_messages': 0, 'replacements': 0, 'unresolved_anaphors': 0}
+
+    @staticmethod
+    def tokenize(text: str) -> List[tuple]:
+        return [(m.group(), m.start(), m.end()) for m in _COREF_TOKEN_RE.finditer(str(text))]
+
+    @staticmethod
+    def _noun_at(lowered: List[str], i: int):
+        """Longest ERP noun (singular or plural) starting at token i -> (length, key, plural)."""
+        for length in range(min(_MAX_NOUN_LEN, len(lowered) - i), 0, -1):
+            words = lowered[i:i + length]
+            if tuple(words) in ERP_MENTION_NOUNS:
+                return length, tuple(words), False
+            last = words[-1]
+            singular = last[:-3] + "y" if last.endswith("ies") else last[:-1] if last.endswith("s") else None
+            if singular and tuple(words[:-1] + [singular]) in ERP_MENTION_NOUNS:
+                return length, tuple(words[:-1] + [singular]), True
+        return 0, None, False
+
+    def extract_mentions(self, text: str, tokens: Optional[List[tuple]] = None) -> List[tuple]:
+        """ERP mentions in order of appearance, as (token_index, CorefMention)."""
+        text = str(text)
+        tokens = tokens if tokens is not None else self.tokenize(text)
+        lowered = [t[0].lower() for t in tokens]
+        mentions = []
+        i = 0
+        while i < len(tokens):
+            word = lowered[i]
+            prefix = word.split("-", 1)[0]
+            if "-" in word and prefix in ERP_ID_PREFIXES and _ERP_ID_RE.match(word):
+                mentions.append((i, CorefMention(tokens[i][0], ERP_MENTION_NOUNS[ERP_ID_PREFIXES[prefix]], True)))
+                i += 1
+                continue
+            length, key, plural = self._noun_at(lowered, i)
+            if length:
+                end = i + length
+                if not plural and end < len(tokens) and _ERP_ID_RE.match(tokens[end][0]):
+                    # "invoice 12345"; a prefixed id stands on its own ("purchase order PO-98765")
+                    identifier = tokens[end][0]
+                    noun = text[tokens[i][1]:tokens[end - 1][2]].lower()
+                    surface = identifier if "-" in identifier and not identifier[0].isdigit() else f"{noun} {identifier}"
+                    mentions.append((i, CorefMention(surface, ERP_MENTION_NOUNS[key], True)))
+                    end += 1
+                else:
+                    surface = text[tokens[i][1]:tokens[end - 1][2]].lower()
+                    mentions.append((i, CorefMention(surface, "plural" if plural else ERP_MENTION_NOUNS[key], False)))
+                i = end
+                continue
+            # Two capitalised words: a person's name ("John Smith", "for Mary Jones")
+            if (i < len(tokens) - 1 and tokens[i][0].isalpha() and tokens[i + 1][0].isalpha()
+                    and tokens[i][0][0].isupper() and tokens[i + 1][0][0].isupper()
+                    and word not in PRONOUN_TARGETS and word not in _NAME_STOPWORDS):
+                mentions.append((i, CorefMention(text[tokens[i][1]:tokens[i + 1][2]], "person", True)))
+                i += 2
+                continue
+            i += 1
+        return mentions
+
+    def observe(self, session_id: str, text: str, mentions: Optional[List[CorefMention]] = None):
+        """Remember the mentions of a stored turn (user or bot)."""
+        if not session_id or not text:
+            return
+        if mentions is None:
+            mentions = [m for _, m in self.extract_mentions(text)]
+        with self._lock:
+            turns = self.sessions.pop(session_id, None) or deque(maxlen=self.max_turns)
+            turns.append((str(text), mentions))
+            self.sessions[session_id] = turns
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    @staticmethod
+    def _pleonastic(lowered: List[str], i: int) -> bool:
+        """True for an "it" that refers to nothing ("is it raining", "it seems that ...")."""
+        j = i + 1
+        if j < len(lowered) and lowered[j] in PLEONASTIC_IT_VERBS:
+            return True
+        while j < len(lowered) and lowered[j] in _PLEONASTIC_COPULAS:
+            j += 1
+        return j < len(lowered) and lowered[j] in PLEONASTIC_IT_COMPLEMENTS
+
+    @staticmethod
+    def _antecedent(candidates: List[tuple], targets: tuple, skip: int = 0) -> Optional[CorefMention]:
+        """Most recent turn with a compatible mention wins; inside it the preferred category, then recency.
+
+        candidates are (turn, CorefMention) in order of appearance.
+        """
+        if targets == ("person",):
+            # Prefer a named person over a role noun ("the approver")
+            named = [c for c in candidates if c[1].definite]
+            if any(m.category == "person" for _, m in named):
+                candidates = named
+        compatible = [(turn, position, mention) for position, (turn, mention) in enumerate(candidates)
+                      if mention.category in targets]
+        compatible.sort(key=lambda c: (-c[0], targets.index(c[2].category), -c[1]))
+        seen = []
+        for _, _, mention in compatible:
+            if mention.text.lower() not in seen:
+                if len(seen) == skip:
+                    return mention
+                seen.append(mention.text.lower())
         return None
-    chat_collection.add(
-        documents=[message],
-        embeddings=[embedding.tolist()],
-        metadatas=[{
-            "session_id": session_id,
-            "role": role,
-            "timestamp": timestamp,
-            "message_id": message_id
-        }],
-        ids=[message_id]
-    )
-    print(f"[ChromaDB] Stored {role} message for session {session_id}")
-    return message_id
 
-def get_relevant_history(query: str, session_id: Optional[str] = None, top_k: int = 5):
-    query_doc = nlp(query)
-    filters = {}
-    if session_id:
-        filters["session_id"] = session_id
-    # Get all messages for the session
-    results = chat_collection.get(where=filters if filters else None)
-    messages = []
-    if results["documents"]:
-        for i, doc in enumerate(results["documents"]):
-            messages.append({
-                "message": doc,
-                "role": results["metadatas"][i]["role"],
-                "timestamp": results["metadatas"][i]["timestamp"]
-            })
-    # Compute similarity using spaCy
-    for msg in messages:
-        msg_doc = nlp(msg["message"])
-        msg["similarity"] = query_doc.similarity(msg_doc)
-    # Sort by similarity and return top_k
-    messages.sort(key=lambda x: x["similarity"], reverse=True)
-    return messages[:top_k]
+    def resolve(self, text: str, session_id: Optional[str] = None, context: Optional[List[str]] = None,
+                context_mentions: Optional[List[CorefMention]] = None) -> str:
+        text = str(text)
+        candidates: List[tuple] = []  # (turn, CorefMention)
+        if session_id:
+            with self._lock:
+                turns = list(self.sessions.get(session_id, ()))
+            # The current message is usually stored before it is analyzed; never resolve against itself
+            if turns and turns[-1][0] == text:
+                turns = turns[:-1]
+            for turn, (_, mentions) in enumerate(turns):
+                candidates.extend((turn, m) for m in mentions)
+        if not candidates:
+            # Nothing remembered for the session (e.g. after a restart): fall back to the request context
+            for turn, context_text in enumerate(context or []):
+                if context_text:
+                    candidates.extend((turn, m) for _, m in self.extract_mentions(context_text))
+            candidates.extend((len(context or []), m) for m in context_mentions or [])
+        current_turn = max((turn for turn, _ in candidates), default=-1) + 1
 
-def get_session_history(session_id: str, limit: int = 10):
-    try:
-        results = chat_collection.get(
-            where={"session_id": session_id},
-            limit=limit
+        tokens = self.tokenize(text)
+        lowered = [t[0].lower() for t in tokens]
+        own_mentions = dict(self.extract_mentions(text, tokens))
+        pieces, cursor, replaced = [], 0, 0
+        i = 0
+        while i < len(tokens):
+            if i in own_mentions:
+                candidates.append((current_turn, own_mentions[i]))
+            word = lowered[i]
+            pair = (word, lowered[i + 1]) if i + 1 < len(tokens) else None
+            if pair in ERP_COREF_PHRASES:
+                span, targets = 2, ("thing",)
+            elif word == "it" and self._pleonastic(lowered, i):
+                i += 1
+                continue
+            elif word in PRONOUN_TARGETS:
+                span, targets = 1, PRONOUN_TARGETS[word]
+            else:
+                i += 1
+                continue
+            following = lowered[i + span] if i + span < len(tokens) else ""
+            determiner = following.isalnum() and following not in CLAUSE_END_FOLLOWERS
+            if determiner and (span == 2 or word in ("this", "that", "these", "those")):
+                i += span
+                continue
+            antecedent = self._antecedent(candidates, targets, skip=1 if pair == ("the", "former") else 0)
+            if antecedent is None:
+                with self._lock:
+                    self.stats['unresolved_anaphors'] += 1
+                i += span
+                continue
+            possessive = span == 1 and (word in ("its", "their", "his")
+                                        or (word == "her" and determiner and following not in _NON_POSSESSIVE_FOLLOWERS))
+            replacement = antecedent.replacement(possessive)
+            start, end = tokens[i][1], tokens[i + span - 1][2]
+            if start == 0 or text[:start].rstrip().endswith((".", "!", "?")):
+                replacement = replacement[:1].upper() + replacement[1:]
+            pieces.extend([text[cursor:start], replacement])
+            cursor = end
+            replaced += 1
+            i += span
+        if not replaced:
+            return text
+        pieces.append(text[cursor:])
+        with self._lock:
+            self.stats['resolved_messages'] += 1
+            self.stats['replacements'] += replaced
+        return "".join(pieces)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, 'sessions': len(self.sessions)}
+
+erp_coref = ErpCorefResolver()
+
+@dataclass
+class PreparedMessage:
+    """A bot reply analysed once at write time, reused by the next user turn."""
+    text: str
+    tokens: List[str]
+    entities: Dict[str, str]
+    mentions: List[CorefMention]
+    sentences: List[str]
+    vector: np.ndarray
+    backend: str
+    model_version: Optional[int] = None
+
+    def tail(self, max_sentences: int) -> str:
+        return " ".join(self.sentences[-max_sentences:]) if max_sentences > 0 else ""
+
+class PreparedMessageCache:
+    def __init__(self, max_per_session: int = 3, max_sessions: int = 1000):
+        self.max_per_session = max_per_session
+        self.max_sessions = max_sessions
+        self.sessions: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {'prepared': 0, 'hits': 0, 'misses': 0}
+
+    def prepare(self, session_id: str, text: str) -> PreparedMessage:
+        doc = parse(text, "analysis")
+        backend = EMBEDDING_BACKEND
+        version = embedding_version(backend)
+        prepared = PreparedMessage(
+            text=str(text),
+            tokens=[token.text for token in doc],
+            entities=entities_by_label(extract_entity_spans(text, lambda: doc)),
+            mentions=[m for _, m in erp_coref.extract_mentions(text)],
+            sentences=[sent.text.strip() for sent in doc.sents if sent.text.strip()],
+            vector=doc.vector if backend == "spacy" else embed_text(text, backend),
+            backend=backend,
+            model_version=version
         )
-        messages = []
-        if results["documents"]:
-            for i, doc in enumerate(results["documents"]):
-                messages.append({
-                    "message": doc,
-                    "role": results["metadatas"][i]["role"],
-                    "timestamp": results["metadatas"][i]["timestamp"]
-                })
-        messages.sort(key=lambda x: x["timestamp"])
-        return messages
+        with self._lock:
+            replies = self.sessions.pop(session_id, None) or deque(maxlen=self.max_per_session)
+            replies.append(prepared)
+            self.sessions[session_id] = replies
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            self.counts['prepared'] += 1
+        return prepared
+
+    def get(self, session_id: Optional[str], text: Optional[str]) -> Optional[PreparedMessage]:
+        if not session_id or not text:
+            return None
+        with self._lock:
+            replies = list(self.sessions.get(session_id, ()))
+        text = str(text).strip()
+        for prepared in reversed(replies):
+            # A backend switch or an intent model promotion invalidates the stored vectors
+            if (prepared.text.strip() == text and prepared.backend == EMBEDDING_BACKEND
+                    and prepared.model_version == embedding_version(EMBEDDING_BACKEND)):
+                with self._lock:
+                    self.counts['hits'] += 1
+                return prepared
+        with self._lock:
+            self.counts['misses'] += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts, sessions = dict(self.counts), len(self.sessions)
+        lookups = counts['hits'] + counts['misses']
+        return {**counts, 'sessions': sessions, 'hit_rate': counts['hits'] / lookups if lookups else 0.0}
+
+prepared_messages = PreparedMessageCache()
+
+# Entity extraction. A rule stage (patterns and phrase lists on tokenizer output) runs first;
+# the custom ERP NER (intent_training/config.cfg: tok2vec + ner, hash embeddings, no static
+# vectors) is its own small pipeline; en_core_web_lg's generic OntoNotes NER only runs when
+# the merge mode asks for it.
+ENTITY_MERGE_MODES = ("erp", "generic", "merged")
+entity_stats = {engine: {'docs': 0, 'ms': 0.0, 'entities': 0} for engine in ("rules", "erp_ner", "generic_ner")}
+entity_stats['statistical_skipped'] = 0
+
+def load_erp_ner(path: str):
+    if not path or not os.path.isdir(path):
+        print(f"[NER] ERP NER model not found at {path}; entities fall back to the generic model")
+        return None
+    try:
+        model = spacy.load(path)
+        print(f"[NER] Loaded ERP NER model from {path}: labels {list(model.get_pipe('ner').labels)}")
+        return model
     except Exception as e:
-        print(f"[ChromaDB] Error getting session history: {e}")
-        return []
+        print(f"[NER] Error loading ERP NER model from {path}: {e}")
+        return None
 
-def search_with_context(query: str, context_messages: List[str] = None):
-    """Enhanced semantic search that considers conversation context"""
-    if not questions or not question_docs:
-        return None, 0.0
-    
-    query_doc = nlp(query)
-    best_score = 0.0
-    best_idx = -1
-    
-    # If we have context, create a combined query
-    if context_messages:
-        context_text = " ".join(context_messages)
-        context_doc = nlp(context_text)
-        # Combine query with context for better matching
-        combined_query = f"{query} {context_text}"
-        combined_doc = nlp(combined_query)
-    else:
-        combined_doc = query_doc
-    
-    # Search through all questions
-    for i, q_doc in enumerate(question_docs):
-        # Calculate similarity with both original query and combined query
-        direct_similarity = query_doc.similarity(q_doc)
-        context_similarity = combined_doc.similarity(q_doc)
-        
-        # Use the higher similarity score
-        similarity = max(direct_similarity, context_similarity)
-        
-        if similarity > best_score:
-            best_score = similarity
-            best_idx = i
-    
-    return best_idx, best_score
+erp_ner = load_erp_ner(config.entity_config.erp_model_path)
+erp_ner_lock = threading.Lock()
 
-def lookup_intent_exact(text):
-    return intent_lookup.get(str(text).strip().lower())
+def run_erp_ner(text: str):
+    with erp_ner_lock:
+        return erp_ner(str(text))
 
-def resolve_coref(user_message, last_bot_message, last_user_message=None):
-    # Use only the last bot message as context, with clear speaker tags
-    if last_bot_message:
-        context = f"Bot: {last_bot_message}\nUser: {user_message}"
-    else:
-        context = user_message
-    doc = nlp(context)
-    
-    # Check if coreferee is properly loaded
-    if not hasattr(doc._, 'coref_resolved'):
-        print("[Coreferee WARNING] coref_resolved extension not found. Trying alternative approach.")
-    else:
-        try:
-            # Only return the rewritten user message part
-            if "User:" in doc._.coref_resolved:
-                resolved = doc._.coref_resolved.split("User:")[-1].strip()
-            else:
-                resolved = doc._.coref_resolved
-        except Exception as e:
-            print(f"[Coreferee WARNING] Error resolving coref: {e}")
-            resolved = user_message
-    
-    return resolved
+def doc_entity_spans(doc, engine: str) -> List[Dict[str, Any]]:
+    return [{'label': ent.label_, 'text': ent.text, 'start': ent.start_char, 'end': ent.end_char, 'engine': engine}
+            for ent in doc.ents]
 
-def classify_intent_local(text):
-    inputs = intent_tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=64)
-    with torch.no_grad():
-        logits = intent_model(**inputs).logits
-        pred = torch.argmax(logits, dim=1).item()
-    print(f"[Intent Debug] Input: {text}")
-    print(f"[Intent Debug] Logits: {logits.tolist()}")
-    print(f"[Intent Debug] Predicted class index: {pred}")
-    print(f"[Intent Debug] Predicted intent: {id2intent[str(pred)]}")
-    return id2intent[str(pred)]
+def _timed_entities(engine: str, run) -> List[Dict[str, Any]]:
+    start = time.perf_counter()
+    spans = run()
+    entity_stats[engine]['docs'] += 1
+    entity_stats[engine]['ms'] += (time.perf_counter() - start) * 1000
+    entity_stats[engine]['entities'] += len(spans)
+    return spans
 
-class AnalysisStrategy(Enum):
-    EXACT_MATCH = "exact_match"
-    SEMANTIC_SEARCH = "semantic_search"
-    INTENT_CLASSIFICATION = "intent_classification"
-    CONTEXT_AWARE = "context_aware"
-    HYBRID = "hybrid"
+def extract_entity_spans(text: str, generic_parse: Optional[Callable[[], Any]] = None) -> List[Dict[str, Any]]:
+    """Entities with character offsets and the engine that found them.
 
-# Initialize ChromaDB for semantic memory
-chroma_client = chromadb.Client(Settings(
-    persist_directory="./chroma_db"  # Persistent storage for chat history
-))
-chat_collection = chroma_client.get_or_create_collection("chat_history")
+    The rule stage runs first on tokenizer output; when its entities leave no candidate
+    token uncovered the statistical NER is skipped. Otherwise EntityConfig.merge_mode picks
+    the statistical engines: "merged" keeps generic entities (optionally only generic_labels)
+    that do not overlap an ERP one. Rule entities win over statistical ones on overlap.
+    Without the ERP model every mode behaves like "generic".
+    """
+    entity_config = config.entity_config
+    if not entity_config.enabled:
+        return []
+    spans = []
+    if erp_entity_ruler is not None:
+        start = time.perf_counter()
+        with erp_entity_ruler.lock:
+            rule_doc = erp_entity_ruler.make_doc(text)
+            rule_spans = erp_entity_ruler.match(rule_doc)
+            spans = [{'label': span.label_, 'text': span.text, 'start': span.start_char, 'end': span.end_char,
+                      'engine': 'rules'} for span in rule_spans]
+            covered = erp_entity_ruler.covers(rule_doc, rule_spans)
+        entity_stats['rules']['docs'] += 1
+        entity_stats['rules']['ms'] += (time.perf_counter() - start) * 1000
+        entity_stats['rules']['entities'] += len(spans)
+        if covered:
+            entity_stats['statistical_skipped'] += 1
+            return spans
+    mode = entity_config.merge_mode if erp_ner is not None else "generic"
+    statistical = []
+    if mode in ("erp", "merged"):
+        statistical = _timed_entities("erp_ner", lambda: doc_entity_spans(run_erp_ner(text), "erp_ner"))
+    if mode in ("generic", "merged"):
+        generic = _timed_entities("generic_ner", lambda: _generic_entities(text, generic_parse))
+        if entity_config.generic_labels is not None:
+            generic = [s for s in generic if s['label'] in entity_config.generic_labels]
+        statistical += [s for s in generic if not _overlaps(s, statistical)]
+    spans += [s for s in statistical if not _overlaps(s, spans)]
+    return sorted(spans, key=lambda s: s['start'])
 
-# Use spaCy's large model for all NLP tasks (embeddings, similarity, coreference)
-try:
-    nlp = spacy.load("en_core_web_lg")
-    print(f"[spaCy] Loaded model: {nlp.meta['name']} (version {nlp.meta['version']})")
-    if config.semantic_config.use_coreference:
-        try:
-            nlp.add_pipe('coreferee')
-            print("[spaCy] coreferee pipeline added successfully to en_core_web_lg.")
-        except Exception as e:
-            print(f"[spaCy] Error adding coreferee pipeline: {e}")
-except Exception as e:
-    print(f"[spaCy] Error loading model or setting up coreferee: {e}")
-    raise
+def _generic_entities(text: str, generic_parse: Optional[Callable[[], Any]]) -> List[Dict[str, Any]]:
+    spans = inference_processes.entities(text)
+    if spans is None:
+        spans = doc_entity_spans(generic_parse() if generic_parse else parse(text, "ner"), "generic_ner")
+    return spans
 
-# Load fine-tuned intent classifier
-INTENT_MODEL_PATH = "intent_model"
-intent_tokenizer = AutoTokenizer.from_pretrained(INTENT_MODEL_PATH)
-intent_model = AutoModelForSequenceClassification.from_pretrained(INTENT_MODEL_PATH)
-with open(f"{INTENT_MODEL_PATH}/id2intent.json", "r") as f:
-    id2intent = json.load(f)
+def _overlaps(span: Dict[str, Any], others: List[Dict[str, Any]]) -> bool:
+    return any(span['start'] < other['end'] and other['start'] < span['end'] for other in others)
 
-# Load CSV and compute spaCy docs for semantic search (use nlp with vectors)
-CSV_PATH = '../../ChatBot.Server/Data/erp_case_data_expanded.csv'
-df = pd.read_csv(CSV_PATH)
-questions = df['Question'].tolist()
-answers = df['Answer'].tolist()
-question_docs = [nlp(q) for q in questions]
+def entities_by_label(spans: List[Dict[str, Any]]) -> Dict[str, str]:
+    return {s['label']: s['text'] for s in spans}
 
-# Load intent CSV for hybrid lookup
-INTENT_LOOKUP_CSV = '../../intent_training/erp_intents.csv'
-intent_df = pd.read_csv(INTENT_LOOKUP_CSV)
-intent_lookup = {str(q).strip().lower(): i for q, i in zip(intent_df['text'], intent_df['intent'])}
+def entity_stats_report() -> Dict[str, Any]:
+    return {
+        'merge_mode': config.entity_config.merge_mode,
+        'erp_model_loaded': erp_ner is not None,
+        'rules_loaded': erp_entity_ruler is not None,
+        'statistical_skipped': entity_stats['statistical_skipped'],
+        **{engine: {**counts, 'mean_ms': counts['ms'] / counts['docs'] if counts['docs'] else 0.0}
+           for engine, counts in entity_stats.items() if isinstance(counts, dict)}
+    }
 
-# Initialize ChromaDB for semantic memory
-chroma_client = chromadb.Client(Settings(
-    persist_directory="./chroma_db"  # Persistent storage for chat history
-))
-chat_collection = chroma_client.get_or_create_collection("chat_history")
+class ErpEntityRuler:
+    """Pattern and phrase-list entities on tokenizer output alone.
 
-# ChromaDB functions for semantic memory (store as before, but use spaCy for similarity)
-def add_message_to_chroma(session_id: str, message: str, role: str, timestamp: Optional[str] = None):
-    if timestamp is None:
-        timestamp = datetime.utcnow().isoformat()
-    message_id = str(uuid.uuid4())
-    # Use spaCy vector for embedding
-    embedding = nlp(message).vector
-    print(f"[Embedding DEBUG] Message: '{message}'\n[Embedding DEBUG] Vector (first 5): {embedding[:5]} | Norm: {np.linalg.norm(embedding):.4f}")
-    if embedding is None or np.linalg.norm(embedding) == 0 or len(embedding) == 0:
-        print(f"[Embedding WARNING] Empty or zero embedding for message: '{message}' (skipping ChromaDB add)")
-        return None
-    chat_collection.add(
-        documents=[message],
-        embeddings=[embedding.tolist()],
-        metadatas=[{
-            "session_id": session_id,
-            "role": role,
-            "timestamp": timestamp,
-            "message_id": message_id
-        }],
-        ids=[message_id]
-    )
-    print(f"[ChromaDB] Stored {role} message for session {session_id}")
-    return message_id
+    Token patterns may carry "contexts": leading tokens that must match but are not part of
+    the entity ("invoice 12345" -> 12345 as INVOICE_NUMBER). Phrase lists come from the
+    pattern files and from the annotated texts in erp_ner_training_data.json (except labels
+    whose values are open-ended, which the patterns or the statistical NER handle).
+    """
+    def __init__(self, pattern_files: List[str], training_data_path: Optional[str] = None):
+        self.tokenizer_nlp = spacy.blank("en")
+        vocab = self.tokenizer_nlp.vocab
+        self.matcher = Matcher(vocab)
+        self.phrase_matcher = PhraseMatcher(vocab, attr="LOWER")
+        # All-caps phrases are acronyms ("IT", "HR") and only match as written, so "about it" is no department
+        self.acronym_matcher = PhraseMatcher(vocab, attr="ORTH")
+        self.context_length: Dict[str, int] = {}
+        self.entity_words: set = set()  # lowercase words that can start or belong to an entity
+        self.phrase_count = 0
+        excluded = set()
+        phrases: Dict[str, set] = {}
+        for path in pattern_files:
+            if not os.path.exists(path):
+                print(f"[Rules] Entity pattern file {path} not found")
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                spec = json.load(f)
+            excluded.update(spec.get("exclude_training_labels", []))
+            for entry in spec.get("patterns", []):
+                for context in entry.get("contexts", [[]]):
+                    key = f"{entry['label']}#{len(self.context_length)}"
+                    self.matcher.add(key, [context + entry["pattern"]])
+                    self.context_length[key] = len(context)
+            for label, values in spec.get("phrases", {}).items():
+                phrases.setdefault(label, set()).update(values)
+        if training_data_path and os.path.exists(training_data_path):
+            with open(training_data_path, "r", encoding="utf-8") as f:
+                for example in json.load(f):
+                    for start, end, label in example["entities"]:
+                        value = example["text"][start:end]
+                        self.entity_words.update(w for w in value.lower().split() if not w.isdigit())
+                        if label not in excluded:
+                            phrases.setdefault(label, set()).add(value)
+        for label, values in phrases.items():
+            docs = list(self.tokenizer_nlp.tokenizer.pipe(sorted(values)))
+            acronyms = [doc for doc in docs if doc.text.isupper()]
+            if acronyms:
+                self.acronym_matcher.add(label, acronyms)
+            self.phrase_matcher.add(label, [doc for doc in docs if not doc.text.isupper()])
+            self.phrase_count += len(docs)
+            self.entity_words.update(token.lower_ for doc in docs for token in doc if token.is_alpha)
+        self.entity_words.update(word for key in ERP_MENTION_NOUNS for word in key)
+        self.lock = threading.Lock()
+        print(f"[Rules] Entity ruler: {len(self.context_length)} token patterns, {self.phrase_count} phrases")
 
-def get_relevant_history(query: str, session_id: Optional[str] = None, top_k: int = 5):
-    query_doc = nlp(query)
-    filters = {}
-    if session_id:
-        filters["session_id"] = session_id
-    # Get all messages for the session
-    results = chat_collection.get(where=filters if filters else None)
-    messages = []
-    if results["documents"]:
-        for i, doc in enumerate(results["documents"]):
-            messages.append({
-                "message": doc,
-                "role": results["metadatas"][i]["role"],
-                "timestamp": results["metadatas"][i]["timestamp"]
-            })
-    # Compute similarity using spaCy
-    for msg in messages:
-        msg_doc = nlp(msg["message"])
-        msg["similarity"] = query_doc.similarity(msg_doc)
-    # Sort by similarity and return top_k
-    messages.sort(key=lambda x: x["similarity"], reverse=True)
-    return messages[:top_k]
+    def make_doc(self, text: str):
+        return self.tokenizer_nlp.make_doc(str(text))
 
-def get_session_history(session_id: str, limit: int = 10):
+    def match(self, doc) -> List[Any]:
+        spans = []
+        for match_id, start, end in self.matcher(doc):
+            key = self.tokenizer_nlp.vocab.strings[match_id]
+            spans.append(Span(doc, start + self.context_length[key], end, label=key.split("#", 1)[0]))
+        for matcher in (self.phrase_matcher, self.acronym_matcher):
+            spans.extend(Span(doc, start, end, label=match_id) for match_id, start, end in matcher(doc))
+        return sorted(filter_spans(spans), key=lambda span: span.start)
+
+    def covers(self, doc, spans) -> bool:
+        """True when no token outside the rule entities could start a statistical entity.
+
+        Candidates are numbers, codes, capitalised words inside a sentence and lowercase
+        words that occur in annotated ERP entities.
+        """
+        covered = set()
+        for span in spans:
+            covered.update(range(span.start, span.end))
+        for token in doc:
+            if token.i in covered or token.is_punct or token.is_space:
+                continue
+            if token.like_num or any(ch.isdigit() for ch in token.text):
+                return False
+            if token.lower_ in self.entity_words:
+                return False
+            sentence_start = token.i == 0 or doc[token.i - 1].text in (".", "!", "?", ":")
+            if (token.is_title and not sentence_start) or (token.is_upper and len(token) > 1 and token.text != "I"):
+                return False
+        return True
+
+def load_entity_ruler(entity_config: "EntityConfig") -> Optional[ErpEntityRuler]:
+    if not entity_config.rules_enabled:
+        return None
     try:
-        results = chat_collection.get(
-            where={"session_id": session_id},
-            limit=limit
-        )
-        messages = []
-        if results["documents"]:
-            for i, doc in enumerate(results["documents"]):
-                messages.append({
-                    "message": doc,
-                    "role": results["metadatas"][i]["role"],
-                    "timestamp": results["metadatas"][i]["timestamp"]
-                })
-        messages.sort(key=lambda x: x["timestamp"])
-        return messages
+        return ErpEntityRuler(entity_config.rule_files, NER_TRAINING_DATA_PATH)
     except Exception as e:
-        print(f"[ChromaDB] Error getting session history: {e}")
-        return []
+        print(f"[Rules] Error building entity ruler: {e}")
+        return None
 
-def search_with_context(query: str, context_messages: List[str] = None):
-    """Enhanced semantic search that considers conversation context"""
-    if not questions or not question_docs:
-        return None, 0.0
-    
-    query_doc = nlp(query)
-    best_score = 0.0
-    best_idx = -1
-    
-    # If we have context, create a combined query
-    if context_messages:
-        context_text = " ".join(context_messages)
-        context_doc = nlp(context_text)
-        # Combine query with context for better matching
-        combined_query = f"{query} {context_text}"
-        combined_doc = nlp(combined_query)
-    else:
-        combined_doc = query_doc
-    
-    # Search through all questions
-    for i, q_doc in enumerate(question_docs):
-        # Calculate similarity with both original query and combined query
-        direct_similarity = query_doc.similarity(q_doc)
-        context_similarity = combined_doc.similarity(q_doc)
-        
-        # Use the higher similarity score
-        similarity = max(direct_similarity, context_similarity)
-        
-        if similarity > best_score:
-            best_score = similarity
-            best_idx = i
-    
-    return best_idx, best_score
+erp_entity_ruler = load_entity_ruler(config.entity_config)
 
-def lookup_intent_exact(text):
-    return intent_lookup.get(str(text).strip().lower())
+def tracked_vocabs() -> Dict[str, Any]:
+    """Every Vocab that grows with request text: en_core_web_lg, the ERP NER and the rule tokenizer."""
+    vocabs = {'nlp': nlp.vocab}
+    if erp_ner is not None:
+        vocabs['erp_ner'] = erp_ner.vocab
+    if erp_entity_ruler is not None:
+        vocabs['rules'] = erp_entity_ruler.tokenizer_nlp.vocab
+    return vocabs
 
-def resolve_coref(user_message, last_bot_message, last_user_message=None):
-    # Use only the last bot message as context, with clear speaker tags
-    if last_bot_message:
-        context = f"Bot: {last_bot_message}\nUser: {user_message}"
-    else:
-        context = user_message
-    doc = nlp(context)
-    
-    # Check if coreferee is properly loaded
-    if not hasattr(doc._, 'coref_resolved'):
-        print("[Coreferee WARNING] coref_resolved extension not found. Trying alternative approach.")
+memory_monitor = MemoryMonitor()
+
+
+def ensure_coreferee_pipe():
+    with nlp_lock:
+        if "coreferee" not in nlp.pipe_names:
+            nlp.add_pipe('coreferee')
+            print("[spaCy] coreferee pipeline added to en_core_web_lg.")
+
+def _resolve_with_coreferee(user_message: str, bot_tail: str, analysis: Optional[AnalysisContext] = None) -> str:
+    """Rewrite only the user part of the context, replacing each mention with its chain head."""
+    prefix = f"Bot: {bot_tail}\nUser: " if bot_tail else ""
+    doc = analysis.doc(prefix + user_message, "coreference") if analysis else parse(prefix + user_message, "coreference")
+    if not doc.has_extension('coref_chains') or doc._.coref_chains is None:
+        print("[Coreferee WARNING] coref_chains extension not found; coreferee is not in the pipeline.")
+        return user_message
+    offset = len(prefix)
+    pieces, cursor = [], offset
+    for token in doc:
+        if token.idx < offset:
+            continue
+        heads = doc._.coref_chains.resolve(token)
+        if heads:
+            pieces.extend([doc.text[cursor:token.idx], " and ".join(t.text for t in heads)])
+            cursor = token.idx + len(token.text)
+    pieces.append(doc.text[cursor:])
+    return "".join(pieces)
+
+def resolve_coref(user_message, last_bot_message, last_user_message=None, session_id: Optional[str] = None,
+                  analysis: Optional[AnalysisContext] = None):
+    if not config.semantic_config.use_coreference:
+        _count_coref('skipped_disabled')
+        return user_message
+    if not needs_coreference(user_message):
+        _count_coref('skipped_no_anaphor')
+        return user_message
+    _count_coref('runs')
+    start = time.perf_counter()
+    # Use only the tail of the last bot message as context, prepared when the reply was stored
+    max_sentences = config.semantic_config.coref_context_sentences
+    prepared = prepared_messages.get(session_id, last_bot_message)
+    if prepared:
+        bot_tail = prepared.tail(max_sentences)
     else:
-        try:
-            # Only return the rewritten user message part
-            if "User:" in doc._.coref_resolved:
-                resolved = doc._.coref_resolved.split("User:")[-1].strip()
-            else:
-                resolved = doc._.coref_resolved
-        except Exception as e:
-            print(f"[Coreferee WARNING] Error resolving coref: {e}")
-            resolved = user_message
-    
+        bot_tail = trim_context(last_bot_message, max_sentences) if last_bot_message else ""
+    try:
+        if config.semantic_config.coref_engine == "coreferee":
+            resolved = _resolve_with_coreferee(user_message, bot_tail, analysis)
+        elif prepared:
+            resolved = erp_coref.resolve(user_message, session_id, context=[last_user_message],
+                                         context_mentions=prepared.mentions)
+        else:
+            resolved = erp_coref.resolve(user_message, session_id, context=[last_user_message, bot_tail])
+    except Exception as e:
+        print(f"[Coref WARNING] Error resolving coref: {e}")
+        _count_coref('errors')
+        resolved = user_message
+    _count_coref('run_ms', (time.perf_counter() - start) * 1000)
     return resolved
 
+def evaluate_coref_engines(dialogues_path: str) -> Dict[str, Any]:
+    """Accuracy and latency of each coreference engine on recorded dialogues.
+
+    Each dialogue has prev_bot, last_user, message and the expected rewrite; exact match
+    after whitespace/case normalisation counts as correct.
+    """
+    with open(dialogues_path, "r", encoding="utf-8") as f:
+        dialogues = json.load(f)
+    report = {"dialogues": len(dialogues)}
+    engines = {"erp": lambda d: erp_coref.resolve(d["message"], None, context=[d.get("last_user"), d.get("prev_bot")])}
+    try:
+        ensure_coreferee_pipe()
+        engines["coreferee"] = lambda d: _resolve_with_coreferee(d["message"], d.get("prev_bot") or "")
+    except Exception as e:
+        report["coreferee_error"] = str(e)
+    for name, resolve in engines.items():
+        correct, timings, failures = 0, [], []
+        for dialogue in dialogues:
+            start = time.perf_counter()
+            resolved = resolve(dialogue)
+            timings.append((time.perf_counter() - start) * 1000)
+            if " ".join(resolved.lower().split()) == " ".join(dialogue["expected"].lower().split()):
+                correct += 1
+            else:
+                failures.append({"message": dialogue["message"], "expected": dialogue["expected"], "resolved": resolved})
+        report[name] = {
+            "accuracy": correct / len(dialogues) if dialogues else 0.0,
+            "mean_ms": float(np.mean(timings)) if timings else 0.0,
+            "p95_ms": float(np.percentile(timings, 95)) if timings else 0.0,
+            "failures": failures
+        }
+    return report
+
 def classify_intent_local(text):
-    inputs = intent_tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=64)
-    with torch.no_grad():
-        logits = intent_model(**inputs).logits
-        pred = torch.argmax(logits, dim=1).item()
+    result = predict_intent_transformer(text)
     print(f"[Intent Debug] Input: {text}")
-    print(f"[Intent Debug] Logits: {logits.tolist()}")
-    print(f"[Intent Debug] Predicted class index: {pred}")
-    print(f"[Intent Debug] Predicted intent: {id2intent[str(pred)]}")
-    return id2intent[str(pred)]
+    print(f"[Intent Debug] Model version: v{result['model_version']}")
+    print(f"[Intent Debug] Predicted intent: {result['intent']} ({result['confidence']:.3f})")
+    return result['intent']
 
-class AnalysisStrategy(Enum):
-    EXACT_MATCH = "exact_match"
-    SEMANTIC_SEARCH = "semantic_search"
-    INTENT_CLASSIFICATION = "intent_classification"
-    CONTEXT_AWARE = "context_aware"
-    HYBRID = "hybrid"
+def top_probabilities(probabilities, id2intent: Dict[str, str], k: int) -> List[Dict[str, Any]]:
+    values, indices = torch.topk(probabilities, min(k, probabilities.shape[-1]))
+    return [{'intent': id2intent.get(str(i), 'unknown'), 'probability': round(float(v), 6)}
+            for v, i in zip(values.tolist(), indices.tolist())]
 
-# Initialize ChromaDB for semantic memory
-chroma_client = chromadb.Client(Settings(
-    persist_directory="./chroma_db"  # Persistent storage for chat history
-))
-chat_collection = chroma_client.get_or_create_collection("chat_history")
+def predict_intent_transformer(text, model_version: Optional[IntentModelVersion] = None) -> Dict[str, Any]:
+    """Single DistilBERT forward pass on the active registry version; returns intent and softmax confidence."""
+    model_version = model_version or intent_registry.active
+    start = time.perf_counter()
+    # Shares the cached pass with the intent_model embedding backend
+    logits, _ = model_version.forward(str(text))
+    probabilities = torch.softmax(logits, dim=1)
+    pred = torch.argmax(logits, dim=1).item()
+    intent = model_version.id2intent.get(str(pred), 'unknown')
+    intent_registry.shadow(str(text), intent, (time.perf_counter() - start) * 1000)
+    return {
+        'intent': intent,
+        'confidence': float(probabilities[0][pred]),
+        'probabilities': probabilities[0],
+        'id2intent': model_version.id2intent,
+        'model_version': model_version.version
+    }
 
-# Use spaCy's large model for all NLP tasks (embeddings, similarity, coreference)
-try:
-    nlp = spacy.load("en_core_web_lg")
-    print(f"[spaCy] Loaded model: {nlp.meta['name']} (version {nlp.meta['version']})")
-    if config.semantic_config.use_coreference:
-        try:
-            nlp.add_pipe('coreferee')
-            print("[spaCy] coreferee pipeline added successfully to en_core_web_lg.")
-        except Exception as e:
-            print(f"[spaCy] Error adding coreferee pipeline: {e}")
-except Exception as e:
-    print(f"[spaCy] Error loading model or setting up coreferee: {e}")
-    raise
+class CentroidIntentClassifier:
+    """Nearest-centroid intent classifier over spaCy doc vectors (first tier of the intent cascade).
+
+    The acceptance margin (best minus second-best centroid cosine) is calibrated with
+    leave-one-out predictions so that accepted predictions reach ``target_precision``.
+    """
+
+    def __init__(self, vectors: np.ndarray, labels: List[str], target_precision: float = 0.95,
+                 margin_threshold: Optional[float] = None):
+        self.target_precision = target_precision
+        self.intents = sorted(set(labels))
+        intent_index = {intent: i for i, intent in enumerate(self.intents)}
+        norms = np.linalg.norm(vectors, axis=1)
+        keep = norms > 0
+        self.vectors = (vectors[keep] / norms[keep][:, None]).astype(np.float32)
+        self.labels = np.array([intent_index[l] for l, k in zip(labels, keep) if k])
+        self.sums = np.zeros((len(self.intents), self.vectors.shape[1]), dtype=np.float32)
+        np.add.at(self.sums, self.labels, self.vectors)
+        self.class_counts = np.bincount(self.labels, minlength=len(self.intents))
+        self.centroids = self._normalize_rows(self.sums)
+        self.loo_predictions, self.loo_margins = self._leave_one_out()
+        self.calibration = self._calibrate()
+        self.margin_threshold = margin_threshold if margin_threshold is not None else self.calibration['threshold']
 
-# Load fine-tuned intent classifier
-INTENT_MODEL_PATH = "intent_model"
-intent_tokenizer = AutoTokenizer.from_pretrained(INTENT_MODEL_PATH)
-intent_model = AutoModelForSequenceClassification.from_pretrained(INTENT_MODEL_PATH)
-with open(f"{INTENT_MODEL_PATH}/id2intent.json", "r") as f:
-    id2intent = json.load(f)
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
 
-# Load CSV and compute spaCy docs for semantic search (use nlp with vectors)
-CSV_PATH = '../../ChatBot.Server/Data/erp_case_data_expanded.csv'
-df = pd.read_csv(CSV_PATH)
-questions = df['Question'].tolist()
-answers = df['Answer'].tolist()
-question_docs = [nlp(q) for q in questions]
+    @staticmethod
+    def _top_two(sims: np.ndarray):
+        order = np.argsort(-sims, axis=-1)
+        best = order[..., 0]
+        best_sim = np.take_along_axis(sims, order[..., :1], axis=-1)[..., 0]
+        second_sim = np.take_along_axis(sims, order[..., 1:2], axis=-1)[..., 0]
+        return best, best_sim, best_sim - second_sim
 
-# Load intent CSV for hybrid lookup
-INTENT_LOOKUP_CSV = '../../intent_training/erp_intents.csv'
-intent_df = pd.read_csv(INTENT_LOOKUP_CSV)
-intent_lookup = {str(q).strip().lower(): i for q, i in zip(intent_df['text'], intent_df['intent'])}
+    def _leave_one_out(self):
+        sims = self.vectors @ self.centroids.T
+        # Replace each sample's own-class similarity with the centroid computed without it
+        own_sums = self.sums[self.labels] - self.vectors
+        own_norms = np.linalg.norm(own_sums, axis=1)
+        own_sims = np.where(own_norms > 0, np.einsum('ij,ij->i', self.vectors, own_sums) / np.maximum(own_norms, 1e-12), -1.0)
+        sims[np.arange(len(self.labels)), self.labels] = own_sims
+        best, _, margins = self._top_two(sims)
+        return best, margins
 
-# Initialize ChromaDB for semantic memory
-chroma_client = chromadb.Client(Settings(
-    persist_directory="./chroma_db"  # Persistent storage for chat history
-))
-chat_collection = chroma_client.get_or_create_collection("chat_history")
+    def _calibrate(self) -> Dict[str, Any]:
+        correct = self.loo_predictions == self.labels
+        order = np.argsort(-self.loo_margins)
+        precision = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+        passing = np.nonzero(precision >= self.target_precision)[0]
+        if len(passing) == 0:
+            return {'threshold': float('inf'), 'coverage': 0.0, 'precision': None,
+                    'loo_accuracy': float(correct.mean()) if len(correct) else 0.0}
+        cut = passing[-1]
+        return {
+            'threshold': float(self.loo_margins[order[cut]]),
+            'coverage': float((cut + 1) / len(order)),
+            'precision': float(precision[cut]),
+            'loo_accuracy': float(correct.mean())
+        }
 
-# ChromaDB functions for semantic memory (store as before, but use spaCy for similarity)
-def add_message_to_chroma(session_id: str, message: str, role: str, timestamp: Optional[str] = None):
-    if timestamp is None:
-        timestamp = datetime.utcnow().isoformat()
-    message_id = str(uuid.uuid4())
-    # Use spaCy vector for embedding
-    embedding = nlp(message).vector
-    print(f"[Embedding DEBUG] Message: '{message}'\n[Embedding DEBUG] Vector (first 5): {embedding[:5]} | Norm: {np.linalg.norm(embedding):.4f}")
-    if embedding is None or np.linalg.norm(embedding) == 0 or len(embedding) == 0:
-        print(f"[Embedding WARNING] Empty or zero embedding for message: '{message}' (skipping ChromaDB add)")
-        return None
-    chat_collection.add(
-        documents=[message],
-        embeddings=[embedding.tolist()],
-        metadatas=[{
-            "session_id": session_id,
-            "role": role,
-            "timestamp": timestamp,
-            "message_id": message_id
-        }],
-        ids=[message_id]
-    )
-    print(f"[ChromaDB] Stored {role} message for session {session_id}")
-    return message_id
+    def predict(self, vector) -> Optional[Dict[str, Any]]:
+        norm = np.linalg.norm(vector) if vector is not None else 0.0
+        if not norm:
+            return None
+        sims = self.centroids @ (np.asarray(vector, dtype=np.float32) / norm)
+        best, best_sim, margin = self._top_two(sims)
+        return {'intent': self.intents[int(best)], 'similarity': float(best_sim), 'margin': float(margin)}
 
-def get_relevant_history(query: str, session_id: Optional[str] = None, top_k: int = 5):
-    query_doc = nlp(query)
-    filters = {}
-    if session_id:
-        filters["session_id"] = session_id
-    # Get all messages for the session
-    results = chat_collection.get(where=filters if filters else None)
-    messages = []
-    if results["documents"]:
-        for i, doc in enumerate(results["documents"]):
-            messages.append({
-                "message": doc,
-                "role": results["metadatas"][i]["role"],
-                "timestamp": results["metadatas"][i]["timestamp"]
+    def sweep(self, thresholds: List[float]) -> List[Dict[str, Any]]:
+        """Leave-one-out coverage and precision of the vector tier at each margin threshold."""
+        correct = self.loo_predictions == self.labels
+        rows = []
+        for threshold in thresholds:
+            accepted = self.loo_margins >= threshold
+            rows.append({
+                'threshold': float(threshold),
+                'coverage': float(accepted.mean()) if len(accepted) else 0.0,
+                'precision': float(correct[accepted].mean()) if accepted.any() else None
             })
-    # Compute similarity using spaCy
-    for msg in messages:
-        msg_doc = nlp(msg["message"])
-        msg["similarity"] = query_doc.similarity(msg_doc)
-    # Sort by similarity and return top_k
-    messages.sort(key=lambda x: x["similarity"], reverse=True)
-    return messages[:top_k]
+        return rows
 
-def get_session_history(session_id: str, limit: int = 10):
-    try:
-        results = chat_collection.get(
-            where={"session_id": session_id},
-            limit=limit
-        )
-        messages = []
-        if results["documents"]:
-            for i, doc in enumerate(results["documents"]):
-                messages.append({
-                    "message": doc,
-                    "role": results["metadatas"][i]["role"],
-                    "timestamp": results["metadatas"][i]["timestamp"]
-                })
-        messages.sort(key=lambda x: x["timestamp"])
-        return messages
-    except Exception as e:
-        print(f"[ChromaDB] Error getting session history: {e}")
-        return []
+def build_centroid_classifier(texts, intents, target_precision: float = 0.95,
+                              margin_threshold: Optional[float] = None) -> Optional[CentroidIntentClassifier]:
+    pairs = [(str(t), str(i)) for t, i in zip(texts, intents) if not pd.isna(t) and not pd.isna(i)]
+    if not pairs:
+        return None
+    vectors = static_embedder.embed([t for t, _ in pairs])
+    classifier = CentroidIntentClassifier(vectors, [i for _, i in pairs], target_precision, margin_threshold)
+    print(f"[Intent Cascade] Centroid tier over {len(classifier.intents)} intents, "
+          f"margin threshold {classifier.margin_threshold:.4f} (LOO calibration: {classifier.calibration})")
+    return classifier
 
-def search_with_context(query: str, context_messages: List[str] = None):
-    """Enhanced semantic search that considers conversation context"""
-    if not questions or not question_docs:
-        return None, 0.0
-    
-    query_doc = nlp(query)
-    best_score = 0.0
-    best_idx = -1
-    
-    # If we have context, create a combined query
-    if context_messages:
-        context_text = " ".join(context_messages)
-        context_doc = nlp(context_text)
-        # Combine query with context for better matching
-        combined_query = f"{query} {context_text}"
-        combined_doc = nlp(combined_query)
-    else:
-        combined_doc = query_doc
-    
-    # Search through all questions
-    for i, q_doc in enumerate(question_docs):
-        # Calculate similarity with both original query and combined query
-        direct_similarity = query_doc.similarity(q_doc)
-        context_similarity = combined_doc.similarity(q_doc)
-        
-        # Use the higher similarity score
-        similarity = max(direct_similarity, context_similarity)
-        
-        if similarity > best_score:
-            best_score = similarity
-            best_idx = i
-    
-    return best_idx, best_score
+class IntentCascade:
+    """Routes inputs to the centroid tier when its margin is high enough, otherwise to the transformer."""
 
-def lookup_intent_exact(text):
-    return intent_lookup.get(str(text).strip().lower())
+    def __init__(self, vector_classifier: Optional[CentroidIntentClassifier]):
+        self.vector_classifier = vector_classifier
+        self.routed = {'vector': 0, 'transformer': 0}
+        self.latency_ms = {'vector': 0.0, 'transformer': 0.0}
+        self._lock = threading.Lock()
 
-def resolve_coref(user_message, last_bot_message, last_user_message=None):
-    # Use only the last bot message as context, with clear speaker tags
-    if last_bot_message:
-        context = f"Bot: {last_bot_message}\nUser: {user_message}"
-    else:
-        context = user_message
-    doc = nlp(context)
-    
-    # Check if coreferee is properly loaded
-    if not hasattr(doc._, 'coref_resolved'):
-        print("[Coreferee WARNING] coref_resolved extension not found. Trying alternative approach.")
-    else:
-        try:
-            # Only return the rewritten user message part
-            if "User:" in doc._.coref_resolved:
-                resolved = doc._.coref_resolved.split("User:")[-1].strip()
+    def _record(self, tier: str, start: float):
+        with self._lock:
+            self.routed[tier] += 1
+            self.latency_ms[tier] += (time.perf_counter() - start) * 1000
+
+    def classify(self, text: str, vector=None, transformer=predict_intent_transformer,
+                 cancelled: Optional[threading.Event] = None) -> Optional[Dict[str, Any]]:
+        start = time.perf_counter()
+        # With the intent_model embedding backend the transformer pass is already paid for
+        if self.vector_classifier is not None and EMBEDDING_BACKEND != "intent_model":
+            if vector is None:
+                vector = parse(text, "embedding").vector
+            prediction = self.vector_classifier.predict(vector)
+            if prediction and prediction['margin'] >= self.vector_classifier.margin_threshold:
+                self._record('vector', start)
+                return {'intent': prediction['intent'], 'confidence': prediction['similarity'],
+                        'margin': prediction['margin'], 'tier': 'vector'}
+        if cancelled is not None and cancelled.is_set():
+            return None  # the race this classification was started for is over
+        result = transformer(text)
+        self._record('transformer', start)
+        return {'intent': result['intent'], 'confidence': result['confidence'],
+                'probabilities': result['probabilities'], 'id2intent': result['id2intent'], 'tier': 'transformer'}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routed, latency_ms = dict(self.routed), dict(self.latency_ms)
+        total = sum(routed.values())
+        return {
+            'margin_threshold': self.vector_classifier.margin_threshold if self.vector_classifier else None,
+            'calibration': self.vector_classifier.calibration if self.vector_classifier else None,
+            'requests': total,
+            'routed': routed,
+            'vector_ratio': routed['vector'] / total if total else 0.0,
+            'mean_latency_ms': {
+                tier: (latency_ms[tier] / n if n else 0.0) for tier, n in routed.items()
+            },
+            'overall_mean_latency_ms': sum(latency_ms.values()) / total if total else 0.0
+        }
+
+    def evaluate(self, texts, intents, transformer=predict_intent_transformer) -> Dict[str, Any]:
+        """Offline per-tier accuracy and latency on a labelled set.
+
+        Vector-tier predictions are leave-one-out when evaluating the training CSV itself.
+        """
+        clf = self.vector_classifier
+        if clf is None:
+            return {'error': 'vector tier disabled'}
+        pairs = [(str(t), str(i)) for t, i in zip(texts, intents) if not pd.isna(t) and not pd.isna(i)]
+        vector_ms, transformer_ms = [], []
+        rows = []
+        for text, intent in pairs:
+            start = time.perf_counter()
+            prediction = clf.predict(parse(text, "embedding").vector)
+            vector_ms.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            heavy = transformer(text)['intent']
+            transformer_ms.append((time.perf_counter() - start) * 1000)
+            rows.append((intent, prediction, heavy))
+        if not rows:
+            return {'error': 'no labelled rows'}
+        training_set = len(rows) == len(clf.labels)
+        accepted, vector_correct, deferred, deferred_correct, cascade_correct, heavy_correct = 0, 0, 0, 0, 0, 0
+        for n, (intent, prediction, heavy) in enumerate(rows):
+            if training_set:
+                margin, guess = float(clf.loo_margins[n]), clf.intents[int(clf.loo_predictions[n])]
             else:
-                resolved = doc._.coref_resolved
-        except Exception as e:
-            print(f"[Coreferee WARNING] Error resolving coref: {e}")
-            resolved = user_message
-    
-    return resolved
+                margin, guess = (prediction['margin'], prediction['intent']) if prediction else (float('-inf'), None)
+            heavy_correct += heavy == intent
+            if margin >= clf.margin_threshold:
+                accepted += 1
+                vector_correct += guess == intent
+                cascade_correct += guess == intent
+            else:
+                deferred += 1
+                deferred_correct += heavy == intent
+                cascade_correct += heavy == intent
+        total = len(rows)
+        mean_vector_ms = float(np.mean(vector_ms))
+        mean_transformer_ms = float(np.mean(transformer_ms))
+        quantiles = np.quantile(clf.loo_margins, [0.1, 0.25, 0.5, 0.75, 0.9]).tolist() if training_set else []
+        return {
+            'samples': total,
+            'leave_one_out': training_set,
+            'margin_threshold': clf.margin_threshold,
+            'routing': {'vector': accepted / total, 'transformer': deferred / total},
+            'accuracy': {
+                'vector_tier': vector_correct / accepted if accepted else None,
+                'transformer_on_deferred': deferred_correct / deferred if deferred else None,
+                'transformer_all': heavy_correct / total,
+                'cascade': cascade_correct / total
+            },
+            'latency_ms': {
+                'vector_tier': mean_vector_ms,
+                'transformer': mean_transformer_ms,
+                'cascade': (accepted * mean_vector_ms + deferred * (mean_vector_ms + mean_transformer_ms)) / total
+            },
+            'threshold_sweep': clf.sweep(quantiles + [clf.margin_threshold]) if quantiles else []
+        }
 
-def classify_intent_local(text):
-    inputs = intent_tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=64)
-    with torch.no_grad():
-        logits = intent_model(**inputs).logits
-        pred = torch.argmax(logits, dim=1).item()
-    print(f"[Intent Debug] Input: {text}")
-    print(f"[Intent Debug] Logits: {logits.tolist()}")
-    print(f"[Intent Debug] Predicted class index: {pred}")
-    print(f"[Intent Debug] Predicted intent: {id2intent[str(pred)]}")
-    return id2intent[str(pred)]
+intent_cascade = IntentCascade(build_centroid_classifier(intent_df['text'], intent_df['intent']))
+
+def classify_intent_cascade(text, vector=None, cancelled: Optional[threading.Event] = None) -> Optional[Dict[str, Any]]:
+    result = intent_cascade.classify(text, vector, cancelled=cancelled)
+    if result is None:
+        return None
+    print(f"[Intent Cascade] '{text}' -> {result['intent']} via {result['tier']} tier ({result['confidence']:.3f})")
+    return result
 
 class AnalyzeRequest(BaseModel):
     text: str
@@ -835,6 +2749,17 @@ class AnalyzeRequest(BaseModel):
     prev_bot_response: Optional[str] = ""
     last_user_message: Optional[str] = None
     history: Optional[List[str]] = []  # Keep for backward compatibility
+    deadline_ms: Optional[float] = None  # latency budget; the X-Deadline-Ms header works too
+
+class TurnRequest(BaseModel):
+    text: str
+    session_id: Optional[str] = None
+    prev_bot_response: Optional[str] = ""
+    last_user_message: Optional[str] = None
+    store: bool = True  # store the user message in semantic memory
+    include: Optional[List[str]] = None  # optional parts, see TURN_OPTIONAL_FIELDS
+    top_k: int = 5  # relevant_history size
+    deadline_ms: Optional[float] = None  # latency budget; the X-Deadline-Ms header works too
 
 class ClassifyIntentRequest(BaseModel):
     text: str
@@ -848,10 +2773,20 @@ class StoreMessageRequest(BaseModel):
     role: str  # "user" or "bot"
     timestamp: Optional[str] = None
 
+class LoadIntentModelRequest(BaseModel):
+    model_path: str
+    shadow_fraction: float = 0.0
+    auto_promote: bool = False
+
 class ConfigRequest(BaseModel):
     data_sources: Optional[List[Dict[str, Any]]] = None
     intent_config: Optional[Dict[str, Any]] = None
     semantic_config: Optional[Dict[str, Any]] = None
+    memory_config: Optional[Dict[str, Any]] = None
+    entity_config: Optional[Dict[str, Any]] = None
+    execution_config: Optional[Dict[str, Any]] = None
+    admission_config: Optional[Dict[str, Any]] = None
+    deadline_config: Optional[Dict[str, Any]] = None
     default_strategy: Optional[str] = None
 
 # Data source management
@@ -867,29 +2802,43 @@ class DataSourceManager:
             df = pd.read_csv(source_config.csv_path)
             questions = df['Question'].tolist() if 'Question' in df.columns else []
             answers = df['Answer'].tolist() if 'Answer' in df.columns else []
-            question_docs = [nlp(q) for q in questions] if questions else []
+            question_vectors = embed_texts(questions) if questions else np.zeros((0, 0), dtype=np.float32)
+            lookup_dict = {str(q).lower().strip(): {'question': q, 'answer': a}
+                           for q, a in zip(questions, answers) if not pd.isna(q)}
             
             self.sources[source_config.name] = {
                 'config': source_config,
                 'questions': questions,
                 'answers': answers,
-                'question_docs': question_docs,
+                'question_vectors': question_vectors,
+                'lookup_dict': lookup_dict,
                 'df': df
             }
             print(f"[DataSource] Loaded {source_config.name}: {len(questions)} questions")
         except Exception as e:
             print(f"[DataSource] Error loading {source_config.name}: {e}")
+
+    def replace_sources(self, source_configs: List[DataSourceConfig]):
+        """Load every source first, then swap the set, so searches never see it half loaded."""
+        staging = DataSourceManager()
+        for source_config in source_configs:
+            staging.add_source(source_config)
+        with embedding_lock:
+            self.sources = staging.sources
     
-    def search_all_sources(self, query: str) -> List[Dict[str, Any]]:
+    def search_all_sources(self, query: str, analysis: Optional[AnalysisContext] = None) -> List[Dict[str, Any]]:
         results = []
-        query_doc = nlp(query)
+        with embedding_lock:
+            backend = EMBEDDING_BACKEND
+            sources = [(name, data, data['question_vectors']) for name, data in self.sources.items()]
+        query_vector = analysis.embedding(query, backend) if analysis else embed_text(query, backend)
         
-        for source_name, source_data in self.sources.items():
+        for source_name, source_data, source_vectors in sources:
             if not source_data['config'].enabled:
                 continue
                 
-            similarities = [query_doc.similarity(q_doc) for q_doc in source_data['question_docs']]
-            if not similarities:
+            similarities = cosine_similarities(source_vectors, query_vector)
+            if not len(similarities):
                 continue
                 
             best_idx = int(np.argmax(similarities))
@@ -911,58 +2860,74 @@ class DataSourceManager:
 # Intent classification management
 class IntentManager:
     def __init__(self):
-        self.tokenizer = None
-        self.model = None
-        self.id2intent = {}
-        self.lookup_dict = {}
+        self.lookup_index: Optional[IntentLookupIndex] = None
+        self.cascade: Optional[IntentCascade] = None
+        self.top_k = 5
         self.enabled = False
         
     def setup(self, intent_config: IntentConfig):
         if not intent_config.enabled:
             return
+        self.top_k = intent_config.top_k_probabilities
             
         try:
-            # Load fine-tuned model
-            self.tokenizer = AutoTokenizer.from_pretrained(intent_config.model_path)
-            self.model = AutoModelForSequenceClassification.from_pretrained(intent_config.model_path)
-            
-            with open(f"{intent_config.model_path}/id2intent.json", "r") as f:
-                self.id2intent = json.load(f)
+            # Model weights live in the shared registry; a different path is loaded in the
+            # background and swapped in atomically (after shadowing, when a fraction is set)
+            active = intent_registry.active
+            if active is None or os.path.abspath(active.model_path) != os.path.abspath(intent_config.model_path):
+                status = intent_registry.load_candidate(intent_config.model_path,
+                                                        shadow_fraction=intent_config.shadow_fraction,
+                                                        auto_promote=intent_config.shadow_fraction <= 0,
+                                                        prepare=prepare_intent_candidate)
+                print(f"[Intent] Candidate model {intent_config.model_path}: {status}")
             
             # Load lookup CSV if provided
             if intent_config.lookup_csv_path:
                 intent_df = pd.read_csv(intent_config.lookup_csv_path)
-                self.lookup_dict = {str(q).strip().lower(): i for q, i in zip(intent_df['text'], intent_df['intent'])}
+                self.lookup_index = IntentLookupIndex(intent_df['text'], intent_df['intent'],
+                                                      fuzzy_threshold=intent_config.fuzzy_threshold)
+                if intent_config.cascade_enabled:
+                    self.cascade = IntentCascade(build_centroid_classifier(
+                        intent_df['text'], intent_df['intent'],
+                        target_precision=intent_config.cascade_target_precision,
+                        margin_threshold=intent_config.cascade_margin_threshold))
             
             self.enabled = True
-            print(f"[Intent] Loaded model with {len(self.id2intent)} intents")
+            print(f"[Intent] Intent classification enabled (active model v{intent_registry.active.version})")
         except Exception as e:
             print(f"[Intent] Error loading intent model: {e}")
     
-    def classify(self, text: str) -> Dict[str, Any]:
+    def _predict(self, text: str) -> Dict[str, Any]:
+        return predict_intent_transformer(text)
+
+    def classify(self, text: str, vector=None) -> Dict[str, Any]:
         if not self.enabled:
             return {'intent': 'unknown', 'confidence': 0.0, 'method': 'disabled'}
         
-        # Try exact lookup first
-        exact_intent = self.lookup_dict.get(str(text).strip().lower())
-        if exact_intent:
-            return {'intent': exact_intent, 'confidence': 1.0, 'method': 'exact_lookup'}
+        # Try exact / normalized / fuzzy lookup first
+        match = self.lookup_index.lookup(text) if self.lookup_index else None
+        if match:
+            return {'intent': match['intent'], 'confidence': match['score'], 'method': f"{match['match_type']}_lookup"}
         
-        # Use model classification
+        # Cheap centroid tier first when configured, transformer on low margin
         try:
-            inputs = self.tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=64)
-            with torch.no_grad():
-                logits = self.model(**inputs).logits
-                probabilities = torch.softmax(logits, dim=1)
-                pred = torch.argmax(logits, dim=1).item()
-                confidence = float(probabilities[0][pred])
-            
-            intent = self.id2intent.get(str(pred), 'unknown')
+            if self.cascade:
+                result = self.cascade.classify(text, vector, transformer=self._predict)
+            else:
+                result = self._predict(text)
+                result['tier'] = 'transformer'
+            if result['tier'] == 'vector':
+                return {
+                    'intent': result['intent'],
+                    'confidence': result['confidence'],
+                    'margin': result['margin'],
+                    'method': 'vector_centroid'
+                }
             return {
-                'intent': intent,
-                'confidence': confidence,
+                'intent': result['intent'],
+                'confidence': result['confidence'],
                 'method': 'model_classification',
-                'all_probabilities': probabilities[0].tolist()
+                'top_probabilities': top_probabilities(result['probabilities'], result['id2intent'], self.top_k)
             }
         except Exception as e:
             print(f"[Intent] Error in classification: {e}")
@@ -975,18 +2940,20 @@ intent_manager = IntentManager()
 # Generic analysis function
 def analyze_text(text: str, session_id: Optional[str] = None, 
                 prev_bot_response: str = "", last_user_message: str = None,
-                strategy: AnalysisStrategy = None) -> Dict[str, Any]:
+                strategy: AnalysisStrategy = None, deadline_ms: Optional[float] = None) -> Dict[str, Any]:
     
     if strategy is None:
         strategy = config.default_strategy
+    analysis = AnalysisContext(deadline=request_deadline(None, deadline_ms))
     
     # Store user message
     if session_id:
-        add_message_to_chroma(session_id, text, "user")
+        add_message_to_chroma(session_id, text, "user", analysis=analysis)
     
     # Coreference resolution
     original_text = text
-    resolved_text = resolve_coref(text, prev_bot_response, last_user_message)
+    resolved_text = analysis.deadline.run("coref", text, resolve_coref, text, prev_bot_response, last_user_message,
+                                          session_id, analysis)
     rewritten = resolved_text if resolved_text != text else None
     text = resolved_text
     
@@ -1003,14 +2970,16 @@ def analyze_text(text: str, session_id: Optional[str] = None,
     if strategy == AnalysisStrategy.EXACT_MATCH:
         result.update(analyze_exact_match(text))
     elif strategy == AnalysisStrategy.SEMANTIC_SEARCH:
-        result.update(analyze_semantic_search(text))
+        result.update(analyze_semantic_search(text, analysis))
     elif strategy == AnalysisStrategy.INTENT_CLASSIFICATION:
-        result.update(analyze_intent_classification(text))
+        result.update(analyze_intent_classification(text, analysis))
     elif strategy == AnalysisStrategy.CONTEXT_AWARE:
-        result.update(analyze_context_aware(text, session_id))
+        result.update(analyze_context_aware(text, session_id, analysis))
     elif strategy == AnalysisStrategy.HYBRID:
-        result.update(analyze_hybrid(text, session_id))
+        result.update(analyze_hybrid(text, session_id, analysis))
+    result['skipped_stages'] = list(analysis.deadline.skipped)
     
+    analysis.record("analyze_text")
     return result
 
 def analyze_exact_match(text: str) -> Dict[str, Any]:
@@ -1030,8 +2999,8 @@ def analyze_exact_match(text: str) -> Dict[str, Any]:
     
     return {'source': 'exact_match', 'confidence': 0.0}
 
-def analyze_semantic_search(text: str) -> Dict[str, Any]:
-    results = data_manager.search_all_sources(text)
+def analyze_semantic_search(text: str, analysis: Optional[AnalysisContext] = None) -> Dict[str, Any]:
+    results = data_manager.search_all_sources(text, analysis)
     
     if results:
         best_result = results[0]
@@ -1046,8 +3015,9 @@ def analyze_semantic_search(text: str) -> Dict[str, Any]:
     
     return {'source': 'semantic_search', 'similarity': 0.0}
 
-def analyze_intent_classification(text: str) -> Dict[str, Any]:
-    intent_result = intent_manager.classify(text)
+def analyze_intent_classification(text: str, analysis: Optional[AnalysisContext] = None) -> Dict[str, Any]:
+    analysis = analysis or AnalysisContext()
+    intent_result = intent_manager.classify(text, analysis.vector(text))
     return {
         'source': 'intent_classification',
         'intent': intent_result['intent'],
@@ -1055,135 +3025,567 @@ def analyze_intent_classification(text: str) -> Dict[str, Any]:
         'method': intent_result['method']
     }
 
-def analyze_context_aware(text: str, session_id: Optional[str] = None) -> Dict[str, Any]:
-    relevant_history = get_relevant_history(text, session_id)
+def analyze_context_aware(text: str, session_id: Optional[str] = None,
+                          analysis: Optional[AnalysisContext] = None) -> Dict[str, Any]:
+    analysis = analysis or AnalysisContext()
+    deadline = analysis.deadline
+    relevant_history = deadline.run("relevant_history", [], get_relevant_history, text, session_id, analysis=analysis)
     context_messages = [msg["message"] for msg in relevant_history if msg["role"] == "bot"]
     context_used = " | ".join(context_messages[-2:]) if context_messages else None
     
     # Extract entities
-    doc = nlp(text)
-    entities = {ent.label_: ent.text for ent in doc.ents}
+    entities = deadline.run("entities", {}, analysis.entities, text)
     
     return {
         'source': 'context_aware',
         'entities': entities,
         'context_used': context_used,
-        'relevant_history': relevant_history
+        'relevant_history': relevant_history,
+        'skipped_stages': list(deadline.skipped)
     }
 
-def analyze_hybrid(text: str, session_id: Optional[str] = None) -> Dict[str, Any]:
-    # Try exact match first
+def analyze_hybrid(text: str, session_id: Optional[str] = None,
+                   analysis: Optional[AnalysisContext] = None) -> Dict[str, Any]:
+    analysis = analysis or AnalysisContext()
+    # Try exact match first (a dictionary lookup, so nothing else is started for a hit)
     exact_result = analyze_exact_match(text)
     if exact_result['confidence'] > 0.9:
         return exact_result
     
-    # Try semantic search
-    semantic_result = analyze_semantic_search(text)
-    if semantic_result['similarity'] > 0.8:
-        return semantic_result
-    
-    # Try intent classification
-    intent_result = analyze_intent_classification(text)
-    if intent_result['confidence'] > 0.7:
-        return intent_result
-    
-    # Fall back to context-aware analysis
-    context_result = analyze_context_aware(text, session_id)
-    return context_result
+    # Semantic search, intent classification and the context-aware fallback run at once; the
+    # first in that order to cross its threshold is the answer and the rest are cancelled
+    race = StageRace({
+        'semantic_search': (analyze_semantic_search, text, analysis),
+        'intent_classification': (analyze_intent_classification, text, analysis),
+        'context_aware': (analyze_context_aware, text, session_id, analysis),
+    }, cancelled=analysis.deadline.cancelled)
+    _, result = race.first_decisive([
+        ('semantic_search', lambda r: r['similarity'] > 0.8),
+        ('intent_classification', lambda r: r['confidence'] > 0.7),
+        ('context_aware', None),
+    ])
+    return result
+
+# Response serialization: orjson when installed (NumPy arrays and scalars natively), msgpack
+# when the client asks for it (Accept: application/msgpack), the json module otherwise.
+# ?fields=source,answer,intent keeps only those keys ("a.b" keeps b inside a).
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+serialization_stats: Dict[str, Dict[str, Any]] = {}
+
+def _plain(value):
+    if hasattr(value, "tolist"):  # NumPy and torch values
+        return value.tolist()
+    if isinstance(value, Enum):
+        return value.value
+    return str(value)
+
+def project_fields(payload: Any, fields: List[str]) -> Any:
+    if not fields or not isinstance(payload, dict):
+        return payload
+    projected: Dict[str, Any] = {}
+    for path in fields:
+        head, _, rest = path.partition(".")
+        if head not in payload:
+            continue
+        if not rest or not isinstance(payload[head], dict) or head in fields:
+            projected[head] = payload[head]
+        else:
+            projected.setdefault(head, {}).update(project_fields(payload[head], [rest]))
+    return projected
+
+def serialize_payload(payload: Any, accept: str = "") -> tuple:
+    if msgpack is not None and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        return msgpack.packb(payload, default=_plain, use_bin_type=True), "application/msgpack", "msgpack"
+    if orjson is not None:
+        return (orjson.dumps(payload, default=_plain, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS),
+                "application/json", "orjson")
+    return json.dumps(payload, default=_plain).encode("utf-8"), "application/json", "json"
+
+def compact_response(http_request: Request, payload: Any, endpoint: str) -> Response:
+    fields = [f.strip() for f in (http_request.query_params.get("fields") or "").split(",") if f.strip()]
+    start = time.perf_counter()
+    body, media_type, encoder = serialize_payload(project_fields(payload, fields), http_request.headers.get("accept", ""))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    stats = serialization_stats.setdefault(endpoint, {'responses': 0, 'bytes': 0, 'max_bytes': 0, 'serialize_ms': 0.0,
+                                                      'projected': 0, 'encoders': {}})
+    stats['responses'] += 1
+    stats['bytes'] += len(body)
+    stats['max_bytes'] = max(stats['max_bytes'], len(body))
+    stats['serialize_ms'] += elapsed_ms
+    stats['projected'] += bool(fields)
+    stats['encoders'][encoder] = stats['encoders'].get(encoder, 0) + 1
+    return Response(content=body, media_type=media_type,
+                    headers={"X-Serialize-Ms": f"{elapsed_ms:.3f}", "X-Payload-Bytes": str(len(body))})
+
+def serialization_stats_report() -> Dict[str, Any]:
+    return {
+        'encoder': 'orjson' if orjson is not None else 'json',
+        'msgpack_available': msgpack is not None,
+        'endpoints': {endpoint: {**stats, 'mean_bytes': stats['bytes'] / stats['responses'],
+                                 'mean_serialize_ms': stats['serialize_ms'] / stats['responses']}
+                      for endpoint, stats in serialization_stats.items()}
+    }
 
 @app.post("/analyze")
-async def analyze(request: AnalyzeRequest):
+async def analyze(request: AnalyzeRequest, http_request: Request):
+    reason = oversized_input(request)
+    if reason:
+        return input_rejection(reason)
+    analysis = AnalysisContext(deadline=request_deadline(http_request, request.deadline_ms))
+    result = await model_pool.run(analyze_request, request, analysis)
+    analysis.record("/analyze")
+    return compact_response(http_request, result, "/analyze")
+
+def analyze_request(request: AnalyzeRequest, analysis: AnalysisContext) -> Dict[str, Any]:
+    # The first "result" stage is the response; closing the generator skips the later stages
+    with closing(analyze_stages(request, analysis)) as stages:
+        for stage, payload in stages:
+            if stage == "result":
+                return payload
+
+def analyze_stages(request: AnalyzeRequest, analysis: AnalysisContext):
+    """/analyze as a sequence of (stage, payload) events, cheapest first.
+
+    A "result" event carries what /analyze returns: right after a lookup hit or a KB match
+    above the threshold, otherwise after the intent stage. The KB, history, entity and intent
+    stages start together once the lookup misses. Until the KB stage has answered, nothing else
+    is pulled onto the calling thread, so a KB hit returns as soon as it is found; stages not yet
+    started when the consumer stops reading are cancelled, and started ones skip their
+    remaining steps.
+    """
     text = request.text
     session_id = request.session_id
     prev_bot_response = request.prev_bot_response or ""
     last_user_message = request.last_user_message
-    history = request.history or []
-    context_used = None
+    decided = False
 
     # Store the user message in ChromaDB for future semantic retrieval
     if session_id:
-        add_message_to_chroma(session_id, text, "user")
+        message_id = add_message_to_chroma(session_id, text, "user", analysis=analysis)
+        yield "stored", {"message_id": message_id}
 
     # Coreference resolution for multi-turn context
     print(f"[Coreferee DEBUG] User message: '{text}'")
     print(f"[Coreferee DEBUG] Last bot message: '{prev_bot_response}'")
     print(f"[Coreferee DEBUG] Last user message: '{last_user_message}'")
-    resolved_text = resolve_coref(text, prev_bot_response, last_user_message)
+    deadline = analysis.deadline
+    resolved_text = deadline.run("coref", text, resolve_coref, text, prev_bot_response, last_user_message,
+                                 session_id, analysis)
     print(f"[Coreferee DEBUG] Resolved (rewritten) message: '{resolved_text}'")
     rewritten = None
     if resolved_text != text:
         print(f"[Coreferee] Rewrote '{text}' to '{resolved_text}' using context.")
         rewritten = resolved_text
         text = resolved_text
+    yield "coref", {"resolved_text": text, "rewritten": rewritten}
 
-    # 0. Hybrid: Exact intent lookup first (domain-specific)
-    exact_intent = lookup_intent_exact(text)
-    if exact_intent:
-        return {
+    # 0. Hybrid: Exact / near-exact intent lookup first (domain-specific)
+    lookup_match = lookup_intent(text)
+    yield "lookup", {"match": lookup_match}
+    if lookup_match:
+        decided = True
+        yield "result", {
             "source": "csv_lookup",
-            "intent": exact_intent,
+            "intent": lookup_match["intent"],
+            "match_type": lookup_match["match_type"],
             "matched_question": text,
-            "rewritten": rewritten
+            "rewritten": rewritten,
+            "skipped_stages": list(deadline.skipped)
         }
 
+    # Stages 1-3 do not depend on each other: start them together, report them in order, and
+    # cancel the rest once the consumer stops reading (/analyze, after a result)
+    race = StageRace({
+        "kb": (kb_search, text, session_id, analysis) if questions and len(question_vectors) else (lambda: None,),
+        "relevant_history": (deadline.run, "relevant_history", None, get_relevant_history, text, session_id, 5,
+                             analysis) if session_id else (lambda: None,),
+        "entities": (deadline.run, "entities", None, analysis.entities, text),
+        "intent": (lambda: classify_intent_cascade(text, analysis.vector(text), deadline.cancelled),),
+    }, decisive=("kb",) if questions and len(question_vectors) and not decided else (), cancelled=deadline.cancelled)
+    try:
+        yield from analyze_race_stages(race, text, rewritten, decided, deadline)
+    finally:
+        race.cancel()
+
+def analyze_race_stages(race: StageRace, text: str, rewritten: Optional[str], decided: bool, deadline: Deadline):
+    context_used = None
+
     # 1. Try semantic search in CSV using spaCy similarity (domain-specific threshold)
-    if questions and question_docs:
-        # Get recent conversation context for better search
-        context_messages = []
-        if session_id:
-            recent_history = get_session_history(session_id, limit=3)
-            context_messages = [msg["message"] for msg in recent_history if msg["role"] == "bot"]
-        
-        # Use enhanced context-aware search
-        best_idx, best_score = search_with_context(text, context_messages)
+    if questions and len(question_vectors):
+        # Enhanced context-aware search (recent conversation context), budget permitting
+        best_idx, best_score = race.result("kb")
         if best_idx >= 0:
             print(f"[Semantic Search] User Query: {text}")
             print(f"[Semantic Search] Best Match: {questions[best_idx]}")
             print(f"[Semantic Search] Similarity Score: {best_score}")
-            if best_score > config.data_sources[0].similarity_threshold:
-                return {
+            above_threshold = best_score > config.data_sources[0].similarity_threshold
+            yield "kb", {"matched_question": questions[best_idx], "similarity": best_score,
+                         "above_threshold": above_threshold}
+            if above_threshold and not decided:
+                decided = True
+                yield "result", {
                     "source": "csv",
                     "answer": answers[best_idx],
                     "similarity": best_score,
                     "matched_question": questions[best_idx],
-                    "rewritten": rewritten
+                    "rewritten": rewritten,
+                    "skipped_stages": list(deadline.skipped)
                 }
 
     # 2. Get semantically relevant chat history using spaCy similarity
-    relevant_history = []
-    if session_id:
-        relevant_history = get_relevant_history(text, session_id, top_k=5)
+    relevant_history = race.result("relevant_history")
+    if relevant_history is None:
+        relevant_history = []  # no session, or skipped for the budget
+    else:
         print(f"[Context] Retrieved {len(relevant_history)} relevant messages from semantic memory")
         if relevant_history:
             context_messages = [msg["message"] for msg in relevant_history if msg["role"] == "bot"]
             if context_messages:
                 context_used = " | ".join(context_messages[-2:])
+        yield "relevant_history", {"relevant_history": relevant_history, "context_used": context_used}
 
     # 3. Context-aware intent/entity extraction (domain-specific confidence)
-    doc = nlp(text)
-    entities = {ent.label_: ent.text for ent in doc.ents}
-    intent_result = classify_intent_local(text)
+    entities = race.result("entities")
+    if entities is None:
+        entities = {}  # skipped for the budget
+    else:
+        yield "entities", {"entities": entities}
+    intent_prediction = race.result("intent")
+    intent_result = intent_prediction["intent"]
     
     # Check if intent confidence meets domain threshold
     intent_confidence = 0.9  # Default high confidence for exact matches
     if intent_result != "unknown":
         intent_confidence = 0.8  # High confidence for model classification
+    yield "intent", {"intent": intent_result, "confidence": intent_confidence, "intent_tier": intent_prediction["tier"]}
     
-    return {
-        "source": "llm",
-        "intent": intent_result,
-        "entities": entities,
-        "context_used": context_used,
-        "relevant_history": relevant_history,
-        "rewritten": rewritten,
-        "confidence": intent_confidence
-    }
+    if not decided:
+        yield "result", {
+            "source": "llm",
+            "intent": intent_result,
+            "entities": entities,
+            "context_used": context_used,
+            "relevant_history": relevant_history,
+            "rewritten": rewritten,
+            "confidence": intent_confidence,
+            "intent_tier": intent_prediction["tier"],
+            "skipped_stages": list(deadline.skipped)
+        }
+    if deadline.budget_ms is not None:
+        yield "deadline", {"skipped_stages": list(deadline.skipped), "remaining_ms": deadline.remaining_ms()}
+
+# Streaming /analyze: each stage is sent as soon as it is ready (NDJSON, or server-sent events
+# with format=sse or Accept: text/event-stream). Stages run one at a time on the model pool;
+# once the client disconnects or cancels, no further stage is started.
+active_streams: Dict[str, threading.Event] = {}
+stream_stats = {'streams': 0, 'completed': 0, 'cancelled': 0, 'disconnected': 0, 'stages': 0,
+                'results': 0, 'first_result_ms': 0.0}
+
+def _stream_event(stream_format: str, stage: str, data: Dict[str, Any], ms: Optional[float] = None) -> str:
+    event = {"stage": stage, "ms": ms, "data": data}
+    body = json.dumps(event, default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o))
+    if stream_format == "sse":
+        return f"event: {stage}\ndata: {body}\n\n"
+    return body + "\n"
+
+@app.post("/analyze/stream")
+async def analyze_stream(request: AnalyzeRequest, http_request: Request, format: Optional[str] = None,
+                         stop_after_result: bool = False):
+    """Stream /analyze stage by stage; stop_after_result ends the stream at the first result."""
+    reason = oversized_input(request)
+    if reason:
+        return input_rejection(reason)
+    stream_format = format or ("sse" if "text/event-stream" in http_request.headers.get("accept", "") else "ndjson")
+    if stream_format not in ("ndjson", "sse"):
+        return JSONResponse({"status": "error", "message": "format must be 'ndjson' or 'sse'"}, status_code=400)
+    stream_id = uuid.uuid4().hex
+    cancelled = threading.Event()
+    active_streams[stream_id] = cancelled
+    analysis = AnalysisContext(deadline=request_deadline(http_request, request.deadline_ms))
+    stages = analyze_stages(request, analysis)
+    stages_lock = threading.Lock()  # a generator cannot be closed while a step is running it
+    stream_stats['streams'] += 1
+
+    def step():
+        with stages_lock:
+            return None if cancelled.is_set() else next(stages, None)
+
+    def close_stages(disconnected: bool = False):
+        with stages_lock:
+            stages.close()  # runs analyze_stages' finally: raced stages that have not started are cancelled
+        if disconnected:
+            analysis.record("/analyze/stream (disconnected)")
+
+    async def events():
+        start = time.perf_counter()
+        finished = False
+        try:
+            yield _stream_event(stream_format, "stream", {"stream_id": stream_id})
+            while True:
+                stage_start = time.perf_counter()
+                event = await model_pool.run(step)
+                if event is None:
+                    break
+                stage, payload = event
+                stream_stats['stages'] += 1
+                if stage == "result":
+                    stream_stats['results'] += 1
+                    stream_stats['first_result_ms'] += (time.perf_counter() - start) * 1000
+                yield _stream_event(stream_format, stage, payload, (time.perf_counter() - stage_start) * 1000)
+                if stage == "result" and stop_after_result:
+                    break
+            finished = True
+            yield _stream_event(stream_format, "done", {"cancelled": cancelled.is_set(),
+                                                        "analysis": analysis.record("/analyze/stream")},
+                                (time.perf_counter() - start) * 1000)
+        finally:
+            # A disconnect cancels this generator mid-await; the step already on a worker
+            # finishes, then a worker closes the stages so queued stage work is dropped too
+            if not finished:
+                stream_stats['disconnected'] += 1
+            elif cancelled.is_set():
+                stream_stats['cancelled'] += 1
+            else:
+                stream_stats['completed'] += 1
+            cancelled.set()
+            active_streams.pop(stream_id, None)
+            if finished:
+                close_stages()
+            else:
+                model_pool.submit(close_stages, True)
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"X-Stream-Id": stream_id})
+
+@app.post("/analyze/stream/{stream_id}/cancel")
+async def cancel_analyze_stream(stream_id: str):
+    cancelled = active_streams.get(stream_id)
+    if cancelled is None:
+        return {"status": "unknown", "stream_id": stream_id}
+    cancelled.set()
+    return {"status": "cancelled", "stream_id": stream_id}
+
+def stream_stats_report() -> Dict[str, Any]:
+    results = stream_stats['results']
+    return {**stream_stats, 'active': len(active_streams),
+            'mean_first_result_ms': stream_stats['first_result_ms'] / results if results else 0.0}
+
+# Everything the chat orchestrator needs for one user message, in one call. Mandatory parts
+# (stored message, coreference, lookup, KB match, intent) always run; the optional ones only
+# when listed in TurnRequest.include. All stages share one AnalysisContext.
+TURN_OPTIONAL_FIELDS = ("entities", "relevant_history")
+
+@app.post("/turn")
+async def turn(request: TurnRequest, http_request: Request):
+    reason = oversized_input(request)
+    if reason:
+        return input_rejection(reason)
+    unknown = set(request.include or []) - set(TURN_OPTIONAL_FIELDS)
+    if unknown:
+        return {"status": "error", "message": f"Unknown include fields {sorted(unknown)}; expected {TURN_OPTIONAL_FIELDS}"}
+    analysis = AnalysisContext(deadline=request_deadline(http_request, request.deadline_ms))
+    result = await model_pool.run(turn_request, request, analysis)
+    result["analysis"] = analysis.record("/turn")
+    return compact_response(http_request, result, "/turn")
+
+def turn_request(request: TurnRequest, analysis: AnalysisContext,
+                 context_messages: Optional[List[str]] = None) -> Dict[str, Any]:
+    include = set(request.include or [])
+    session_id = request.session_id
+    message_id = None
+    if session_id and request.store:
+        message_id = add_message_to_chroma(session_id, request.text, "user", analysis=analysis)
+
+    deadline = analysis.deadline
+    text = deadline.run("coref", request.text, resolve_coref, request.text, request.prev_bot_response or "",
+                        request.last_user_message, session_id, analysis)
+    result = {"text": request.text, "resolved_text": text, "rewritten": text if text != request.text else None,
+              "message_id": message_id}
+
+    lookup_match = lookup_intent(text)
+    result["lookup"] = lookup_match
+
+    result["kb"] = None
+    if questions and len(question_vectors):
+        best_idx, best_score = kb_search(text, session_id, analysis, context_messages)
+        if best_idx >= 0:
+            result["kb"] = {"answer": answers[best_idx], "similarity": best_score,
+                            "matched_question": questions[best_idx],
+                            "above_threshold": best_score > config.data_sources[0].similarity_threshold}
+
+    if lookup_match:
+        result["intent"] = {"intent": lookup_match["intent"], "tier": "lookup", "confidence": 1.0,
+                            "match_type": lookup_match["match_type"]}
+    else:
+        prediction = classify_intent_cascade(text, analysis.vector(text))
+        result["intent"] = {"intent": prediction["intent"], "tier": prediction["tier"],
+                            "confidence": float(prediction["confidence"])}
+        if prediction["tier"] == "transformer":
+            result["intent"]["top_probabilities"] = top_probabilities(
+                prediction["probabilities"], prediction["id2intent"], intent_manager.top_k)
+
+    # Same routing as /analyze: lookup, then a KB answer above the threshold, else the LLM
+    if lookup_match:
+        result["source"] = "csv_lookup"
+    elif result["kb"] and result["kb"]["above_threshold"]:
+        result["source"] = "csv"
+    else:
+        result["source"] = "llm"
+
+    if "entities" in include:
+        spans = deadline.run("entities", [], analysis.entity_spans, text)
+        result["entities"] = entities_by_label(spans)
+        result["entity_spans"] = spans
+    if "relevant_history" in include:
+        relevant_history = []
+        if session_id:
+            relevant_history = deadline.run("relevant_history", [], get_relevant_history, text, session_id,
+                                            request.top_k, analysis)
+        bot_messages = [msg["message"] for msg in relevant_history if msg["role"] == "bot"]
+        result["relevant_history"] = relevant_history
+        result["context_used"] = " | ".join(bot_messages[-2:]) if bot_messages else None
+    result["skipped_stages"] = list(deadline.skipped)
+    return result
+
+# One WebSocket per chat session. The connection keeps the session's recent turns, the previous
+# bot reply and the vectors computed for earlier turns, so a message is analyzed without the
+# client re-sending context or the service re-reading it from ChromaDB.
+#   {"type": "user", "text": ..., "include": [...], "store": true, "top_k": 5} -> {"type": "turn", ...}
+#   {"type": "bot", "text": ..., "store": true}                                 -> {"type": "stored", ...}
+class ChatSession:
+    max_turns = 10
+    max_vectors = 256
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.turns: deque = deque(maxlen=self.max_turns)  # (role, message)
+        self.prev_bot_response = ""
+        self.last_user_message: Optional[str] = None
+        self.embeddings: Dict[tuple, np.ndarray] = {}
+        self.messages = 0
+        self.opened = time.time()
+
+    def load_history(self):
+        for msg in get_session_history(self.session_id, limit=self.max_turns):
+            self.add_turn(msg["role"], msg["message"])
+
+    def add_turn(self, role: str, message: str):
+        self.turns.append((role, message))
+        if role == "bot":
+            self.prev_bot_response = message
+        else:
+            self.last_user_message = message
+
+    def context_messages(self) -> List[str]:
+        """Bot replies among the last three turns, as turn_request reads them from ChromaDB."""
+        return [message for role, message in list(self.turns)[-3:] if role == "bot"]
+
+    def analysis(self) -> AnalysisContext:
+        while len(self.embeddings) > self.max_vectors:
+            del self.embeddings[next(iter(self.embeddings))]  # oldest first
+        return AnalysisContext(self.embeddings)
+
+    def user_turn(self, message: Dict[str, Any], received_at: Optional[float] = None) -> Dict[str, Any]:
+        request = TurnRequest(text=message["text"], session_id=self.session_id, prev_bot_response=self.prev_bot_response,
+                              last_user_message=self.last_user_message, store=message.get("store", True),
+                              include=message.get("include"), top_k=message.get("top_k", 5),
+                              deadline_ms=message.get("deadline_ms"))
+        unknown = set(request.include or []) - set(TURN_OPTIONAL_FIELDS)
+        if unknown:
+            return {"type": "error", "message": f"Unknown include fields {sorted(unknown)}; expected {TURN_OPTIONAL_FIELDS}"}
+        reason = oversized_input(request)
+        if reason:
+            admission_stats['oversized'] += 1
+            return {"type": "error", "message": reason}
+        analysis = self.analysis()
+        analysis.deadline = request_deadline(None, request.deadline_ms)
+        if received_at is not None:
+            analysis.deadline.started = received_at
+        result = turn_request(request, analysis, self.context_messages())
+        self.add_turn("user", request.text)
+        result["analysis"] = analysis.record("/ws/chat")
+        return {"type": "turn", **result}
+
+    def bot_turn(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        reason = oversized_input({"message": message["text"]})
+        if reason:
+            admission_stats['oversized'] += 1
+            return {"type": "error", "message": reason}
+        message_id = None
+        if message.get("store", True):
+            message_id = add_message_to_chroma(self.session_id, message["text"], "bot", analysis=self.analysis())
+        self.add_turn("bot", message["text"])
+        return {"type": "stored", "message_id": message_id}
+
+    def stats(self) -> Dict[str, Any]:
+        return {'messages': self.messages, 'turns': len(self.turns), 'cached_vectors': len(self.embeddings),
+                'open_s': round(time.time() - self.opened, 1)}
+
+chat_sessions: Dict[str, List[ChatSession]] = {}
+chat_socket_stats = {'opened': 0, 'messages': 0, 'errors': 0}
+
+@app.websocket("/ws/chat/{session_id}")
+async def chat_socket(websocket: WebSocket, session_id: str):
+    await websocket.accept()
+    session = ChatSession(session_id)
+    await storage_pool.run(session.load_history)
+    chat_sessions.setdefault(session_id, []).append(session)
+    chat_socket_stats['opened'] += 1
+    try:
+        while True:
+            message = await websocket.receive_json()
+            received_at = time.monotonic()
+            start = time.perf_counter()
+            session.messages += 1
+            chat_socket_stats['messages'] += 1
+            kind = message.get("type", "user")
+            # Each turn counts as a request, so a memory reset waits for it and holds the next one back
+            await request_gate.enter()
+            try:
+                if kind == "user":
+                    reply = await model_pool.run(session.user_turn, message, received_at)
+                elif kind == "bot":
+                    reply = await model_pool.run(session.bot_turn, message)
+                else:
+                    reply = {"type": "error", "message": f"Unknown message type {kind!r}; expected 'user' or 'bot'"}
+            except Exception as e:
+                chat_socket_stats['errors'] += 1
+                reply = {"type": "error", "message": str(e)}
+            finally:
+                request_gate.exit()
+            reply["ms"] = (time.perf_counter() - start) * 1000
+            body, _, _ = serialize_payload(reply)
+            await websocket.send_text(body.decode("utf-8"))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        chat_sessions[session_id].remove(session)
+        if not chat_sessions[session_id]:
+            del chat_sessions[session_id]
+
+def chat_socket_stats_report() -> Dict[str, Any]:
+    return {**chat_socket_stats, 'active': sum(len(s) for s in chat_sessions.values()),
+            'sessions': {session_id: [session.stats() for session in sessions]
+                         for session_id, sessions in chat_sessions.items()}}
 
 @app.post("/store_message")
 async def store_message(request: StoreMessageRequest):
     """Store a message in ChromaDB for semantic memory."""
+    reason = oversized_input(request)
+    if reason:
+        return input_rejection(reason)
     try:
-        message_id = add_message_to_chroma(
+        message_id = await model_pool.run(
+            add_message_to_chroma,
             request.session_id, 
             request.message, 
             request.role, 
@@ -1194,42 +3596,65 @@ async def store_message(request: StoreMessageRequest):
         return {"status": "error", "message": str(e)}
 
 @app.get("/get_relevant_history")
-async def get_relevant_history_endpoint(query: str, session_id: Optional[str] = None, top_k: int = 5):
+async def get_relevant_history_endpoint(http_request: Request, query: str, session_id: Optional[str] = None,
+                                        top_k: int = 5):
     """Get semantically relevant chat history for a query."""
+    reason = oversized_input({"query": query})
+    if reason:
+        return input_rejection(reason)
     try:
-        relevant_history = get_relevant_history(query, session_id, top_k)
-        return {"relevant_history": relevant_history}
+        relevant_history = await model_pool.run(get_relevant_history, query, session_id, top_k)
+        return compact_response(http_request, {"relevant_history": relevant_history}, "/get_relevant_history")
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @app.get("/get_session_history")
-async def get_session_history_endpoint(session_id: str, limit: int = 10):
+async def get_session_history_endpoint(http_request: Request, session_id: str, limit: int = 10):
     """Get recent messages from a specific session."""
     try:
-        history = get_session_history(session_id, limit)
-        return {"session_history": history}
+        history = await storage_pool.run(get_session_history, session_id, limit)
+        return compact_response(http_request, {"session_history": history}, "/get_session_history")
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @app.post("/classify_intent")
-async def classify_intent(request: ClassifyIntentRequest):
-    text = request.text
-    # Hybrid: Exact intent lookup first
-    exact_intent = lookup_intent_exact(text)
-    if exact_intent:
-        return {"intent": exact_intent, "source": "csv_lookup"}
-    intent = classify_intent_local(text)
-    return {"intent": intent, "source": "model"}
+async def classify_intent(request: ClassifyIntentRequest, http_request: Request):
+    reason = oversized_input(request)
+    if reason:
+        return input_rejection(reason)
+    return compact_response(http_request, await model_pool.run(classify_intent_request, request.text), "/classify_intent")
+
+def classify_intent_request(text: str) -> Dict[str, Any]:
+    # Hybrid: Exact / near-exact intent lookup first
+    lookup_match = lookup_intent(text)
+    if lookup_match:
+        return {"intent": lookup_match["intent"], "source": "csv_lookup", "match_type": lookup_match["match_type"]}
+    intent_prediction = classify_intent_cascade(text)
+    result = {"intent": intent_prediction["intent"], "source": "model", "intent_tier": intent_prediction["tier"]}
+    if intent_prediction["tier"] == "transformer":
+        result["top_probabilities"] = top_probabilities(intent_prediction["probabilities"], intent_prediction["id2intent"],
+                                                        intent_manager.top_k)
+    return result
 
 @app.post("/extract_entities")
-async def extract_entities(request: ExtractEntitiesRequest):
-    text = request.text
-    doc = nlp(text)
-    entities = {ent.label_: ent.text for ent in doc.ents}
-    return {"entities": entities}
+async def extract_entities(request: ExtractEntitiesRequest, http_request: Request):
+    reason = oversized_input(request)
+    if reason:
+        return input_rejection(reason)
+    analysis = AnalysisContext()
+    spans = await model_pool.run(analysis.entity_spans, request.text)
+    analysis.record("/extract_entities")
+    return compact_response(http_request, {"entities": entities_by_label(spans), "entity_spans": spans}, "/extract_entities")
 
 @app.post("/resolve_coref")
-async def resolve_coref_endpoint(request: AnalyzeRequest):
+async def resolve_coref_endpoint(request: AnalyzeRequest, http_request: Request):
+    reason = oversized_input(request)
+    if reason:
+        return input_rejection(reason)
+    return compact_response(http_request, {"resolved": await model_pool.run(resolve_coref_request, request)},
+                            "/resolve_coref")
+
+def resolve_coref_request(request: AnalyzeRequest) -> str:
     last_user = None
     if request.session_id:
         session_history = get_session_history(request.session_id, limit=2)
@@ -1239,32 +3664,357 @@ async def resolve_coref_endpoint(request: AnalyzeRequest):
                     last_user = msg["message"]
                     break
     last_bot = request.prev_bot_response
-    resolved = resolve_coref(request.text, last_bot, last_user)
-    return {"resolved": resolved}
+    return resolve_coref(request.text, last_bot, last_user, request.session_id)
+
+def prepare_intent_candidate(candidate: IntentModelVersion):
+    """Embed with a candidate before the swap: stored intent_model chat messages, and the KB
+    questions when it serves embeddings."""
+    stored = storage_pool.call(chat_store("intent_model").get, include=["documents"])
+    candidate.chat_vectors = (stored["ids"], embed_texts(stored["documents"] or [], "intent_model",
+                                                         model_version=candidate))
+    if EMBEDDING_BACKEND != "intent_model":
+        return
+    candidate.kb_vectors = {'__kb__': embed_texts(questions, "intent_model", model_version=candidate)}
+    for name, source_data in list(data_manager.sources.items()):
+        candidate.kb_vectors[name] = embed_texts(source_data['questions'], "intent_model", model_version=candidate)
+
+def reembed_intent_chat_collection(model_version: IntentModelVersion, batch_size: int = 512) -> int:
+    """Replace the intent_model chat embeddings with model_version's.
+
+    Vectors prepared with the candidate are reused; messages stored since then are embedded now.
+    Messages this version has already written are skipped, so running it again after the swap
+    only catches up on those stored (with the old model) in between. If a write fails, the
+    batches already written get their previous embeddings back before the error is raised.
+    """
+    collection = chat_store("intent_model")
+    prepared_ids, prepared_vectors = model_version.chat_vectors or ([], None)
+    prepared_rows = {message_id: i for i, message_id in enumerate(prepared_ids)}
+    written = model_version.chat_written or set()
+    stored = storage_pool.call(collection.get, include=["documents", "embeddings"])
+    previous = dict(zip(stored["ids"], stored["embeddings"] if stored["embeddings"] is not None else []))
+    stored_rows = [(message_id, document) for message_id, document in zip(stored["ids"], stored["documents"] or [])
+                   if message_id not in written]
+    late = [(message_id, document) for message_id, document in stored_rows if message_id not in prepared_rows]
+    ids = [message_id for message_id, _ in stored_rows if message_id in prepared_rows] + [m for m, _ in late]
+    vectors = [prepared_vectors[prepared_rows[message_id]] for message_id in ids[:len(ids) - len(late)]]
+    if late:
+        vectors.extend(embed_texts([d for _, d in late], "intent_model", model_version=model_version))
+    done = 0
+    try:
+        for done in range(0, len(ids), batch_size):
+            storage_pool.call(collection.update, ids=ids[done:done + batch_size],
+                              embeddings=[np.asarray(v).tolist() for v in vectors[done:done + batch_size]])
+    except Exception:
+        for i in range(0, done, batch_size):
+            storage_pool.call(collection.update, ids=ids[i:i + batch_size],
+                              embeddings=[np.asarray(previous[m]).tolist() for m in ids[i:i + batch_size]])
+        raise
+    model_version.chat_vectors = None
+    model_version.chat_written = written | set(ids)
+    print(f"[Embedding] Re-embedded {len(ids)} chat messages with intent model v{model_version.version}")
+    return len(ids)
+
+def apply_intent_model_vectors(model_version: IntentModelVersion):
+    """on_promote hook: reload the worker processes, swap in the KB vectors prepared with the new
+    model (when it serves embeddings) and re-embed chat messages stored with the old one during
+    the promotion."""
+    global question_vectors
+    if inference_processes.processes:
+        # The workers hold the previous weights; intent inference runs in-process until they reload
+        inference_processes.start(inference_processes.processes, SPACY_MODEL, model_version.model_path,
+                                  model_version.version)
+    if EMBEDDING_BACKEND == "intent_model" and model_version.kb_vectors:
+        with embedding_lock:
+            question_vectors = model_version.kb_vectors['__kb__']
+            for name, source_data in data_manager.sources.items():
+                if name in model_version.kb_vectors:
+                    source_data['question_vectors'] = model_version.kb_vectors[name]
+    reembed_intent_chat_collection(model_version)
+    model_version.chat_written = None
+
+intent_registry.before_promote = reembed_intent_chat_collection
+intent_registry.on_promote = apply_intent_model_vectors
+
+def set_embedding_backend(backend: str):
+    """Switch the embedding backend: re-embed KB questions and use that backend's chat collection."""
+    global EMBEDDING_BACKEND, question_vectors
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}")
+    if backend == EMBEDDING_BACKEND:
+        return
+    # Build everything for the new backend first; requests keep using the old one meanwhile
+    previous_collection = chat_store(EMBEDDING_BACKEND)
+    chat_collection = chat_store(backend)
+    if chat_collection.count() == 0 and previous_collection.count() > 0:
+        backfill_chat_collection(previous_collection, chat_collection, backend)
+    kb_vectors = load_kb_embeddings(questions, backend)
+    source_vectors = {name: embed_texts(source_data['questions'], backend)
+                      for name, source_data in list(data_manager.sources.items())}
+    with embedding_lock:
+        EMBEDDING_BACKEND = backend  # chat_store() follows the backend
+        question_vectors = kb_vectors
+        for name, vectors in source_vectors.items():
+            if name in data_manager.sources:
+                data_manager.sources[name]['question_vectors'] = vectors
+    print(f"[Embedding] Switched to '{backend}' embedding backend")
+
+def backfill_chat_collection(source, target, backend: str, batch_size: int = 512) -> int:
+    """Copy stored chat messages into another backend's collection, re-embedded in batches."""
+    stored = source.get(include=["documents", "metadatas"])
+    for i in range(0, len(stored["ids"]), batch_size):
+        documents = stored["documents"][i:i + batch_size]
+        target.add(ids=stored["ids"][i:i + batch_size], documents=documents,
+                   metadatas=stored["metadatas"][i:i + batch_size],
+                   embeddings=embed_texts(documents, backend).tolist())
+    print(f"[Embedding] Backfilled {len(stored['ids'])} chat messages into '{target.name}'")
+    return len(stored["ids"])
+
+def _same_intent_recall(vectors: np.ndarray, labels: np.ndarray, ks=(1, 5)) -> Dict[str, float]:
+    """Leave-one-out recall@k of a same-intent neighbour."""
+    sims = vectors @ vectors.T
+    np.fill_diagonal(sims, -np.inf)
+    order = np.argsort(-sims, axis=1)
+    return {f"recall@{k}": float((labels[order[:, :k]] == labels[:, None]).any(axis=1).mean()) for k in ks}
+
+def compare_embedding_recall(ks=(1, 5)) -> Dict[str, Any]:
+    """Retrieval quality of each embedding backend.
+
+    Recall@k is leave-one-out same-intent neighbour recall over erp_intents.csv; the KB
+    agreement is how often both backends pick the same top KB question for those texts.
+    """
+    pairs = [(str(t), str(i)) for t, i in zip(intent_df['text'], intent_df['intent'])
+             if not pd.isna(t) and not pd.isna(i)]
+    texts = [t for t, _ in pairs]
+    labels = np.array([i for _, i in pairs])
+    report = {'queries': len(texts), 'recall': {}, 'kb_top1_agreement': None,
+              'note': 'intent_model was fine-tuned on these texts, so its recall here is optimistic'}
+    kb_top1 = {}
+    for backend in EMBEDDING_BACKENDS:
+        start = time.perf_counter()
+        vectors = CentroidIntentClassifier._normalize_rows(embed_texts(texts, backend))
+        embed_ms = (time.perf_counter() - start) * 1000 / max(len(texts), 1)
+        report['recall'][backend] = _same_intent_recall(vectors, labels, ks)
+        report['recall'][backend]['embed_ms_per_text'] = embed_ms
+        if questions:
+            kb_vectors = CentroidIntentClassifier._normalize_rows(load_kb_embeddings(questions, backend))
+            kb_top1[backend] = np.argmax(vectors @ kb_vectors.T, axis=1)
+    if len(kb_top1) == 2:
+        report['kb_top1_agreement'] = float(np.mean(kb_top1['spacy'] == kb_top1['intent_model']))
+    return report
+
+def collect_domain_vocab(model) -> Dict[str, int]:
+    """Token counts over the KB CSV, erp_intents.csv, the NER training texts and stored chat messages."""
+    texts = [str(t) for t in list(df['Question']) + list(df['Answer']) + list(intent_df['text']) if not pd.isna(t)]
+    if os.path.exists(NER_TRAINING_DATA_PATH):
+        with open(NER_TRAINING_DATA_PATH, "r", encoding="utf-8") as f:
+            texts.extend(example["text"] for example in json.load(f))
+    chat = chat_store().get(include=["documents"])
+    texts.extend(chat["documents"] or [])
+    counts: Dict[str, int] = {}
+    for doc in model.tokenizer.pipe(texts, batch_size=512):
+        for token in doc:
+            for form in {token.text, token.lower_}:
+                counts[form] = counts.get(form, 0) + 1
+    return counts
+
+def _prioritise_rows(model, counts: Dict[str, int]) -> int:
+    """Move the rows of domain words to the front of the vectors table.
+
+    prune_vectors keeps the first rows (lexeme probabilities are not loaded, so it falls back
+    to table order), so domain words must come first; the rest keep their frequency order.
+    """
+    vectors = model.vocab.vectors
+    strings = model.vocab.strings
+    domain_rows = []
+    seen = set()
+    for word, _ in sorted(counts.items(), key=lambda item: -item[1]):
+        row = vectors.key2row.get(strings[word]) if word in strings else None
+        if row is not None and row not in seen:
+            seen.add(row)
+            domain_rows.append(row)
+    rest = np.setdiff1d(np.arange(vectors.shape[0]), np.array(domain_rows, dtype=np.int64), assume_unique=True)
+    order = np.concatenate([np.array(domain_rows, dtype=np.int64), rest])
+    new_row = np.empty_like(order)
+    new_row[order] = np.arange(len(order))
+    reordered = Vectors(strings=strings, data=vectors.data[order], name=vectors.name)
+    for key, row in vectors.key2row.items():
+        reordered.add(key, row=int(new_row[row]))
+    model.vocab.vectors = reordered
+    return len(domain_rows)
+
+def prune_vectors_to_domain(keep: int, output_dir: str = PRUNED_MODEL_DIR, package_dir: Optional[str] = None,
+                            base_model: str = SPACY_BASE_MODEL) -> Dict[str, Any]:
+    """Prune the vectors table to `keep` rows, domain vocabulary first, and save a loadable model.
+
+    Removed keys are mapped to their nearest kept vector by spaCy's prune_vectors. The report
+    compares table size, load time and retrieval quality of the full and pruned vectors.
+    """
+    start = time.perf_counter()
+    model = spacy.load(base_model)
+    full_load_s = time.perf_counter() - start
+    full_shape = model.vocab.vectors.shape
+    full_keys = len(model.vocab.vectors.key2row)
+    full_mb = model.vocab.vectors.data.nbytes / (1024 * 1024)
+
+    pairs = [(str(t), str(i)) for t, i in zip(intent_df['text'], intent_df['intent'])
+             if not pd.isna(t) and not pd.isna(i)]
+    texts = [t for t, _ in pairs]
+    labels = np.array([i for _, i in pairs])
+    kb_texts = [str(q) for q in questions]
+    embedder = StaticVectorEmbedder(model)
+    full_vectors = embedder.embed(texts, normalize=True)
+    full_kb = embedder.embed(kb_texts, normalize=True)
+
+    counts = collect_domain_vocab(model)
+    domain_rows = _prioritise_rows(model, counts)
+    remap = model.vocab.prune_vectors(keep)
+    embedder.reload()
+    pruned_vectors = embedder.embed(texts, normalize=True)
+    pruned_kb = embedder.embed(kb_texts, normalize=True)
+
+    model.meta['name'] = f"{model.meta['name']}_erp"
+    model.meta['description'] = f"{base_model} with vectors pruned to {keep} rows for the ERP domain"
+    model.to_disk(output_dir)
+    start = time.perf_counter()
+    reloaded = spacy.load(output_dir)
+    pruned_load_s = time.perf_counter() - start
+
+    worst = sorted(remap.items(), key=lambda item: item[1][1])[:10]
+    report = {
+        'base_model': base_model,
+        'output_dir': output_dir,
+        'domain_word_types': len(counts),
+        'domain_rows_with_vectors': domain_rows,
+        'domain_rows_kept': min(domain_rows, keep),
+        'vectors': {
+            'full': {'rows': full_shape[0], 'keys': full_keys, 'mb': full_mb},
+            'pruned': {'rows': reloaded.vocab.vectors.shape[0], 'keys': len(reloaded.vocab.vectors.key2row),
+                       'mb': reloaded.vocab.vectors.data.nbytes / (1024 * 1024)}
+        },
+        'load_seconds': {'full': full_load_s, 'pruned': pruned_load_s},
+        'retrieval': {
+            'intent_recall_full': _same_intent_recall(full_vectors, labels),
+            'intent_recall_pruned': _same_intent_recall(pruned_vectors, labels),
+            'kb_top1_agreement': float(np.mean(np.argmax(full_vectors @ full_kb.T, axis=1)
+                                               == np.argmax(pruned_vectors @ pruned_kb.T, axis=1))) if kb_texts else None,
+            'kb_vector_cosine_mean': float(np.mean(np.sum(full_kb * pruned_kb, axis=1))) if kb_texts else None
+        },
+        'remapped_keys': len(remap),
+        'least_similar_remaps': [{'word': w, 'mapped_to': s, 'score': float(score)} for w, (s, score) in worst]
+    }
+    with open(os.path.join(output_dir, "pruning_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    if package_dir:
+        from spacy.cli.package import package
+        os.makedirs(package_dir, exist_ok=True)
+        package(Path(output_dir), Path(package_dir), create_sdist=True, force=True)
+        report['package_dir'] = package_dir
+    return report
+
+def benchmark_inference_processes(texts: List[str], max_processes: int, batch_size: int = 16) -> Dict[str, Any]:
+    """Texts per second for embedding + intent + generic NER, in-process and with 1..max_processes workers."""
+    chunks = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    model_version = intent_registry.active
+
+    def work(chunk):
+        embed_texts(chunk, "spacy")
+        model_version.forward_batch(chunk)
+        for text in chunk:
+            _generic_entities(text, None)
+
+    def throughput(threads: int) -> float:
+        work(chunks[0])  # warm-up
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(work, chunks))
+        return len(texts) / (time.perf_counter() - start)
+
+    report = {'texts': len(texts), 'batch_size': batch_size, 'cpu_count': os.cpu_count(),
+              'in_process_threads': throughput(max(max_processes, 1) * 2)}
+    for processes in range(1, max_processes + 1):
+        inference_processes.start(processes, SPACY_MODEL, model_version.model_path, model_version.version,
+                                  background=False)
+        if not inference_processes.active:
+            report['error'] = inference_processes.error
+            break
+        report[f'processes_{processes}'] = throughput(processes * 2)
+        inference_processes.stop()
+    base = report.get('processes_1')
+    if base:
+        report['speedup_vs_1_process'] = {k: v / base for k, v in report.items() if k.startswith('processes_')}
+    return report
 
 @app.post("/configure")
 async def configure(request: ConfigRequest):
-    global config
+    global config, erp_ner, erp_entity_ruler
     
+    # Model loading and re-embedding run on model_pool so the event loop keeps serving other requests
     # Configure data sources
     if request.data_sources:
         config.data_sources.clear()
         for source_config in request.data_sources:
             config.add_data_source(DataSourceConfig(**source_config))
-        data_manager.sources.clear()
-        for source_config in config.data_sources:
-            data_manager.add_source(source_config)
+        await model_pool.run(data_manager.replace_sources, list(config.data_sources))
     
     # Configure intent classification
     if request.intent_config:
         intent_config = IntentConfig(**request.intent_config)
         config.set_intent_config(intent_config)
-        intent_manager.setup(intent_config)
+        await model_pool.run(intent_manager.setup, intent_config)
     
     # Configure semantic search
     if request.semantic_config:
-        semantic_config = SemanticConfig(**request.semantic_config)
+        semantic_fields = dict(request.semantic_config)
+        backend = semantic_fields.get("embedding_backend")
+        if backend is not None and backend not in EMBEDDING_BACKENDS:
+            return {"status": "error", "message": f"embedding_backend must be one of {EMBEDDING_BACKENDS}"}
+        # Omitted, the backend stays as it is (it may come from NLP_EMBEDDING_BACKEND)
+        semantic_fields.setdefault("embedding_backend", EMBEDDING_BACKEND)
+        semantic_config = SemanticConfig(**semantic_fields)
+        if backend is not None:
+            await model_pool.run(set_embedding_backend, backend)
         config.set_semantic_config(semantic_config)
+        if semantic_config.use_coreference and semantic_config.coref_engine == "coreferee":
+            await model_pool.run(ensure_coreferee_pipe)
+    
+    # Configure entity extraction
+    if request.entity_config:
+        entity_config = EntityConfig(**request.entity_config)
+        if entity_config.merge_mode not in ENTITY_MERGE_MODES:
+            return {"status": "error", "message": f"merge_mode must be one of {ENTITY_MERGE_MODES}"}
+        if entity_config.erp_model_path != config.entity_config.erp_model_path:
+            erp_ner = await model_pool.run(load_erp_ner, entity_config.erp_model_path)
+        if (entity_config.rule_files, entity_config.rules_enabled) != (config.entity_config.rule_files,
+                                                                      config.entity_config.rules_enabled):
+            erp_entity_ruler = await model_pool.run(load_entity_ruler, entity_config)
+        config.entity_config = entity_config
+    
+    # Configure memory limits
+    if request.memory_config:
+        config.memory_config = MemoryConfig(**request.memory_config)
+    
+    # Configure worker pools
+    if request.execution_config:
+        execution_config = ExecutionConfig(**request.execution_config)
+        if execution_config.model_workers < 1 or execution_config.storage_workers < 1:
+            return {"status": "error", "message": "model_workers and storage_workers must be at least 1"}
+        model_pool.resize(execution_config.model_workers)
+        storage_pool.resize(execution_config.storage_workers)
+        if execution_config.inference_processes != inference_processes.processes:
+            await model_pool.run(inference_processes.start, execution_config.inference_processes, SPACY_MODEL,
+                                 intent_registry.active.model_path, intent_registry.active.version)
+        config.execution_config = execution_config
+    
+    # Configure admission control
+    if request.admission_config:
+        admission_config = AdmissionConfig(**request.admission_config)
+        if min(admission_config.max_concurrent.values(), default=1) < 1 or admission_config.max_queued < 0:
+            return {"status": "error", "message": "max_concurrent limits must be at least 1 and max_queued at least 0"}
+        config.admission_config = admission_config
+    
+    # Configure latency budgets
+    if request.deadline_config:
+        config.deadline_config = DeadlineConfig(**request.deadline_config)
     
     # Set default strategy
     if request.default_strategy:
@@ -1282,11 +4032,245 @@ async def health():
     return {
         "status": "healthy",
         "spacy_model": nlp.meta['name'] if nlp else None,
+        "embedding_backend": EMBEDDING_BACKEND,
         "data_sources": len(data_manager.sources),
         "intent_enabled": intent_manager.enabled,
+        "intent_model_version": intent_registry.active.version if intent_registry.active else None,
         "chroma_connected": True
     }
 
+@app.get("/stats")
+async def stats():
+    """Runtime counters for the cheap-path and model stages."""
+    return {
+        "intent_lookup": intent_lookup_index.stats(),
+        "intent_manager_lookup": intent_manager.lookup_index.stats() if intent_manager.lookup_index else None,
+        "intent_cascade": intent_cascade.stats(),
+        "coreference": coref_stats_report(),
+        "prepared_bot_replies": prepared_messages.stats(),
+        "analysis": analysis_stats_report(),
+        "analyze_streams": stream_stats_report(),
+        "serialization": serialization_stats_report(),
+        "chat_sockets": chat_socket_stats_report(),
+        "admission": admission_report(),
+        "deadlines": deadline_report(),
+        "pipeline_profiles": profile_stats_report(),
+        "entities": entity_stats_report(),
+        "memory": {k: v for k, v in memory_monitor.report().items() if k != 'samples'},
+        "workers": {"model": model_pool.stats(), "storage": storage_pool.stats(),
+                    "inference_processes": inference_processes.stats()},
+        "stage_races": stage_race_report(),
+        "intent_manager_cascade": intent_manager.cascade.stats() if intent_manager.cascade else None
+    }
+
+@app.get("/memory")
+async def memory():
+    """StringStore/Vocab size and RSS over time, plus model resets."""
+    return memory_monitor.report()
+
+@app.get("/memory/graph", response_class=HTMLResponse)
+async def memory_graph():
+    return render_memory_svg(list(memory_monitor.samples))
+
+@app.post("/memory/reset")
+async def memory_reset():
+    """Reload the spaCy model now (drains in-flight requests first)."""
+    return await asyncio.to_thread(memory_monitor.reset_model, "manual")
+
+@app.get("/intent_models")
+async def intent_models():
+    """Active and candidate intent model versions, shadow agreement and latency."""
+    return intent_registry.status()
+
+@app.post("/intent_models/load")
+async def load_intent_model(request: LoadIntentModelRequest):
+    """Load a candidate in the background; shadow a fraction of traffic or swap in as soon as it is ready."""
+    return intent_registry.load_candidate(request.model_path, shadow_fraction=request.shadow_fraction,
+                                          auto_promote=request.auto_promote, prepare=prepare_intent_candidate)
+
+@app.post("/intent_models/promote")
+async def promote_intent_model():
+    return intent_registry.promote()
+
+@app.post("/intent_models/discard")
+async def discard_intent_model():
+    return intent_registry.discard()
+
+@app.get("/intent_cascade/report")
+async def intent_cascade_report():
+    """Offline routing ratio, per-tier accuracy and latency of the intent cascade on erp_intents.csv."""
+    return await model_pool.run(intent_cascade.evaluate, intent_df['text'], intent_df['intent'])
+
+# Production serving. With --preload the models loaded at import are shared copy-on-write by
+# forked uvicorn workers; per-process state (threads, pools, the Chroma client) is rebuilt in
+# each worker after the fork.
+def reinitialize_after_fork(torch_threads: Optional[int] = None):
+    model_pool.after_fork()
+    storage_pool.after_fork()
+    intent_registry._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="intent-shadow")
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+    memory_monitor.start()
+    inference_processes.start(config.execution_config.inference_processes, SPACY_MODEL,
+                              intent_registry.active.model_path, intent_registry.active.version)
+
+def stop_threads_before_fork():
+    """Stop this process's own threads; reinitialize_after_fork() starts them again in each worker.
+
+    fork() copies only the calling thread, so a lock another thread holds at that moment
+    (nlp_lock, the request gate, a stdout buffer) would stay held forever in the child.
+    """
+    memory_monitor.stop()
+    inference_processes.stop()  # each worker starts its own pool, if configured
+    model_pool.shutdown()
+    storage_pool.shutdown()
+    intent_registry._shadow_executor.shutdown(wait=True)
+    others = [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()]
+    if others:
+        print(f"[Serve] Threads still running before fork: {others}")
+
+def preforked_memory_report(parent_pid: int, worker_pids: List[int]) -> Dict[str, Any]:
+    parent = process_memory_breakdown(parent_pid)
+    workers = {pid: process_memory_breakdown(pid) for pid in worker_pids}
+    known = [m for m in [parent, *workers.values()] if m]
+    return {
+        'parent': parent,
+        'workers': workers,
+        'total_rss_mb': sum(m['rss_mb'] for m in known),  # counts shared pages once per process
+        'total_pss_mb': sum(m['pss_mb'] for m in known),  # actual footprint of the process group
+    }
+
+def bind_unix_socket(path: str):
+    """Listening Unix domain socket for same-host clients (the .NET server), owner and group only."""
+    import socket
+    if os.path.exists(path):
+        os.unlink(path)  # left behind by a previous run
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, 0o660)
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def serve_preforked(host: str, port: int, workers: int, torch_threads: Optional[int] = None,
+                    memory_report_s: float = 60.0, uds: Optional[str] = None):
+    """Bind once, fork workers that inherit the loaded models, and restart any that exit."""
+    import signal
+    import socket
+    import uvicorn
+    stop_threads_before_fork()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    sockets = [sock] + ([bind_unix_socket(uds)] if uds else [])
+    gc.collect()
+    gc.freeze()  # keep the collector from writing to (and so un-sharing) the preloaded objects
+
+    children: Dict[int, int] = {}
+    stopping: List[int] = []
+
+    def fork_worker(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            reinitialize_after_fork(torch_threads)
+            uvicorn.Server(uvicorn.Config(app, log_level="info")).run(sockets=sockets)
+            os._exit(0)
+        children[pid] = slot
+
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    for slot in range(workers):
+        fork_worker(slot)
+    print(f"[Serve] Parent {os.getpid()} preloaded the models ({process_rss_mb() or 0:.0f} MB RSS); "
+          f"{workers} worker(s) on http://{host}:{port}{f' and {uds}' if uds else ''}: {sorted(children)}")
+    next_report = time.monotonic() + min(10.0, memory_report_s)
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid in children:
+            slot = children.pop(pid)
+            print(f"[Serve] Worker {pid} exited with status {status}; starting a replacement")
+            fork_worker(slot)
+        if time.monotonic() >= next_report:
+            report = preforked_memory_report(os.getpid(), sorted(children))
+            for worker_pid, pages in report['workers'].items():
+                if pages:
+                    print(f"[Serve] Worker {worker_pid}: RSS {pages['rss_mb']:.0f} MB, shared {pages['shared_mb']:.0f} MB, "
+                          f"private {pages['private_mb']:.0f} MB, PSS {pages['pss_mb']:.0f} MB")
+            print(f"[Serve] Total RSS {report['total_rss_mb']:.0f} MB, total PSS {report['total_pss_mb']:.0f} MB")
+            next_report = time.monotonic() + memory_report_s
+        time.sleep(0.5)
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    if uds and os.path.exists(uds):
+        os.unlink(uds)
+    print("[Serve] All workers stopped")
+
+def _latency_summary(timings: List[float]) -> Dict[str, float]:
+    ordered = sorted(timings)
+    return {'requests': len(ordered), 'mean_ms': float(np.mean(ordered)), 'median_ms': float(np.median(ordered)),
+            'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]}
+
+def benchmark_transports(texts: List[str], host: str = "127.0.0.1", port: int = 8000,
+                         uds: Optional[str] = None) -> Dict[str, Any]:
+    """Chat-turn latency against a running service: HTTP /turn vs /ws/chat, over TCP and the Unix socket.
+
+    Connections are kept open for the whole run, as the .NET client's pooled HttpClient keeps
+    them. Messages are not stored, so the run leaves semantic memory unchanged.
+    """
+    import httpx
+    from websockets.sync.client import connect, unix_connect
+    session_id = f"bench-transport-{uuid.uuid4().hex[:8]}"
+    report: Dict[str, Any] = {'texts': len(texts), 'session_id': session_id}
+
+    def http_turns(client: httpx.Client) -> List[float]:
+        timings, prev_bot_response = [], ""
+        for text in texts:
+            start = time.perf_counter()
+            response = client.post("/turn", json={"text": text, "session_id": session_id, "store": False,
+                                                  "prev_bot_response": prev_bot_response})
+            timings.append((time.perf_counter() - start) * 1000)
+            kb = response.json().get("kb")
+            prev_bot_response = kb["answer"] if kb else ""
+        return timings
+
+    def socket_turns(websocket) -> List[float]:
+        timings = []
+        for text in texts:
+            start = time.perf_counter()
+            websocket.send(json.dumps({"type": "user", "text": text, "store": False}))
+            reply = json.loads(websocket.recv())
+            timings.append((time.perf_counter() - start) * 1000)
+            if reply.get("kb"):
+                websocket.send(json.dumps({"type": "bot", "text": reply["kb"]["answer"], "store": False}))
+                websocket.recv()
+        return timings
+
+    with httpx.Client(base_url=f"http://{host}:{port}") as client:
+        report['http_tcp'] = _latency_summary(http_turns(client))
+    with connect(f"ws://{host}:{port}/ws/chat/{session_id}") as websocket:
+        report['websocket_tcp'] = _latency_summary(socket_turns(websocket))
+    if uds:
+        with httpx.Client(base_url="http://localhost", transport=httpx.HTTPTransport(uds=uds)) as client:
+            report['http_uds'] = _latency_summary(http_turns(client))
+        with unix_connect(uds, f"ws://localhost/ws/chat/{session_id}") as websocket:
+            report['websocket_uds'] = _latency_summary(socket_turns(websocket))
+    return report
+
 # Initialize with default ERP configuration
 def initialize_default_config():
     # Add ERP data source
@@ -1313,6 +4297,7 @@ def initialize_default_config():
         similarity_threshold=0.6,
         max_history_results=5,
         use_coreference=True,
+        embedding_backend=EMBEDDING_BACKEND,
         enabled=True
     )
     config.set_semantic_config(semantic_config)
@@ -1325,7 +4310,80 @@ def initialize_default_config():
 
 # Initialize on startup
 initialize_default_config()
+memory_monitor.start()
+inference_processes.start(config.execution_config.inference_processes, SPACY_MODEL, intent_registry.active.model_path,
+                          intent_registry.active.version)
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("erp_nlp_service:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="ERP NLP service")
+    subparsers = parser.add_subparsers(dest="command")
+    build_parser = subparsers.add_parser("build-kb-embeddings", help="Re-embed KB questions for an embedding backend")
+    build_parser.add_argument("--backend", choices=EMBEDDING_BACKENDS, default=EMBEDDING_BACKEND)
+    build_parser.add_argument("--compare", action="store_true", help="Print a recall comparison across backends")
+    coref_parser = subparsers.add_parser("eval-coref", help="Compare coreference engines on recorded dialogues")
+    coref_parser.add_argument("--dialogues", nargs="+", default=["../../intent_training/coref_dialogues.json",
+                                                             "../../intent_training/coref_dialogues_heldout.json"],
+                              help="Dialogue files, each reported separately (the held-out set was not used to tune the rules)")
+    prune_parser = subparsers.add_parser("prune-vectors", help="Prune the spaCy vectors table to the ERP vocabulary")
+    prune_parser.add_argument("--keep", type=int, default=20000, help="Number of vector rows to keep")
+    prune_parser.add_argument("--output", default=PRUNED_MODEL_DIR)
+    prune_parser.add_argument("--package-dir", default=None, help="Also build an installable package (sdist) here")
+    bench_parser = subparsers.add_parser("bench-profiles", help="Time each spaCy pipeline profile")
+    bench_parser.add_argument("--limit", type=int, default=500, help="Number of KB questions and intent texts to parse")
+    serve_parser = subparsers.add_parser("serve", help="Run the API with several workers (no auto-reload)")
+    serve_parser.add_argument("--workers", type=int, default=1)
+    serve_parser.add_argument("--preload", action="store_true",
+                              help="Load models once here and fork workers that share them copy-on-write")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--torch-threads", type=int, default=None, help="torch intra-op threads per worker")
+    serve_parser.add_argument("--memory-report-s", type=float, default=60.0,
+                              help="Seconds between shared/private memory reports (--preload)")
+    serve_parser.add_argument("--uds", default=None,
+                              help="Also listen on this Unix domain socket (without --preload it replaces host/port)")
+    processes_parser = subparsers.add_parser("bench-processes", help="Inference throughput in-process vs worker processes")
+    processes_parser.add_argument("--max-processes", type=int, default=os.cpu_count() or 1)
+    processes_parser.add_argument("--limit", type=int, default=512, help="Number of KB questions and intent texts")
+    transport_parser = subparsers.add_parser("bench-transport", help="Turn latency over HTTP and WebSocket, TCP and Unix socket")
+    transport_parser.add_argument("--host", default="127.0.0.1")
+    transport_parser.add_argument("--port", type=int, default=8000)
+    transport_parser.add_argument("--uds", default=None, help="Unix socket the service was started with (serve --uds)")
+    transport_parser.add_argument("--limit", type=int, default=200, help="Number of KB questions sent as chat turns")
+    args = parser.parse_args()
+
+    if args.command == "build-kb-embeddings":
+        path = save_kb_embeddings(questions, args.backend)
+        print(f"[Embedding] Wrote {len(questions)} KB embeddings to {path}")
+        if args.compare:
+            print(json.dumps(compare_embedding_recall(), indent=2))
+    elif args.command == "eval-coref":
+        print(json.dumps({os.path.basename(path): evaluate_coref_engines(path) for path in args.dialogues}, indent=2))
+    elif args.command == "prune-vectors":
+        print(json.dumps(prune_vectors_to_domain(args.keep, args.output, args.package_dir), indent=2))
+    elif args.command == "bench-profiles":
+        texts = [str(t) for t in list(questions) + list(intent_df['text'])][:args.limit]
+        report = benchmark_profiles(texts)
+        report['static_embedder'] = static_embedder.benchmark(texts)
+        if erp_ner is not None:
+            start = time.perf_counter()
+            list(erp_ner.pipe(texts))
+            report['erp_ner'] = {'ms_per_doc_batched': (time.perf_counter() - start) * 1000 / len(texts)}
+        print(json.dumps(report, indent=2))
+    elif args.command == "bench-processes":
+        texts = [str(t) for t in list(questions) + list(intent_df['text'])][:args.limit]
+        print(json.dumps(benchmark_inference_processes(texts, args.max_processes), indent=2))
+    elif args.command == "bench-transport":
+        texts = [str(t) for t in questions][:args.limit]
+        print(json.dumps(benchmark_transports(texts, args.host, args.port, args.uds), indent=2))
+    elif args.command == "serve":
+        if args.preload:
+            serve_preforked(args.host, args.port, args.workers, args.torch_threads, args.memory_report_s, args.uds)
+        else:
+            import uvicorn
+            # Every worker imports (and loads) the service itself
+            uvicorn.run("erp_nlp_service:app", host=args.host, port=args.port, workers=args.workers, uds=args.uds)
+    else:
+        import uvicorn
+        # Serve the app already loaded here: an import string (or reload=True) would load every model again
+        uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
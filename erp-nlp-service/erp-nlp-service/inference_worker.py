@@ -0,0 +1,94 @@
+"""Model-inference worker processes for erp_nlp_service (ExecutionConfig.inference_processes).
+
+Each worker loads its own spaCy pipeline and intent model once, in its initializer, and then
+serves embedding, intent and NER calls over the pool's IPC channel. Vector results are written
+into a shared-memory block; only the block name and shape travel back through the pipe.
+Kept free of service imports so spawned workers do not run the service's start-up code.
+"""
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+_nlp = None
+_intent = None  # (tokenizer, model) of the intent model the pool was started with
+_ner_disabled = []
+
+
+def mean_pooled(hidden, attention_mask):
+    """L2-normalised mean of the last hidden states over the attention mask."""
+    mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+    pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+    return torch.nn.functional.normalize(pooled, dim=1)
+
+
+def init_worker(spacy_model, intent_model_path=None, torch_threads=1, ready=None):
+    global _nlp, _intent, _ner_disabled
+    import spacy
+    torch.set_num_threads(torch_threads)
+    _nlp = spacy.load(spacy_model)
+    keep = {"ner"}
+    if "tok2vec" in _nlp.pipe_names and "ner" in _nlp.get_pipe("tok2vec").listening_components:
+        keep.add("tok2vec")
+    _ner_disabled = [name for name in _nlp.pipe_names if name not in keep]
+    if intent_model_path:
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+        model = AutoModelForSequenceClassification.from_pretrained(intent_model_path)
+        model.eval()
+        _intent = (AutoTokenizer.from_pretrained(intent_model_path), model)
+    print(f"[Inference worker {os.getpid()}] Loaded {spacy_model}"
+          f"{f' and {intent_model_path}' if intent_model_path else ''}")
+    if ready is not None:
+        ready.put(os.getpid())
+
+
+def _to_shared(array):
+    """Copy an array into a new shared-memory block; the caller reads and unlinks it."""
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=np.float32, buffer=block.buf)
+    view[:] = array
+    del view
+    name = block.name
+    block.close()
+    return name, array.shape
+
+
+def read_shared(name, shape):
+    """Parent side of _to_shared: copy the block out and free it."""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.float32, buffer=block.buf).copy()
+    finally:
+        block.close()
+        block.unlink()
+
+
+def embed(texts):
+    """spaCy doc vectors (tokenizer only) for a batch."""
+    vectors = np.zeros((len(texts), _nlp.vocab.vectors.shape[1]), dtype=np.float32)
+    for i, doc in enumerate(_nlp.tokenizer.pipe(texts)):
+        vectors[i] = doc.vector
+    return _to_shared(vectors)
+
+
+def intent_forward(texts):
+    """One intent-model pass; logits and pooled states share one block (logits first)."""
+    tokenizer, model = _intent
+    inputs = tokenizer(list(texts), return_tensors="pt", truncation=True, padding=True, max_length=64)
+    with torch.no_grad():
+        outputs = model(**inputs, output_hidden_states=True)
+    pooled = mean_pooled(outputs.hidden_states[-1], inputs['attention_mask'])
+    name, shape = _to_shared(torch.cat([outputs.logits, pooled], dim=1).numpy())
+    return name, shape, outputs.logits.shape[1]
+
+
+def entities(text):
+    doc = _nlp(str(text), disable=_ner_disabled)
+    return [{'label': ent.label_, 'text': ent.text, 'start': ent.start_char, 'end': ent.end_char,
+             'engine': 'generic_ner'} for ent in doc.ents]
+
+
+def ping():
+    return os.getpid()
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTENT_TRAINING_DIR = os.path.join(SERVICE_DIR, "..", "..", "intent_training")
+
+
+@pytest.fixture(scope="session")
+def service():
+    """The service module, imported once. It loads its models and CSVs from paths relative to
+    the service directory, so the tests skip where those (or torch/chromadb) are unavailable."""
+    if SERVICE_DIR not in sys.path:
+        sys.path.insert(0, SERVICE_DIR)
+    os.chdir(SERVICE_DIR)
+    try:
+        import erp_nlp_service
+    except Exception as e:
+        pytest.skip(f"erp_nlp_service could not be loaded here: {e}")
+    return erp_nlp_service
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def limits(service, monkeypatch):
+    limits = service.AdmissionConfig(max_body_bytes=1024, max_text_chars=20, max_history_items=3)
+    monkeypatch.setattr(service.config, "admission_config", limits)
+    return limits
+
+
+def test_oversized_text(service, limits):
+    assert service.oversized_input({"text": "x" * 20}) is None
+    assert service.oversized_input({"text": "x" * 21}).startswith("text has 21 characters")
+    assert service.oversized_input({"query": "x" * 21}).startswith("query")
+
+
+def test_oversized_history(service, limits):
+    assert service.oversized_input({"text": "hi", "history": ["a", "b", "c"]}) is None
+    assert service.oversized_input({"history": ["a"] * 4}).startswith("history has 4 items")
+    assert "history item" in service.oversized_input({"history": [{"message": "x" * 30}]})
+
+
+def test_oversized_reads_model_attributes(service, limits):
+    class Req:
+        text = "x" * 50
+    assert service.oversized_input(Req()).startswith("text has 50 characters")
+
+
+def test_caps_disabled(service, limits):
+    limits.enabled = False
+    assert service.oversized_input({"text": "x" * 1000, "history": ["a"] * 100}) is None
+
+
+def test_queue_hands_slots_over_in_order(service):
+    async def scenario():
+        endpoint = service.EndpointAdmission()
+        assert await endpoint.acquire(1, max_queued=2, timeout_s=1)
+        first = asyncio.ensure_future(endpoint.acquire(1, 2, 1))
+        second = asyncio.ensure_future(endpoint.acquire(1, 2, 1))
+        await asyncio.sleep(0)
+        assert endpoint.queued == 2
+        assert not await endpoint.acquire(1, 2, 1)  # queue full
+        endpoint.release(1, elapsed_ms=100)
+        assert await first and not second.done()
+        assert endpoint.in_flight == 1
+        endpoint.release(1)
+        assert await second
+        endpoint.release(1)
+        return endpoint
+
+    endpoint = asyncio.run(scenario())
+    assert endpoint.in_flight == 0 and endpoint.queued == 0
+    assert endpoint.admitted == 3 and endpoint.rejected == 1
+    assert endpoint.mean_ms == 100
+
+
+def test_queue_timeout(service):
+    async def scenario():
+        endpoint = service.EndpointAdmission()
+        await endpoint.acquire(1, 4, 1)
+        assert not await endpoint.acquire(1, 4, timeout_s=0.01)
+        return endpoint
+
+    endpoint = asyncio.run(scenario())
+    assert endpoint.timed_out == 1 and endpoint.rejected == 1
+    assert endpoint.queued == 0 and endpoint.in_flight == 1
+
+
+def test_retry_after(service):
+    endpoint = service.EndpointAdmission()
+    assert endpoint.retry_after_s(4) == 1
+    endpoint.mean_ms = 2000
+    endpoint._waiters.extend([None, None, None])
+    assert endpoint.retry_after_s(2) == 4  # 4 requests ahead, 2 at a time, 2 s each
+
+
+@pytest.fixture
+def client(service, limits):
+    from fastapi.testclient import TestClient
+    return TestClient(service.app)
+
+
+def test_invalid_content_length(client):
+    response = client.post("/analyze", content=b"{}", headers={"content-length": "abc"})
+    assert response.status_code == 400
+
+
+def test_declared_body_over_cap(client):
+    response = client.post("/analyze", content=b"x" * 2048)
+    assert response.status_code == 413
+
+
+def test_chunked_body_over_cap(client, service):
+    before = service.admission_stats['oversized']
+
+    def chunks():
+        for _ in range(8):
+            yield b"x" * 256
+
+    response = client.post("/analyze", content=chunks())
+    assert response.status_code == 413
+    assert service.admission_stats['oversized'] == before + 1
@@ -0,0 +1,58 @@
+import json
+
+import numpy as np
+import pytest
+from starlette.requests import Request
+
+PAYLOAD = {"source": "kb", "answer": "Approved", "confidence": 0.93,
+           "entities": {"INVOICE_NUMBER": "12345", "DATE": "tomorrow"}, "history": [{"role": "user"}]}
+
+
+def http_request(query=b"", accept="application/json"):
+    return Request({"type": "http", "method": "POST", "path": "/analyze", "query_string": query,
+                    "headers": [(b"accept", accept.encode())]})
+
+
+def test_project_top_level_fields(service):
+    assert service.project_fields(PAYLOAD, ["source", "answer"]) == {"source": "kb", "answer": "Approved"}
+
+
+def test_project_nested_field(service):
+    assert service.project_fields(PAYLOAD, ["entities.DATE", "source"]) == {"entities": {"DATE": "tomorrow"},
+                                                                           "source": "kb"}
+    assert service.project_fields(PAYLOAD, ["entities", "entities.DATE"])["entities"] == PAYLOAD["entities"]
+    assert service.project_fields(PAYLOAD, ["answer.text"]) == {"answer": "Approved"}
+
+
+def test_project_missing_and_passthrough(service):
+    assert service.project_fields(PAYLOAD, ["nope", "entities.nope"]) == {"entities": {}}
+    assert service.project_fields(PAYLOAD, []) is PAYLOAD
+    assert service.project_fields(["a", "b"], ["source"]) == ["a", "b"]
+
+
+def test_compact_response_projects_and_records(service):
+    before = service.serialization_stats.get("/test", {}).get("responses", 0)
+    response = service.compact_response(http_request(b"fields=source, answer"), PAYLOAD, "/test")
+    assert json.loads(response.body) == {"source": "kb", "answer": "Approved"}
+    assert response.media_type == "application/json"
+    assert response.headers["X-Payload-Bytes"] == str(len(response.body))
+    stats = service.serialization_stats["/test"]
+    assert stats["responses"] == before + 1
+    assert stats["projected"] >= 1
+    assert stats["max_bytes"] >= len(response.body)
+
+
+def test_numpy_values_serialize(service):
+    payload = {"vector": np.arange(3, dtype=np.float32), "score": np.float32(0.5), "count": np.int64(2)}
+    body, media_type, _ = service.serialize_payload(payload)
+    assert media_type == "application/json"
+    assert json.loads(body) == {"vector": [0.0, 1.0, 2.0], "score": 0.5, "count": 2}
+
+
+def test_msgpack_on_request(service):
+    msgpack = pytest.importorskip("msgpack")
+    if service.msgpack is None:
+        pytest.skip("the service loaded without msgpack")
+    response = service.compact_response(http_request(b"fields=source", "application/msgpack"), PAYLOAD, "/test")
+    assert response.media_type == "application/msgpack"
+    assert msgpack.unpackb(response.body) == {"source": "kb"}
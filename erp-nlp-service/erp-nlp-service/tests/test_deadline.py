@@ -0,0 +1,77 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def deadlines(service, monkeypatch):
+    deadline_config = service.DeadlineConfig(reserve_ms=30.0)
+    monkeypatch.setattr(service.config, "deadline_config", deadline_config)
+    monkeypatch.setattr(service, "stage_cost_ms", {})
+    return deadline_config
+
+
+def http_request(headers=None, received_at=None):
+    return SimpleNamespace(headers=headers or {}, state=SimpleNamespace(received_at=received_at))
+
+
+def test_no_budget_runs_every_stage(service, deadlines):
+    deadline = service.Deadline()
+    assert deadline.remaining_ms() == float("inf")
+    assert deadline.run("coref", "default", lambda: "ran") == "ran"
+    assert deadline.skipped == []
+
+
+def test_exhausted_budget_returns_default(service, deadlines):
+    before = service.deadline_stats['skipped']['coref']
+    calls = []
+    deadline = service.Deadline(budget_ms=0)
+    assert deadline.run("coref", "default", calls.append, "x") == "default"
+    assert calls == []
+    assert deadline.skipped == ["coref"]
+    assert service.deadline_stats['skipped']['coref'] == before + 1
+
+
+def test_stage_cost_and_reserve_decide(service, deadlines):
+    deadline = service.Deadline(budget_ms=100)
+    service.stage_cost_ms["entities"] = 50.0
+    assert deadline.allows("entities")  # 50 + 30 reserve fits
+    service.stage_cost_ms["entities"] = 80.0
+    assert not deadline.allows("entities")
+    deadlines.enabled = False
+    assert deadline.allows("entities")
+
+
+def test_run_tracks_moving_average(service, deadlines):
+    deadline = service.Deadline()
+    deadline.run("entities", None, time.sleep, 0.02)
+    first = service.stage_cost_ms["entities"]
+    assert first >= 20
+    deadline.run("entities", None, lambda: None)
+    assert service.stage_cost_ms["entities"] == pytest.approx(0.8 * first, rel=0.05)
+
+
+def test_cost_is_tracked_when_the_stage_raises(service, deadlines):
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        service.Deadline().run("coref", None, fail)
+    assert "coref" in service.stage_cost_ms
+
+
+def test_request_deadline_sources(service, deadlines):
+    assert service.request_deadline(None).budget_ms is None
+    assert service.request_deadline(http_request({"x-deadline-ms": "250"})).budget_ms == 250
+    assert service.request_deadline(http_request({"x-deadline-ms": "250"}), deadline_ms=80).budget_ms == 80
+    deadlines.default_budget_ms = 500
+    assert service.request_deadline(http_request({"x-deadline-ms": "soon"})).budget_ms == 500
+    assert service.request_deadline(http_request()).budget_ms == 500
+
+
+def test_budget_counts_from_receipt(service, deadlines):
+    received_at = time.monotonic() - 0.2
+    deadline = service.request_deadline(http_request({"x-deadline-ms": "250"}, received_at))
+    assert deadline.started == received_at
+    assert deadline.remaining_ms() <= 50
@@ -0,0 +1,61 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def ruler(service):
+    return service.ErpEntityRuler(["entity_patterns.json"], service.NER_TRAINING_DATA_PATH)
+
+
+def spans_of(ruler, text):
+    doc = ruler.make_doc(text)
+    spans = ruler.match(doc)
+    return [(span.text, span.label_) for span in spans], ruler.covers(doc, spans)
+
+
+def test_context_pattern_labels_the_number_only(ruler):
+    spans, covered = spans_of(ruler, "Please approve invoice 12345")
+    assert ("12345", "INVOICE_NUMBER") in spans
+    assert ("invoice 12345", "INVOICE_NUMBER") not in spans
+    assert covered
+
+
+def test_context_pattern_after_abbreviation(ruler):
+    spans, _ = spans_of(ruler, "invoice no 4455 was paid on 2024-03-05")
+    assert ("4455", "INVOICE_NUMBER") in spans
+    assert ("2024-03-05", "DATE") in spans
+
+
+def test_prefixed_ids(ruler):
+    spans, covered = spans_of(ruler, "Cancel PO-98765 and TKT-118")
+    assert [label for _, label in spans] == ["ORDER_NUMBER", "TICKET_NUMBER"]
+    assert covered
+
+
+def test_phrases_and_relative_dates(ruler):
+    spans, covered = spans_of(ruler, "Submit sick leave for tomorrow")
+    assert spans == [("sick leave", "LEAVE_TYPE"), ("tomorrow", "DATE")]
+    assert covered
+
+
+def test_multi_token_department_phrase(ruler):
+    spans, covered = spans_of(ruler, "Send the payslip to the Finance department")
+    assert ("payslip", "DOCUMENT") in spans
+    assert ("Finance department", "DEPARTMENT") in spans
+    assert covered
+
+
+def test_acronym_phrases_are_case_sensitive(ruler):
+    assert spans_of(ruler, "Send it to HR")[0] == [("HR", "DEPARTMENT")]
+    assert spans_of(ruler, "Ask Acme Corp about it")[0] == []
+
+
+def test_uncovered_erp_noun_falls_back_to_model(ruler):
+    spans, covered = spans_of(ruler, "What is the status of my request")
+    assert spans == []
+    assert not covered
+
+
+def test_missing_pattern_file_is_skipped(service, capsys):
+    ruler = service.ErpEntityRuler(["no_such_patterns.json"], service.NER_TRAINING_DATA_PATH)
+    assert ruler.phrase_count > 0
+    assert "no_such_patterns.json" in capsys.readouterr().out
@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+
+from conftest import INTENT_TRAINING_DIR
+
+
+def load_dialogues(name):
+    with open(os.path.join(INTENT_TRAINING_DIR, name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def resolver(service):
+    return service.ErpCorefResolver()
+
+
+def normalized(text):
+    return " ".join(text.lower().split())
+
+
+@pytest.mark.parametrize("dialogue", load_dialogues("coref_dialogues.json") + load_dialogues("coref_dialogues_heldout.json"),
+                         ids=lambda d: d["message"])
+def test_recorded_and_held_out_dialogues(resolver, dialogue):
+    resolved = resolver.resolve(dialogue["message"], None, context=[dialogue.get("last_user"), dialogue.get("prev_bot")])
+    assert normalized(resolved) == normalized(dialogue["expected"])
+
+
+def test_it_prefers_the_document_over_the_department_in_the_same_turn(resolver):
+    resolver.observe("s1", "Please review invoice 12345 for the marketing department.")
+    assert resolver.resolve("Can you approve it?", "s1") == "Can you approve invoice 12345?"
+
+
+def test_a_later_turn_wins_over_the_preferred_category(resolver):
+    resolver.observe("s1", "There are 4 pending purchase orders.")
+    resolver.observe("s1", "The HR team handles onboarding.")
+    assert resolver.resolve("How do I contact them?", "s1") == "How do I contact the team?"
+
+
+@pytest.mark.parametrize("message", ["I want to know if it is raining", "Is it snowing there?",
+                                     "It seems the portal was down", "Is it possible to appeal?"])
+def test_non_referential_it_is_left_alone(resolver, message):
+    resolver.observe("s1", "Invoice 553 was paid yesterday.")
+    assert resolver.resolve(message, "s1") == message
+    assert resolver.stats["replacements"] == 0
+
+
+def test_the_message_being_analysed_is_not_its_own_antecedent(resolver):
+    resolver.observe("s1", "Show me PO-98765")
+    resolver.observe("s1", "Can you cancel it?")
+    assert resolver.resolve("Can you cancel it?", "s1") == "Can you cancel PO-98765?"
+
+
+def test_determiners_are_not_anaphors(resolver):
+    resolver.observe("s1", "Invoice 12345 is overdue.")
+    text = "Who is the supplier for this purchase order?"
+    assert resolver.resolve(text, "s1") == text
+
+
+def test_possessive_pronoun_keeps_the_possessive(resolver):
+    resolver.observe("s1", "John Smith submitted an expense claim yesterday.")
+    assert resolver.resolve("What is his manager's name?", "s1") == "What is John Smith's manager's name?"
+
+
+def test_sessions_are_bounded(service):
+    resolver = service.ErpCorefResolver(max_sessions=2)
+    for session_id in ("a", "b", "c"):
+        resolver.observe(session_id, "Invoice 1 is due.")
+    assert list(resolver.sessions) == ["b", "c"]
+
+
+def test_precheck_only_passes_phrases_the_resolver_rewrites(service):
+    assert service.ANAPHORIC_PHRASES <= service.ERP_COREF_PHRASES
+    assert not service.needs_coreference("Do the same for the new hire")
+    assert service.needs_coreference("Approve the same one")
@@ -0,0 +1,99 @@
+import threading
+
+import numpy as np
+import pytest
+
+INTENTS = ["invoice_status", "apply_leave", "leave_policy"]
+
+
+def clustered_vectors(per_intent=20, noise=0.15, seed=0):
+    """Three well separated clusters in 8 dimensions, plus a few points halfway between two."""
+    rng = np.random.default_rng(seed)
+    centers = np.eye(8, dtype=np.float32)[:3]
+    vectors, labels = [], []
+    for center, intent in zip(centers, INTENTS):
+        vectors.append(center + noise * rng.standard_normal((per_intent, 8)))
+        labels += [intent] * per_intent
+    between = (centers[0] + centers[1]) / 2 + noise * rng.standard_normal((4, 8))
+    vectors.append(between)
+    labels += ["invoice_status", "apply_leave"] * 2
+    return np.vstack(vectors).astype(np.float32), labels
+
+
+@pytest.fixture
+def classifier(service):
+    vectors, labels = clustered_vectors()
+    return service.CentroidIntentClassifier(vectors, labels, target_precision=0.95)
+
+
+def test_calibrated_threshold_reaches_target_precision(classifier):
+    calibration = classifier.calibration
+    assert calibration["precision"] >= 0.95
+    assert 0.0 < calibration["coverage"] <= 1.0
+    assert classifier.margin_threshold == calibration["threshold"]
+    accepted = classifier.loo_margins >= classifier.margin_threshold
+    correct = classifier.loo_predictions == classifier.labels
+    assert correct[accepted].mean() >= 0.95
+
+
+def test_unreachable_precision_disables_the_vector_tier(service):
+    vectors, labels = clustered_vectors(noise=2.0)
+    classifier = service.CentroidIntentClassifier(vectors, labels, target_precision=1.01)
+    assert classifier.margin_threshold == float("inf")
+    assert classifier.calibration["coverage"] == 0.0
+
+
+def test_explicit_margin_threshold_overrides_calibration(service):
+    vectors, labels = clustered_vectors()
+    classifier = service.CentroidIntentClassifier(vectors, labels, margin_threshold=0.5)
+    assert classifier.margin_threshold == 0.5
+    assert classifier.calibration["threshold"] != 0.5
+
+
+def test_sweep_coverage_falls_as_the_threshold_rises(classifier):
+    rows = classifier.sweep([0.0, 0.2, 0.4, 0.8])
+    coverages = [row["coverage"] for row in rows]
+    assert coverages == sorted(coverages, reverse=True)
+
+
+def test_predict_ignores_zero_vectors(classifier):
+    assert classifier.predict(np.zeros(8, dtype=np.float32)) is None
+    assert classifier.predict(None) is None
+
+
+def test_cascade_routes_confident_inputs_to_the_vector_tier(service, classifier, monkeypatch):
+    monkeypatch.setattr(service, "EMBEDDING_BACKEND", "spacy")
+    cascade = service.IntentCascade(classifier)
+    transformer_calls = []
+
+    def transformer(text):
+        transformer_calls.append(text)
+        return {"intent": "leave_policy", "confidence": 0.9, "probabilities": [], "id2intent": {}}
+
+    confident = np.eye(8, dtype=np.float32)[1]
+    result = cascade.classify("apply for leave", confident, transformer=transformer)
+    assert (result["tier"], result["intent"]) == ("vector", "apply_leave")
+
+    ambiguous = (np.eye(8, dtype=np.float32)[0] + np.eye(8, dtype=np.float32)[1]) / 2
+    result = cascade.classify("is it leave or invoice", ambiguous, transformer=transformer)
+    assert (result["tier"], result["intent"]) == ("transformer", "leave_policy")
+    assert transformer_calls == ["is it leave or invoice"]
+    assert cascade.stats()["routed"] == {"vector": 1, "transformer": 1}
+
+
+def test_cascade_skips_the_vector_tier_with_the_intent_model_backend(service, classifier, monkeypatch):
+    monkeypatch.setattr(service, "EMBEDDING_BACKEND", "intent_model")
+    cascade = service.IntentCascade(classifier)
+    result = cascade.classify("apply for leave", np.eye(8, dtype=np.float32)[1],
+                              transformer=lambda text: {"intent": "apply_leave", "confidence": 0.8,
+                                                        "probabilities": [], "id2intent": {}})
+    assert result["tier"] == "transformer"
+
+
+def test_cancelled_cascade_skips_the_transformer(service, classifier, monkeypatch):
+    monkeypatch.setattr(service, "EMBEDDING_BACKEND", "spacy")
+    cancelled = threading.Event()
+    cancelled.set()
+    ambiguous = (np.eye(8, dtype=np.float32)[0] + np.eye(8, dtype=np.float32)[1]) / 2
+    assert service.IntentCascade(classifier).classify("is it leave or invoice", ambiguous, transformer=pytest.fail,
+                                                      cancelled=cancelled) is None
@@ -0,0 +1,59 @@
+TEXTS = ["Show my invoice status", "Apply for annual leave", "What is the leave policy?"]
+INTENTS = ["invoice_status", "apply_leave", "leave_policy"]
+
+
+def make_index(service, **kwargs):
+    return service.IntentLookupIndex(TEXTS, INTENTS, **kwargs)
+
+
+def test_exact_match_ignores_case_and_outer_whitespace(service):
+    match = make_index(service).lookup("  show my INVOICE status ")
+    assert match["intent"] == "invoice_status"
+    assert match["match_type"] == "exact"
+    assert match["score"] == 1.0
+
+
+def test_normalized_match_expands_contractions_and_fixes_typos(service):
+    match = make_index(service).lookup("What's the leav polcy")
+    assert match["intent"] == "leave_policy"
+    assert match["match_type"] == "normalized"
+    assert match["matched_text"] == "what is the leave policy"
+
+
+def test_contraction_before_punctuation_is_expanded(service):
+    assert service.normalize_text("I can't.") == service.normalize_text("I can't") == "i cannot"
+    match = service.IntentLookupIndex(["I can't log in"], ["login_issue"]).lookup("i can't, log in")
+    assert (match["intent"], match["match_type"]) == ("login_issue", "normalized")
+
+
+def test_fuzzy_match_at_or_above_threshold(service):
+    match = make_index(service).lookup("show my invoice statuss")
+    assert match["intent"] == "invoice_status"
+    assert match["match_type"] == "fuzzy"
+    assert 0.85 <= match["score"] < 1.0
+
+
+def test_fuzzy_threshold_rejects_weaker_matches(service):
+    index = make_index(service, fuzzy_threshold=0.99)
+    assert index.lookup("show my invoice statuss") is None
+    assert index.counts["miss"] == 1
+
+
+def test_unrelated_text_misses(service):
+    assert make_index(service).lookup("book a meeting room for friday") is None
+
+
+def test_duplicate_normalized_texts_are_indexed_once(service):
+    index = service.IntentLookupIndex(["Show my invoice status", "show my invoice status!"],
+                                      ["invoice_status", "invoice_status"])
+    assert len(index.entries) == 1
+
+
+def test_stats_report_hit_rates_per_match_type(service):
+    index = make_index(service)
+    for text in ("Show my invoice status", "whats the leave policy", "show my invoice statuss", "hello"):
+        index.lookup(text)
+    stats = index.stats()
+    assert stats["lookups"] == 4
+    assert stats["counts"] == {"exact": 1, "normalized": 1, "fuzzy": 1, "miss": 1}
+    assert stats["hit_rates"]["fuzzy"] == 0.25
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+
+
+def test_drain_waits_for_in_flight_requests(service):
+    gate = service.RequestGate()
+
+    async def scenario():
+        await gate.enter()
+        assert not gate.drain(0.01)
+        threading.Timer(0.05, gate.exit).start()
+        return await asyncio.to_thread(gate.drain, 1)
+
+    assert asyncio.run(scenario())
+    assert gate.in_flight == 0
+
+
+def test_held_requests_enter_on_reopen(service):
+    gate = service.RequestGate()
+
+    async def scenario():
+        assert gate.drain(0.01)
+        held = asyncio.ensure_future(gate.enter())
+        await asyncio.sleep(0.02)
+        assert not held.done() and gate.in_flight == 0
+        await asyncio.to_thread(gate.reopen)
+        await asyncio.wait_for(held, 1)
+        return gate.in_flight
+
+    assert asyncio.run(scenario()) == 1
+    assert gate.requests == 1
+
+
+def test_cancelled_waiter_is_forgotten(service):
+    gate = service.RequestGate()
+
+    async def scenario():
+        gate.drain(0.01)
+        held = asyncio.ensure_future(gate.enter())
+        await asyncio.sleep(0)
+        held.cancel()
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert gate._waiters == [] and gate.in_flight == 0
+
+
+def test_streamed_body_holds_the_gate(service, monkeypatch):
+    from fastapi.testclient import TestClient
+    from starlette.responses import StreamingResponse
+
+    gate = service.RequestGate()
+    monkeypatch.setattr(service, "request_gate", gate)
+    seen = []
+
+    async def body():
+        for chunk in (b"a", b"b"):
+            seen.append(gate.in_flight)
+            yield chunk
+
+    path = "/test-gate-stream"
+    service.app.add_api_route(path, lambda: StreamingResponse(body()), methods=["GET"])
+    try:
+        assert TestClient(service.app).get(path).content == b"ab"
+    finally:
+        service.app.router.routes[:] = [r for r in service.app.router.routes if getattr(r, "path", None) != path]
+    assert seen == [1, 1]
+    assert gate.in_flight == 0
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def pool(service, monkeypatch):
+    pool = service.WorkerPool("race-test", 1)
+    monkeypatch.setattr(service, "model_pool", pool)
+    monkeypatch.setattr(service.config.execution_config, "enabled", True)
+    yield pool
+    pool._executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def busy(pool):
+    """Holds the pool's only worker until set, so every stage of a race stays queued."""
+    release = threading.Event()
+    pool.submit(release.wait, 5)
+    yield release
+    release.set()
+
+
+def recorder(ran):
+    def stage(name, value):
+        ran.append((name, threading.current_thread().name))
+        return value
+    return stage
+
+
+def test_results_by_name(service, pool):
+    ran = []
+    stage = recorder(ran)
+    race = service.StageRace({"a": (stage, "a", 1), "b": (stage, "b", 2), "c": (stage, "c", 3)})
+    assert [race.result(name) for name in ("c", "a", "b")] == [3, 1, 2]
+    assert race.result("c") == 3
+    assert sorted(name for name, _ in ran) == ["a", "b", "c"]
+
+
+def test_queued_stage_is_taken_back(service, pool, busy):
+    ran = []
+    inline = service.stage_race_stats['inline']
+    race = service.StageRace({"a": (recorder(ran), "a", 1)})
+    assert race.result("a") == 1
+    assert ran == [("a", threading.current_thread().name)]
+    assert service.stage_race_stats['inline'] == inline + 1
+    assert pool.stats()['cancelled'] == 1
+
+
+def slow_stage(started):
+    def slow():
+        started.set()
+        time.sleep(0.1)
+        return "slow"
+    return slow
+
+
+def test_waiting_on_a_decisive_stage_runs_nothing_else(service, pool):
+    ran = []
+    started = threading.Event()
+    race = service.StageRace({"kb": (slow_stage(started),), "b": (recorder(ran), "b", 2)}, decisive=("kb",))
+    started.wait(1)
+    assert race.result("kb") == "slow"
+    assert ("b", threading.current_thread().name) not in ran  # b waited for the worker
+    race.cancel()
+
+
+def test_waiting_on_a_settled_race_runs_queued_stages(service, pool):
+    ran = []
+    started = threading.Event()
+    race = service.StageRace({"slow": (slow_stage(started),), "b": (recorder(ran), "b", 2)})
+    started.wait(1)
+    assert race.result("slow") == "slow"
+    assert ran == [("b", threading.current_thread().name)]  # ran while slow held the worker
+    assert race.result("b") == 2
+
+
+def test_cancel_stops_later_steps_of_started_stages(service, pool):
+    deadline = service.Deadline()
+    steps = []
+
+    def stage():
+        started.set()
+        proceed.wait(1)
+        return deadline.run("entities", "skipped", steps.append, "entities")
+
+    started, proceed = threading.Event(), threading.Event()
+    race = service.StageRace({"entities": (stage,), "later": (steps.append, "later")}, cancelled=deadline.cancelled)
+    started.wait(1)
+    race.cancel()
+    proceed.set()
+    pool._executor.shutdown(wait=True)
+    assert race._futures["entities"].result() == "skipped"
+    assert steps == []
+    assert deadline.skipped == []  # a cancelled stage is not a budget skip
+
+
+def test_first_decisive_cancels_the_rest(service, pool, busy):
+    ran = []
+    stage = recorder(ran)
+    cancelled = service.stage_race_stats['cancelled']
+    race = service.StageRace({"kb": (stage, "kb", 0.9), "intent": (stage, "intent", "i"),
+                              "history": (stage, "history", [])})
+    assert race.first_decisive([("kb", lambda score: score >= 0.8), ("intent", None)]) == ("kb", 0.9)
+    busy.set()
+    time.sleep(0.05)
+    assert [name for name, _ in ran] == ["kb"]
+    assert service.stage_race_stats['cancelled'] == cancelled + 2
+    assert service.stage_race_stats['decided_by']['kb'] >= 1
+
+
+def test_first_decisive_falls_through(service, pool):
+    stage = recorder([])
+    race = service.StageRace({"kb": (stage, "kb", 0.2), "intent": (stage, "intent", "i")})
+    assert race.first_decisive([("kb", lambda score: score >= 0.8), ("intent", None)]) == ("intent", "i")
+    assert race.first_decisive([("kb", lambda score: score >= 0.8)]) == (None, None)
+
+
+def test_disabled_pools_run_stages_lazily_in_order(service, pool, monkeypatch):
+    monkeypatch.setattr(service.config.execution_config, "enabled", False)
+    ran = []
+    stage = recorder(ran)
+    race = service.StageRace({"a": (stage, "a", 1), "b": (stage, "b", 2)})
+    assert ran == []
+    assert race.first_decisive([("a", lambda value: value > 1), ("b", None)]) == ("b", 2)
+    assert [name for name, _ in ran] == ["a", "b"]
+    assert pool.stats()['submitted'] == 0
@@ -1,68 +1,233 @@
+import argparse
+import json
+import os
+import re
+import time
 import pandas as pd
-from datasets import Dataset, ClassLabel
+from datasets import Dataset
 from transformers import AutoTokenizer, AutoModelForSequenceClassification, TrainingArguments, Trainer
 import numpy as np
 import torch
+import torch.nn.functional as F
 
-# 1. Load your CSV
-df = pd.read_csv("erp_intents.csv")
-df = df.dropna(subset=["text", "intent"])
-df = df.reset_index(drop=True)
-
-# 2. Encode intent labels
-unique_intents = sorted(df["intent"].unique())
-intent2id = {intent: i for i, intent in enumerate(unique_intents)}
-id2intent = {i: intent for intent, i in intent2id.items()}
-df["label"] = df["intent"].map(intent2id)
-
-# 3. Convert to HuggingFace Dataset
-dataset = Dataset.from_pandas(df[["text", "label"]])
-
-# 4. Tokenize
-tokenizer = AutoTokenizer.from_pretrained("distilbert-base-uncased")
-def tokenize(batch):
-    return tokenizer(batch["text"], truncation=True, padding="max_length", max_length=64)
-dataset = dataset.map(tokenize, batched=True)
-
-# 5. Train/Test Split (optional, here we use all for training)
-train_dataset = dataset
-
-# 6. Model
-model = AutoModelForSequenceClassification.from_pretrained(
-    "distilbert-base-uncased", num_labels=len(unique_intents)
-)
-
-# 7. Training Arguments
-training_args = TrainingArguments(
-    output_dir="./intent_model",
-    num_train_epochs=4,
-    per_device_train_batch_size=8,
-    logging_dir="./logs",
-    learning_rate=2e-5,
-    weight_decay=0.01,
-    save_total_limit=1,  # Only keep the last checkpoint
-)
-
-# 8. Trainer
-trainer = Trainer(
-    model=model,
-    args=training_args,
-    train_dataset=train_dataset,
-    tokenizer=tokenizer,
-)
-
-# 9. Train
-trainer.train()
-
-# 10. Save model and tokenizer
-model.save_pretrained("./intent_model")
-tokenizer.save_pretrained("./intent_model")
-
-# 11. Save label mapping
-import json
-with open("./intent_model/id2intent.json", "w") as f:
-    json.dump(id2intent, f)
-with open("./intent_model/intent2id.json", "w") as f:
-    json.dump(intent2id, f)
+TEACHER_MODEL_PATH = "../erp-nlp-service/erp-nlp-service/intent_model"
+
+
+def train_intent_classifier():
+    # 1. Load your CSV
+    df = pd.read_csv("erp_intents.csv")
+    df = df.dropna(subset=["text", "intent"])
+    df = df.reset_index(drop=True)
+
+    # 2. Encode intent labels
+    unique_intents = sorted(df["intent"].unique())
+    intent2id = {intent: i for i, intent in enumerate(unique_intents)}
+    id2intent = {i: intent for intent, i in intent2id.items()}
+    df["label"] = df["intent"].map(intent2id)
+
+    # 3. Convert to HuggingFace Dataset
+    dataset = Dataset.from_pandas(df[["text", "label"]])
+
+    # 4. Tokenize
+    tokenizer = AutoTokenizer.from_pretrained("distilbert-base-uncased")
+    def tokenize(batch):
+        return tokenizer(batch["text"], truncation=True, padding="max_length", max_length=64)
+    dataset = dataset.map(tokenize, batched=True)
+
+    # 5. Train/Test Split (optional, here we use all for training)
+    train_dataset = dataset
+
+    # 6. Model
+    model = AutoModelForSequenceClassification.from_pretrained(
+        "distilbert-base-uncased", num_labels=len(unique_intents)
+    )
+
+    # 7. Training Arguments
+    training_args = TrainingArguments(
+        output_dir="./intent_model",
+        num_train_epochs=4,
+        per_device_train_batch_size=8,
+        logging_dir="./logs",
+        learning_rate=2e-5,
+        weight_decay=0.01,
+        save_total_limit=1,  # Only keep the last checkpoint
+    )
+
+    # 8. Trainer
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        train_dataset=train_dataset,
+        tokenizer=tokenizer,
+    )
+
+    # 9. Train
+    trainer.train()
+
+    # 10. Save model and tokenizer
+    model.save_pretrained("./intent_model")
+    tokenizer.save_pretrained("./intent_model")
+
+    # 11. Save label mapping
+    with open("./intent_model/id2intent.json", "w") as f:
+        json.dump(id2intent, f)
+    with open("./intent_model/intent2id.json", "w") as f:
+        json.dump(intent2id, f)
+
+    print("Training complete. Model and tokenizer saved in ./intent_model/")
+
+
+def build_student_from_teacher(teacher, num_layers):
+    """Create a shallower copy of the teacher, initialised from evenly spaced teacher layers."""
+    teacher_layers = teacher.config.n_layers
+    keep = np.linspace(0, teacher_layers - 1, num_layers).round().astype(int).tolist()
+    student_config = teacher.config.__class__.from_dict(teacher.config.to_dict())
+    student_config.n_layers = num_layers
+    student = AutoModelForSequenceClassification.from_config(student_config)
+
+    layer_map = {str(t): str(s) for s, t in enumerate(keep)}
+    layer_re = re.compile(r"(distilbert\.transformer\.layer\.)(\d+)(\..*)")
+    state = {}
+    for name, tensor in teacher.state_dict().items():
+        match = layer_re.match(name)
+        if match:
+            if match.group(2) not in layer_map:
+                continue
+            name = f"{match.group(1)}{layer_map[match.group(2)]}{match.group(3)}"
+        state[name] = tensor.clone()
+    student.load_state_dict(state)
+    print(f"Student initialised with teacher layers {keep} ({num_layers}/{teacher_layers})")
+    return student
+
+
+def predict_labels(model, tokenizer, texts, batch_size=32):
+    model.eval()
+    preds = []
+    with torch.no_grad():
+        for i in range(0, len(texts), batch_size):
+            inputs = tokenizer(texts[i:i + batch_size], return_tensors="pt", truncation=True, padding=True, max_length=64)
+            preds.extend(model(**inputs).logits.argmax(dim=1).tolist())
+    return np.array(preds)
+
+
+def cpu_latency_ms(model, tokenizer, texts, batch_size, runs=20):
+    """Median wall-clock latency of one forward pass over a batch of the given size."""
+    model.eval()
+    batch = (texts * ((batch_size // max(len(texts), 1)) + 1))[:batch_size]
+    inputs = tokenizer(batch, return_tensors="pt", truncation=True, padding=True, max_length=64)
+    timings = []
+    with torch.no_grad():
+        model(**inputs)  # warm-up
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(**inputs)
+            timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def model_size_mb(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)
+               if f.endswith((".safetensors", ".bin"))) / (1024 * 1024)
+
+
+def distill_intent_classifier(teacher_path, output_dir, num_layers, epochs, temperature, alpha, learning_rate):
+    # 1. Load the CSV with the teacher's own label ids
+    df = pd.read_csv("erp_intents.csv")
+    df = df.dropna(subset=["text", "intent"]).reset_index(drop=True)
+    with open(os.path.join(teacher_path, "intent2id.json"), "r") as f:
+        intent2id = json.load(f)
+    with open(os.path.join(teacher_path, "id2intent.json"), "r") as f:
+        id2intent = json.load(f)
+    df = df[df["intent"].isin(intent2id)].reset_index(drop=True)
+    texts = df["text"].astype(str).tolist()
+    labels = torch.tensor(df["intent"].map(intent2id).tolist())
+
+    # 2. Teacher and student (student reuses a subset of the teacher's layers, no download)
+    tokenizer = AutoTokenizer.from_pretrained(teacher_path)
+    teacher = AutoModelForSequenceClassification.from_pretrained(teacher_path)
+    teacher.eval()
+    student = build_student_from_teacher(teacher, num_layers)
+
+    # 3. Soft targets from the teacher
+    with torch.no_grad():
+        teacher_logits = torch.cat([
+            teacher(**tokenizer(texts[i:i + 32], return_tensors="pt", truncation=True, padding=True, max_length=64)).logits
+            for i in range(0, len(texts), 32)
+        ])
+
+    # 4. Distillation loop: KL on softened logits plus cross-entropy on the labels (dynamic padding)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=learning_rate, weight_decay=0.01)
+    generator = torch.Generator().manual_seed(0)
+    batch_size = 16
+    for epoch in range(epochs):
+        student.train()
+        order = torch.randperm(len(texts), generator=generator).tolist()
+        total_loss = 0.0
+        for i in range(0, len(order), batch_size):
+            idx = order[i:i + batch_size]
+            inputs = tokenizer([texts[j] for j in idx], return_tensors="pt", truncation=True, padding=True, max_length=64)
+            logits = student(**inputs).logits
+            soft_loss = F.kl_div(F.log_softmax(logits / temperature, dim=1),
+                                 F.softmax(teacher_logits[idx] / temperature, dim=1),
+                                 reduction="batchmean") * temperature ** 2
+            hard_loss = F.cross_entropy(logits, labels[idx])
+            loss = alpha * soft_loss + (1 - alpha) * hard_loss
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(idx)
+        print(f"Epoch {epoch + 1}/{epochs} - loss {total_loss / len(texts):.4f}")
+
+    # 5. Save student in the same layout the service loads (IntentConfig.model_path)
+    os.makedirs(output_dir, exist_ok=True)
+    student.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, "id2intent.json"), "w") as f:
+        json.dump(id2intent, f)
+    with open(os.path.join(output_dir, "intent2id.json"), "w") as f:
+        json.dump(intent2id, f)
+
+    # 6. Side-by-side report: accuracy, size and CPU latency at batch 1 and 32
+    teacher_preds = predict_labels(teacher, tokenizer, texts)
+    student_preds = predict_labels(student, tokenizer, texts)
+    report = {"samples": len(texts), "note": "accuracy is measured on erp_intents.csv, which both models trained on"}
+    for name, model, preds, path in (("teacher", teacher, teacher_preds, teacher_path),
+                                     ("student", student, student_preds, output_dir)):
+        report[name] = {
+            "path": path,
+            "layers": model.config.n_layers,
+            "parameters_m": sum(p.numel() for p in model.parameters()) / 1e6,
+            "size_mb": model_size_mb(path),
+            "accuracy": float((preds == labels.numpy()).mean()),
+            "latency_ms_batch1": cpu_latency_ms(model, tokenizer, texts, 1),
+            "latency_ms_batch32": cpu_latency_ms(model, tokenizer, texts, 32),
+        }
+    report["student"]["agreement_with_teacher"] = float((student_preds == teacher_preds).mean())
+    with open(os.path.join(output_dir, "distillation_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'metric':<22}{'teacher':>12}{'student':>12}")
+    for key in ("layers", "parameters_m", "size_mb", "accuracy", "latency_ms_batch1", "latency_ms_batch32"):
+        print(f"{key:<22}{report['teacher'][key]:>12.3f}{report['student'][key]:>12.3f}")
+    print(f"{'agreement':<22}{'':>12}{report['student']['agreement_with_teacher']:>12.3f}")
+    print(f"\nDistillation complete. Student saved in {output_dir}/ "
+          f"(point IntentConfig.model_path at it to serve it)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fine-tune or distill the ERP intent classifier")
+    parser.add_argument("--distill", action="store_true", help="Distill a smaller student from the trained intent_model")
+    parser.add_argument("--teacher", default=TEACHER_MODEL_PATH, help="Path of the teacher intent_model")
+    parser.add_argument("--output", default="./intent_model_student", help="Where to save the student")
+    parser.add_argument("--student-layers", type=int, default=2, help="Number of transformer layers in the student")
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--alpha", type=float, default=0.7, help="Weight of the soft (teacher) loss")
+    parser.add_argument("--learning-rate", type=float, default=5e-5)
+    args = parser.parse_args()
 
-print("Training complete. Model and tokenizer saved in ./intent_model/")
\ No newline at end of file
+    if args.distill:
+        distill_intent_classifier(args.teacher, args.output, args.student_layers, args.epochs,
+                                  args.temperature, args.alpha, args.learning_rate)
+    else:
+        train_intent_classifier()